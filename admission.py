@@ -0,0 +1,304 @@
+"""Digital Wallet admission control and request deadlines
+
+Under overload every request used to queue for a worker thread and a
+pooled connection, so latency grew without bound until all requests
+timed out together. ``AdmissionMiddleware`` (installed by ``main``)
+instead runs at most ADMISSION_READ_CONCURRENCY GET requests and
+ADMISSION_WRITE_CONCURRENCY other requests (the money-moving and user
+writes) at once. Up to ADMISSION_*_QUEUE more wait, first come first
+served, for at most ADMISSION_QUEUE_TIMEOUT seconds; anything beyond is
+turned away at once with ``503`` and ``Retry-After``, so admitted
+requests keep their latency and clients back off.
+
+The write limit defaults to the pool size because each write holds a
+pooled connection. With ``GROUP_COMMIT=1`` the money-moving writes
+instead wait on the single group writer without one, and a limit that
+low would cap every batch at a few operations; the default is then two
+batches' worth (2 x GROUP_COMMIT_MAX_OPS), one committing while the
+next gathers.
+
+Each admitted request also gets a deadline, REQUEST_TIMEOUT seconds
+after arrival or sooner when the client sends ``X-Request-Timeout``. It
+bounds the wait for admission, and ``install_deadlines`` carries it to
+the database: no statement starts after the deadline, and on SQLite a
+running statement is interrupted by the connection's progress handler.
+The request then fails with ``DeadlineExceeded``, answered ``503``, and
+its transaction is rolled back; commits are never interrupted, and a
+request whose transaction has committed calls ``disarm`` so its
+remaining reads cannot turn a success into a ``503``.
+Streaming exports hold a read slot until their last byte but have no
+deadline.
+
+    ADMISSION_READ_CONCURRENCY   GET requests running at once (default
+                                 DB_POOL_SIZE + DB_MAX_OVERFLOW, 0 = unlimited)
+    ADMISSION_WRITE_CONCURRENCY  other requests running at once (default
+                                 DB_POOL_SIZE, or 2 x GROUP_COMMIT_MAX_OPS with
+                                 GROUP_COMMIT=1; 0 = unlimited)
+    ADMISSION_READ_QUEUE         GET requests waiting for admission (default 64)
+    ADMISSION_WRITE_QUEUE        other requests waiting for admission (default 32)
+    ADMISSION_QUEUE_TIMEOUT      seconds a request may wait for admission (default 0.5)
+    ADMISSION_RETRY_AFTER        Retry-After seconds sent with a 503 (default 1)
+    REQUEST_TIMEOUT              seconds from arrival to the deadline (default 10, 0 = none)
+"""
+
+import asyncio
+import contextvars
+import inspect
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.util import await_
+
+import db_config
+import group_commit
+from metrics import Histogram
+
+ADMISSION_READ_CONCURRENCY = int(os.getenv("ADMISSION_READ_CONCURRENCY",
+                                           str(db_config.POOL_SIZE + db_config.MAX_OVERFLOW)))
+ADMISSION_WRITE_CONCURRENCY = int(os.getenv(
+    "ADMISSION_WRITE_CONCURRENCY",
+    str(2 * group_commit.GROUP_COMMIT_MAX_OPS if group_commit.GROUP_COMMIT else db_config.POOL_SIZE)))
+ADMISSION_READ_QUEUE = int(os.getenv("ADMISSION_READ_QUEUE", "64"))
+ADMISSION_WRITE_QUEUE = int(os.getenv("ADMISSION_WRITE_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "0.5"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "10"))
+
+QUEUE_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Paths neither limited nor given a deadline.
+EXEMPT_PATHS = frozenset({"/", "/metrics", "/docs", "/openapi.json"})
+
+# SQLite virtual-machine instructions between deadline checks of a running statement.
+PROGRESS_INSTRUCTIONS = 10000
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before its database work finished."""
+
+
+def unavailable(detail: str) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=503,
+                        headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+
+
+"""concurrency limits"""
+
+class Limiter:
+    """At most ``limit`` requests at once (0: unlimited), the rest in a bounded FIFO queue.
+
+    Only used from the event loop, so no lock is needed. A released slot
+    passes straight to the oldest waiter, so a waiter cannot be overtaken
+    by a request that arrives later.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self.admitted = 0
+        self.shed: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0}
+        self.queue_wait = Histogram(QUEUE_WAIT_BUCKETS)
+
+    async def acquire(self, timeout: float) -> bool:
+        """Take a slot, waiting at most ``timeout`` seconds; False if the request is shed."""
+        if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            self.admitted += 1
+            self.queue_wait.observe(0.0)
+            return True
+        if len(self._waiters) >= self.queue_size or timeout <= 0:
+            self.shed["queue_full"] += 1
+            return False
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        started = loop.time()
+        expiry = loop.call_later(timeout, self._expire, waiter)
+        try:
+            admitted = await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+        finally:
+            expiry.cancel()
+        if not admitted:
+            self.shed["queue_timeout"] += 1
+            return False
+        self.admitted += 1
+        self.queue_wait.observe(loop.time() - started)
+        return True
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def _expire(self, waiter: asyncio.Future):
+        if not waiter.done():
+            self._remove(waiter)
+            waiter.set_result(False)
+
+    def _remove(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def stats(self) -> Dict[str, object]:
+        return {"in_flight": self.active, "queue_depth": len(self._waiters), "admitted": self.admitted,
+                "shed": dict(self.shed), "queue_wait_seconds": self.queue_wait.snapshot()}
+
+
+read_limiter = Limiter("read", ADMISSION_READ_CONCURRENCY, ADMISSION_READ_QUEUE)
+write_limiter = Limiter("write", ADMISSION_WRITE_CONCURRENCY, ADMISSION_WRITE_QUEUE)
+
+
+def limiters() -> List[Limiter]:
+    return [read_limiter, write_limiter]
+
+
+def limiter_for(method: str, path: str) -> Optional[Limiter]:
+    if path in EXEMPT_PATHS:
+        return None
+    return read_limiter if method in ("GET", "HEAD") else write_limiter
+
+
+"""deadlines"""
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("wallet_request_deadline", default=None)
+
+deadlines_exceeded = 0
+
+
+def deadline() -> Optional[float]:
+    """The current request's deadline on the ``time.monotonic`` clock, if any."""
+    return _deadline.get()
+
+
+def disarm():
+    """Drop the current request's deadline once its transaction has committed."""
+    _deadline.set(None)
+
+
+def request_timeout(header: Optional[str]) -> Optional[float]:
+    """REQUEST_TIMEOUT, or the client's ``X-Request-Timeout`` when shorter."""
+    timeout = REQUEST_TIMEOUT if REQUEST_TIMEOUT > 0 else None
+    try:
+        requested = float(header) if header else None
+    except ValueError:
+        requested = None
+    if requested is not None and requested > 0 and (timeout is None or requested < timeout):
+        timeout = requested
+    return timeout
+
+
+def _expired(expires_at: Optional[float]) -> bool:
+    return expires_at is not None and time.monotonic() >= expires_at
+
+
+def _exceeded() -> DeadlineExceeded:
+    global deadlines_exceeded
+    deadlines_exceeded += 1
+    return DeadlineExceeded("request deadline exceeded")
+
+
+def _install_progress_handler(dbapi_connection, connection_record):
+    # A one-item list shared with the handler, which runs on whatever thread
+    # executes the statement (aiosqlite's own thread for the async engines).
+    armed = connection_record.info["deadline"] = [None]
+
+    def interrupt_when_expired():
+        return 1 if _expired(armed[0]) else 0
+
+    driver = getattr(dbapi_connection, "driver_connection", dbapi_connection)
+    result = driver.set_progress_handler(interrupt_when_expired, PROGRESS_INSTRUCTIONS)
+    if inspect.isawaitable(result):
+        await_(result)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    expires_at = _deadline.get()
+    if _expired(expires_at):
+        raise _exceeded()
+    armed = conn.info.get("deadline")
+    if armed is not None:
+        armed[0] = expires_at
+
+
+def _disarm(conn, *args):
+    armed = conn.info.get("deadline")
+    if armed is not None:
+        armed[0] = None
+
+
+def _handle_error(context):
+    if context.connection is None:
+        return
+    armed = context.connection.info.get("deadline")
+    expires_at = armed[0] if armed is not None else None
+    _disarm(context.connection)
+    if _expired(expires_at) and "interrupted" in str(context.original_exception):
+        raise _exceeded() from context.original_exception
+
+
+def install_deadlines(engine):
+    """Refuse statements past the request deadline and, on SQLite, interrupt running ones."""
+    if isinstance(engine, AsyncEngine):
+        engine = engine.sync_engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _disarm)
+    event.listen(engine, "handle_error", _handle_error)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _install_progress_handler)
+    return engine
+
+
+"""middleware"""
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting each HTTP request through its limiter and setting its deadline.
+
+    Plain ASGI rather than ``BaseHTTPMiddleware`` so a shed request costs
+    next to nothing and a slot is held until the response is fully sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limiter = limiter_for(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if limiter is None:
+            return await self.app(scope, receive, send)
+        timeout = request_timeout(_header(scope, b"x-request-timeout"))
+        wait = limiter.queue_timeout if timeout is None else min(limiter.queue_timeout, timeout)
+        expires_at = None if timeout is None or scope["path"].endswith("/export") else time.monotonic() + timeout
+        if not await limiter.acquire(wait):
+            return await unavailable("Server overloaded, retry later")(scope, receive, send)
+        token = _deadline.set(expires_at)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+            limiter.release()
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
@@ -0,0 +1,348 @@
+"""Digital Wallet cold storage
+
+Ledger rows older than a cutoff move out of the hot ``transactions`` table
+into ``archive.transactions``, a table of the same shape in a separate
+SQLite file (``db_config.ARCHIVE_PATH``) that is ATTACHed to every SQLite
+connection. The hot table and its indexes stay sized to recent activity,
+while history, export, single-row lookups, balance-at-a-time and
+reconciliation read both sides and merge them, so moving a row is
+invisible to clients.
+
+``archive_transactions`` moves rows month by month in batches. Each batch
+is first copied, together with a manifest row in ``archive.archive_batches``
+holding its row count, amount total and a SHA-256 checksum of its rows,
+and committed. A second transaction re-reads the copy, checks it against
+the manifest and only then deletes the rows from the hot table. Commits
+spanning the two files are not atomic under WAL, so the job never relies
+on them: a batch whose delete did not land is finished on the next run.
+
+Only rows that no longer change are moved: rows with ``balance_after``
+(the job backfills it first, see ``balance_history``), with no undelivered
+outbox event, and transfer legs only together with the rest of their
+transfer group.
+
+    ARCHIVE_AFTER_DAYS   age in days past which rows are archived (default 365)
+    ARCHIVE_BATCH_SIZE   rows moved per batch (default 5000)
+"""
+
+import hashlib
+import math
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import (
+    Column, DateTime, Float, Index, Integer, MetaData, String, Table, bindparam, delete, exists, func, insert,
+    select, tuple_, update,
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, aliased
+
+import balance_history
+import db_config
+from models import OutboxEvent, Transaction, TransactionType
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+archive_metadata = MetaData(schema="archive")
+
+archived_transactions = Table(
+    "transactions",
+    archive_metadata,
+    *(Column(column.name, column.type.copy(), primary_key=column.primary_key, nullable=column.nullable)
+      for column in Transaction.__table__.columns),
+    Column("archive_batch", Integer, nullable=False),
+    Index("ix_archive_transactions_user_created_id", "user_id", "created_at", "id"),
+    Index("ix_archive_transactions_transfer_group", "transfer_group"),
+    Index("ix_archive_transactions_batch", "archive_batch"),
+)
+
+archive_batches = Table(
+    "archive_batches",
+    archive_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("period", String(7), nullable=False),
+    Column("first_id", Integer, nullable=False),
+    Column("last_id", Integer, nullable=False),
+    Column("rows", Integer, nullable=False),
+    Column("amount_total", Float, nullable=False),
+    Column("checksum", String(64), nullable=False),
+    Column("copied_at", DateTime, nullable=False),
+    Column("deleted_at", DateTime, nullable=True),
+)
+
+# The archive table's columns in the hot table's order, without archive_batch.
+ARCHIVED_COLUMNS = [archived_transactions.c[column.name] for column in Transaction.__table__.columns]
+
+
+class ArchiveChecksumError(RuntimeError):
+    """An archived batch no longer matches the checksum taken when it was copied."""
+
+
+def enabled() -> bool:
+    return db_config.ARCHIVE_PATH is not None
+
+
+def configure(path: Optional[str]):
+    """Switch the archive file; pooled connections re-attach on next checkout."""
+    db_config.ARCHIVE_PATH = path
+
+
+def ensure_archive_schema(engine: Engine):
+    """Create the archive tables, with the main database's WAL journal mode."""
+    if not enabled() or engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        archive_metadata.create_all(conn)
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA main.journal_mode").scalar() == "wal":
+            conn.exec_driver_sql("PRAGMA archive.journal_mode=WAL")
+
+
+def has_tables(engine: Engine) -> bool:
+    if not enabled() or engine.dialect.name != "sqlite":
+        return False
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(
+            "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'transactions'"
+        ).first() is not None
+
+
+def as_transaction(row) -> Transaction:
+    """A transient ``Transaction`` for an archived row; never added to a session."""
+    return Transaction(**{column.name: row._mapping[column] for column in ARCHIVED_COLUMNS})
+
+
+"""read statements"""
+
+def page_stmt(user_id: int, before: Optional[Tuple[datetime, int]], limit: int,
+              transaction_type: Optional[TransactionType] = None, names: Optional[Iterable[str]] = None):
+    """Newest-first archived rows of a user strictly older than ``before``.
+
+    Selects ``ARCHIVED_COLUMNS``, or the columns called ``names`` in that order.
+    """
+    table = archived_transactions
+    columns = ARCHIVED_COLUMNS if names is None else [table.c[name] for name in names]
+    stmt = select(*columns).where(table.c.user_id == user_id)
+    if transaction_type is not None:
+        stmt = stmt.where(table.c.transaction_type == transaction_type)
+    if before is not None:
+        stmt = stmt.where(tuple_(table.c.created_at, table.c.id) < tuple_(*before))
+    return stmt.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit)
+
+
+def transaction_stmt(transaction_id: int):
+    return select(*ARCHIVED_COLUMNS).where(archived_transactions.c.id == transaction_id)
+
+
+def transfer_legs_stmt(transaction_id: int):
+    """Archived counterpart of ``crud.transfer_legs_stmt``, without the users."""
+    table = archived_transactions
+    group = select(table.c.transfer_group).where(table.c.id == transaction_id).scalar_subquery()
+    return (
+        select(*ARCHIVED_COLUMNS)
+        .where((table.c.id == transaction_id) | (table.c.transfer_group == group))
+        .where(table.c.transaction_type.in_([TransactionType.TRANSFER_OUT, TransactionType.TRANSFER_IN]))
+        .order_by(table.c.id)
+    )
+
+
+def export_stmt(columns: Iterable, user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Oldest-first archived rows for ``export``, as the hot ``columns``.
+
+    Skips rows still present in the hot table, which happens only between
+    the two steps of a batch, so each row is exported once.
+    """
+    table = archived_transactions
+    hot = aliased(Transaction)
+    stmt = (
+        select(*(table.c[column.key] for column in columns))
+        .where(table.c.user_id == user_id)
+        .where(~exists().where(hot.id == table.c.id))
+    )
+    if start is not None:
+        stmt = stmt.where(table.c.created_at >= start)
+    if end is not None:
+        stmt = stmt.where(table.c.created_at < end)
+    return stmt.order_by(table.c.created_at, table.c.id)
+
+
+def latest_row_stmt(user_id: int, at: datetime):
+    """The user's last archived row at or before ``at``; archived rows are all checkpoints."""
+    table = archived_transactions
+    return (
+        select(table.c.id, table.c.created_at, table.c.balance_after)
+        .where(table.c.user_id == user_id, table.c.created_at <= at)
+        .order_by(table.c.created_at.desc(), table.c.id.desc())
+        .limit(1)
+    )
+
+
+def first_row_after_stmt(user_id: int, at: datetime):
+    table = archived_transactions
+    return (
+        select(table.c.id, table.c.created_at, table.c.balance_after)
+        .where(table.c.user_id == user_id, table.c.created_at > at)
+        .order_by(table.c.created_at, table.c.id)
+        .limit(1)
+    )
+
+
+def ledger_stmt(lo: int, hi: int):
+    """Archived rows of users ``lo <= id < hi`` in the shape reconciliation aggregates."""
+    table = archived_transactions
+    return (
+        select(table.c.user_id, table.c.transaction_type, table.c.amount)
+        .where(table.c.user_id >= lo, table.c.user_id < hi)
+    )
+
+
+"""archival job"""
+
+def checksum(rows) -> str:
+    """SHA-256 over rows of ``ARCHIVED_COLUMNS``, in the order given."""
+    digest = hashlib.sha256()
+    for row in rows:
+        values = [value.value if isinstance(value, TransactionType) else value for value in row]
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+        digest.update(repr(values).encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def candidates_stmt(start: datetime, end: datetime, cutoff: datetime, batch_size: int):
+    """Up to ``batch_size`` settled hot rows created in ``[start, end)``, by id."""
+    leg = aliased(Transaction)
+    unsettled = (
+        (leg.created_at >= cutoff)
+        | leg.balance_after.is_(None)
+        | exists().where(OutboxEvent.transaction_id == leg.id)
+    )
+    return (
+        select(*Transaction.__table__.columns)
+        .where(Transaction.created_at >= start, Transaction.created_at < end)
+        .where(Transaction.balance_after.is_not(None))
+        .where(~exists().where(OutboxEvent.transaction_id == Transaction.id))
+        .where(~exists().where(leg.transfer_group == Transaction.transfer_group, unsettled))
+        .order_by(Transaction.id)
+        .limit(batch_size)
+    )
+
+
+def _month_start(at: datetime) -> datetime:
+    return datetime(at.year, at.month, 1)
+
+
+def periods(db: Session, cutoff: datetime) -> Iterator[Tuple[datetime, datetime]]:
+    """Calendar months ``[start, end)`` from the oldest hot row up to ``cutoff``."""
+    oldest = db.scalar(select(func.min(Transaction.created_at)).where(Transaction.created_at < cutoff))
+    if oldest is None:
+        return
+    start = _month_start(oldest)
+    while start < cutoff:
+        end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+        yield start, min(end, cutoff)
+        start = end
+
+
+def copy_batch(db: Session, start: datetime, end: datetime, cutoff: datetime,
+               batch_size: int = ARCHIVE_BATCH_SIZE) -> Optional[int]:
+    """Copy one batch into the archive with its manifest row; returns the batch id."""
+    rows = db.execute(candidates_stmt(start, end, cutoff, batch_size)).all()
+    if not rows:
+        db.rollback()
+        return None
+    batch_id = db.execute(insert(archive_batches).values(
+        period=start.strftime("%Y-%m"),
+        first_id=rows[0].id,
+        last_id=rows[-1].id,
+        rows=len(rows),
+        amount_total=math.fsum(row.amount for row in rows),
+        checksum=checksum(rows),
+        copied_at=datetime.utcnow(),
+    )).inserted_primary_key[0]
+    db.execute(insert(archived_transactions), [dict(row._mapping, archive_batch=batch_id) for row in rows])
+    db.commit()
+    return batch_id
+
+
+def finish_batch(db: Session, batch_id: int) -> int:
+    """Verify a copied batch and delete its rows from the hot table; returns rows moved."""
+    batch = db.execute(select(archive_batches).where(archive_batches.c.id == batch_id)).one()
+    rows = db.execute(
+        select(*ARCHIVED_COLUMNS)
+        .where(archived_transactions.c.archive_batch == batch_id)
+        .order_by(archived_transactions.c.id)
+    ).all()
+    if len(rows) != batch.rows or checksum(rows) != batch.checksum:
+        db.rollback()
+        raise ArchiveChecksumError(f"archive batch {batch_id} does not match its checksum")
+    db.execute(delete(Transaction).where(Transaction.id.in_(bindparam("ids", expanding=True))),
+               {"ids": [row.id for row in rows]})
+    db.execute(update(archive_batches).where(archive_batches.c.id == batch_id).values(deleted_at=datetime.utcnow()))
+    db.commit()
+    return len(rows)
+
+
+def pending_batches(db: Session) -> List[int]:
+    return list(db.scalars(select(archive_batches.c.id).where(archive_batches.c.deleted_at.is_(None))
+                           .order_by(archive_batches.c.id)))
+
+
+def verify(db: Session) -> List[int]:
+    """Ids of archived batches whose rows no longer match their checksum."""
+    failed = []
+    for batch in db.execute(select(archive_batches).order_by(archive_batches.c.id)).all():
+        rows = db.execute(
+            select(*ARCHIVED_COLUMNS)
+            .where(archived_transactions.c.archive_batch == batch.id)
+            .order_by(archived_transactions.c.id)
+        ).all()
+        if len(rows) != batch.rows or checksum(rows) != batch.checksum:
+            failed.append(batch.id)
+    return failed
+
+
+def archive_transactions(session_factory: Callable[[], Session], cutoff: Optional[datetime] = None,
+                         batch_size: int = ARCHIVE_BATCH_SIZE,
+                         on_batch: Optional[Callable[[str, int], None]] = None) -> dict:
+    """Move settled rows created before ``cutoff`` into the archive.
+
+    ``cutoff`` defaults to ``ARCHIVE_AFTER_DAYS`` ago. Finishes batches an
+    earlier run left copied but not deleted, backfills ``balance_after``
+    for users with older rows lacking it, then archives month by month.
+    ``on_batch`` sees each batch's period and row count. Safe to rerun.
+    """
+    if not enabled():
+        raise RuntimeError("ARCHIVE_PATH is not set")
+    cutoff = cutoff or datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    report = {"cutoff": cutoff.isoformat(), "resumed": 0, "backfilled": 0, "batches": 0, "rows": 0}
+    with session_factory() as db:
+        pending = pending_batches(db)
+    for batch_id in pending:
+        with session_factory() as db:
+            report["rows"] += finish_batch(db, batch_id)
+        report["resumed"] += 1
+    with session_factory() as db:
+        user_ids = list(db.scalars(
+            select(Transaction.user_id)
+            .where(Transaction.created_at < cutoff, Transaction.balance_after.is_(None))
+            .distinct()
+        ))
+    report["backfilled"] = balance_history.backfill(session_factory, user_ids=user_ids)
+    with session_factory() as db:
+        months = list(periods(db, cutoff))
+    for start, end in months:
+        while True:
+            with session_factory() as db:
+                batch_id = copy_batch(db, start, end, cutoff, batch_size)
+            if batch_id is None:
+                break
+            with session_factory() as db:
+                moved = finish_batch(db, batch_id)
+            report["batches"] += 1
+            report["rows"] += moved
+            if on_batch is not None:
+                on_batch(start.strftime("%Y-%m"), moved)
+    return report
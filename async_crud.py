@@ -0,0 +1,417 @@
+"""Digital Wallet async CRUD operations Module
+
+The wallet, transaction and transfer operations every route uses, for
+``database.get_async_db`` sessions. Statement builders, batch planning
+and the cache write-through come from ``crud``, so the async paths only
+add the awaiting.
+"""
+
+from sqlalchemy import Row, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import User, Transaction, TransactionType
+import schemas
+import crud
+import admission
+import archive
+from balance_cache import balance_cache
+import balance_history
+import hot_accounts
+import outbox
+from database import recent_writes
+from idempotency import IdempotentRequest, store_record
+import group_commit
+import search
+from serialization import TRANSACTION_COLUMNS
+from fastapi import HTTPException, status
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+import math
+
+"""User lookups"""
+
+async def get_user(db: AsyncSession, user_id: int) -> Optional[User]:
+    return await db.get(User, user_id)
+
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
+    return await db.scalar(select(User).where(User.username == username))
+
+async def get_user_balance(db: AsyncSession, user_id: int) -> Optional[float]:
+    balance = balance_cache.get(user_id)
+    if balance is not None:
+        return balance
+    row = (await db.execute(hot_accounts.total_balance_stmt(user_id))).first()
+    if row is None:
+        return None
+    balance_cache.set(user_id, row.balance, row.version)
+    return row.balance
+
+async def get_balance_state(db: AsyncSession, user_id: int) -> Optional[Tuple[float, int]]:
+    state = balance_cache.get_state(user_id)
+    if state is not None:
+        return state
+    row = (await db.execute(hot_accounts.total_balance_stmt(user_id))).first()
+    if row is None:
+        return None
+    balance_cache.set(user_id, row.balance, row.version)
+    return row.balance, row.version
+
+
+"""User writes
+
+Passwords arrive already hashed (``passwords.hash_async``), so no hashing
+happens while a session holds a connection.
+"""
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str) -> User:
+    now = datetime.utcnow()
+    # Every column is set here, so the response needs no reload after the commit.
+    db_user = User(
+        username=user.username,
+        email=user.email,
+        full_name=user.full_name,
+        phone_number=user.phone_number,
+        balance=user.initial_balance if user.initial_balance else 0.0,
+        hashed_password=hashed_password,
+        is_active=1,
+        version=1,
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(db_user)
+    try:
+        if db_user.balance:
+            # The ledger must explain every balance, including the opening one.
+            await db.flush()
+            opening = crud.opening_deposit(db_user)
+            db.add(opening)
+            await outbox.record_async(db, opening)
+        await db.commit()
+    except IntegrityError:
+        await _raise_duplicate_user(db, user.username)
+    admission.disarm()
+    crud.cache_balances({db_user.id: (db_user.balance, db_user.version)})
+    recent_writes.note([db_user.id])
+    return db_user
+
+async def update_user(db: AsyncSession, user_id: int, user_update: schemas.UserUpdate, hashed_password: Optional[str] = None) -> Optional[User]:
+    db_user = await get_user(db, user_id)
+    if not db_user:
+        return None
+    for var, value in vars(user_update).items():
+        if value is not None and var != "password":
+            setattr(db_user, var, value)
+    if hashed_password is not None:
+        db_user.hashed_password = hashed_password
+    db_user.updated_at = datetime.utcnow()
+    db_user.version = User.version + 1
+    try:
+        await db.commit()
+    except IntegrityError:
+        await _raise_duplicate_user(db, None)
+    # Committed: the reload below must not fail the request on its deadline.
+    admission.disarm()
+    await db.refresh(db_user)
+    crud.cache_balances({db_user.id: (db_user.balance, db_user.version)})
+    recent_writes.note([db_user.id])
+    return db_user
+
+
+async def _raise_duplicate_user(db: AsyncSession, username: Optional[str]):
+    """Explain a unique violation on ``users``; the username check before the insert can lose a race."""
+    await db.rollback()
+    if username is not None and await get_user_by_username(db, username) is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered")
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
+
+
+"""atomic balance mutations"""
+
+async def _apply_balance_delta(db: AsyncSession, user_id: int, delta: float) -> Optional[Row]:
+    """Apply a balance delta; returns the new ``balance`` and ``version``, or None when no row matched.
+
+    For a hot account the returned state is only part of its balance (a
+    slot or the main row) and must not be cached; see ``crud.cache_balances``.
+    """
+    slots = hot_accounts.registry.slots(user_id)
+    if slots and delta > 0:
+        slot_state = await _apply_update(db, hot_accounts.credit_stmt(user_id, slots, delta),
+                                         hot_accounts.RETURNED_SLOT_STATE, hot_accounts.total_balance_stmt(user_id))
+        if slot_state is not None:
+            return slot_state
+    state = await _apply_update(db, crud.balance_update_stmt(user_id, delta), crud.RETURNED_STATE, crud.balance_state_stmt(user_id))
+    if state is None and slots and delta < 0 and await hot_accounts.sweep_async(db, user_id):
+        state = await _apply_update(db, crud.balance_update_stmt(user_id, delta), crud.RETURNED_STATE, crud.balance_state_stmt(user_id))
+    return state
+
+
+async def _apply_update(db: AsyncSession, stmt, returned, lookup) -> Optional[Row]:
+    """Run a conditional UPDATE; ``returned`` via RETURNING, else ``lookup`` after it."""
+    if db.get_bind().dialect.update_returning:
+        return (await db.execute(stmt.returning(*returned))).one_or_none()
+    if (await db.execute(stmt)).rowcount == 0:
+        return None
+    return (await db.execute(lookup)).one()
+
+
+async def _raise_balance_error(db: AsyncSession, user_id: int):
+    """Explain why a conditional balance UPDATE matched no row."""
+    # Inside a group commit only the caller's savepoint is rolled back.
+    if not db.in_nested_transaction():
+        await db.rollback()
+    if await db.scalar(select(User.id).where(User.id == user_id)) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient balance")
+
+
+async def _move_balance(db: AsyncSession, sender_id: int, recipient_id: int, amount: float) -> Dict[int, Row]:
+    """Debit the sender and credit the recipient inside the current transaction.
+
+    Rows are always touched in ascending id order so that two opposing
+    transfers cannot deadlock on backends with row-level locks. Returns
+    the new balance and version of both users.
+    """
+    states = {}
+    legs = sorted([(sender_id, -amount), (recipient_id, amount)])
+    for user_id, delta in legs:
+        states[user_id] = await _apply_balance_delta(db, user_id, delta)
+        if states[user_id] is None:
+            await _raise_balance_error(db, user_id)
+    return states
+
+
+async def _finish_stage(db: AsyncSession, transaction: Transaction, idempotency: Optional[IdempotentRequest]):
+    """Flush a staged mutation and load the transaction it returns.
+
+    The idempotency record is written here too, so that a key a
+    concurrent retry already stored fails inside the stage rather than
+    at commit.
+    """
+    await db.flush()
+    if idempotency is not None:
+        await store_record(db, idempotency, transaction)
+    await db.refresh(transaction)
+
+
+async def _commit_staged(db: AsyncSession, stage) -> Transaction:
+    """Run a staged mutation and commit it, alone or as part of a group commit.
+
+    ``stage(session)`` applies the mutation without committing and returns
+    the transaction to hand back plus the new balance states to cache.
+    """
+    if group_commit.enabled():
+        transaction, states = await group_commit.submit(stage)
+    else:
+        transaction, states = await stage(db)
+        await db.commit()
+    admission.disarm()
+    crud.cache_balances(states)
+    recent_writes.note(states)
+    return transaction
+
+
+async def add_money(db: AsyncSession, user_id: int, amount: float, description: Optional[str] = None, idempotency: Optional[IdempotentRequest] = None) -> Transaction:
+    detail = crud.amount_error(amount)
+    if detail:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+    return await _commit_staged(db, lambda session: _stage_add_money(session, user_id, amount, description, idempotency))
+
+
+async def _stage_add_money(db: AsyncSession, user_id: int, amount: float, description: Optional[str], idempotency: Optional[IdempotentRequest]):
+    state = await _apply_balance_delta(db, user_id, amount)
+    if state is None:
+        await _raise_balance_error(db, user_id)
+    db_transaction = Transaction(
+        user_id=user_id,
+        transaction_type=TransactionType.CREDIT,
+        amount=amount,
+        description=description,
+        balance_after=crud.ledger_balance_after(user_id, state.balance),
+        created_at=datetime.utcnow()
+    )
+    db.add(db_transaction)
+    await outbox.record_async(db, db_transaction)
+    await _finish_stage(db, db_transaction, idempotency)
+    return db_transaction, {user_id: state}
+
+
+async def withdraw_money(db: AsyncSession, user_id: int, amount: float, description: Optional[str] = None, idempotency: Optional[IdempotentRequest] = None) -> Transaction:
+    detail = crud.amount_error(amount)
+    if detail:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+    return await _commit_staged(db, lambda session: _stage_withdraw_money(session, user_id, amount, description, idempotency))
+
+
+async def _stage_withdraw_money(db: AsyncSession, user_id: int, amount: float, description: Optional[str], idempotency: Optional[IdempotentRequest]):
+    state = await _apply_balance_delta(db, user_id, -amount)
+    if state is None:
+        await _raise_balance_error(db, user_id)
+    db_transaction = Transaction(
+        user_id=user_id,
+        transaction_type=TransactionType.DEBIT,
+        amount=amount,
+        description=description,
+        balance_after=crud.ledger_balance_after(user_id, state.balance),
+        created_at=datetime.utcnow()
+    )
+    db.add(db_transaction)
+    await outbox.record_async(db, db_transaction)
+    await _finish_stage(db, db_transaction, idempotency)
+    return db_transaction, {user_id: state}
+
+
+"""Transaction CRUD Operations"""
+
+async def get_balance_at(db: AsyncSession, user_id: int, at: datetime) -> Optional[float]:
+    """The user's balance right after their last ledger row at or before ``at``.
+
+    One indexed lookup when that row has ``balance_after``; otherwise the
+    nearest checkpoint adjusted by the rows in between (see
+    ``balance_history``). Archived rows are all checkpoints, so with an
+    archive the nearest checkpoint is the closer of the hot and archived
+    candidates. None when the user does not exist.
+    """
+    at = balance_history.naive_utc(at)
+    row = (await db.execute(balance_history.latest_row_stmt(user_id, at))).first()
+    if row is not None and row.balance_after is not None:
+        return row.balance_after
+    checkpoint = None
+    if row is not None:
+        checkpoint = (await db.execute(balance_history.checkpoint_before_stmt(user_id, at))).first()
+    if archive.enabled():
+        checkpoint = balance_history.later(checkpoint, (await db.execute(archive.latest_row_stmt(user_id, at))).first())
+        if checkpoint is not None and row is None:
+            return checkpoint.balance_after
+    if checkpoint is not None:
+        return checkpoint.balance_after + await db.scalar(
+            balance_history.signed_sum_stmt(user_id, after=checkpoint, at_most=at))
+    checkpoint = (await db.execute(balance_history.checkpoint_after_stmt(user_id, at))).first()
+    if archive.enabled():
+        checkpoint = balance_history.earlier(checkpoint, (await db.execute(archive.first_row_after_stmt(user_id, at))).first())
+    if checkpoint is not None:
+        return checkpoint.balance_after - await db.scalar(
+            balance_history.signed_sum_stmt(user_id, through=checkpoint, later_than=at))
+    current = (await db.execute(hot_accounts.total_balance_stmt(user_id))).first()
+    if current is None:
+        return None
+    return current.balance - await db.scalar(balance_history.signed_sum_stmt(user_id, later_than=at))
+
+
+async def get_transactions(db: AsyncSession, user_id: int, cursor: Optional[str] = None, limit: int = 10) -> Tuple[List[Row], Optional[str]]:
+    """A history page as rows of ``serialization.TRANSACTION_COLUMNS``, not ORM objects.
+
+    Runs on the session's connection, so the rows skip ORM result processing too.
+    """
+    conn = await db.connection()
+    rows = list(await conn.execute(crud.transactions_page_stmt(user_id, cursor, limit, columns=TRANSACTION_COLUMNS)))
+    stmt = crud.archive_page_stmt(rows, user_id, cursor, limit, columns=TRANSACTION_COLUMNS)
+    if stmt is not None:
+        rows += list(await conn.execute(stmt))
+    return crud.split_page(rows, limit)
+
+async def search_transactions(db: AsyncSession, user_id: int, filters: schemas.TransactionSearch, cursor: Optional[str] = None, limit: int = 10) -> Tuple[List[Row], Optional[str]]:
+    stmt = search.search_stmt(user_id, filters, cursor, limit, db.get_bind().dialect.name, columns=TRANSACTION_COLUMNS)
+    rows = list(await (await db.connection()).execute(stmt))
+    return crud.split_page(rows, limit)
+
+async def get_transaction(db: AsyncSession, transaction_id: int) -> Optional[Transaction]:
+    transaction = await db.get(Transaction, transaction_id)
+    if transaction is None and archive.enabled():
+        row = (await db.execute(archive.transaction_stmt(transaction_id))).first()
+        transaction = archive.as_transaction(row) if row is not None else None
+    return transaction
+
+async def create_transaction(db: AsyncSession, transaction: schemas.TransactionCreate) -> Transaction:
+    if not math.isfinite(transaction.amount):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount must be a finite number")
+    db_transaction = Transaction(
+        user_id=transaction.user_id,
+        transaction_type=transaction.transaction_type,
+        amount=transaction.amount,
+        description=transaction.description,
+        reference_transaction_id=transaction.reference_transaction_id,
+        recipient_user_id=transaction.recipient_user_id,
+        sender_user_id=transaction.sender_user_id,
+        created_at=datetime.utcnow()
+    )
+    db.add(db_transaction)
+    await db.commit()
+    await db.refresh(db_transaction)
+    recent_writes.note([db_transaction.user_id])
+    return db_transaction
+
+
+"Transfer money between users"
+
+async def transfer_money(db: AsyncSession, sender_id: int, recipient_id: int, amount: float, description: Optional[str] = None, idempotency: Optional[IdempotentRequest] = None) -> Transaction:
+    detail = crud.amount_error(amount)
+    if detail:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+    if sender_id == recipient_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot transfer to self")
+    return await _commit_staged(db, lambda session: _stage_transfer_money(session, sender_id, recipient_id, amount, description, idempotency))
+
+
+async def _stage_transfer_money(db: AsyncSession, sender_id: int, recipient_id: int, amount: float, description: Optional[str], idempotency: Optional[IdempotentRequest]):
+    states = await _move_balance(db, sender_id, recipient_id, amount)
+    transfer_group = crud.new_transfer_group()
+    transfer_out = Transaction(
+        user_id=sender_id,
+        transaction_type=TransactionType.TRANSFER_OUT,
+        amount=amount,
+        description=description or f"Transfer to user {recipient_id}",
+        recipient_user_id=recipient_id,
+        transfer_group=transfer_group,
+        balance_after=crud.ledger_balance_after(sender_id, states[sender_id].balance),
+        created_at=datetime.utcnow()
+    )
+    transfer_in = Transaction(
+        user_id=recipient_id,
+        transaction_type=TransactionType.TRANSFER_IN,
+        amount=amount,
+        description=description or f"Transfer from user {sender_id}",
+        recipient_user_id=recipient_id,
+        sender_user_id=sender_id,
+        transfer_group=transfer_group,
+        balance_after=crud.ledger_balance_after(recipient_id, states[recipient_id].balance),
+        created_at=datetime.utcnow()
+    )
+    db.add_all([transfer_out, transfer_in])
+    await outbox.record_async(db, transfer_out, transfer_in)
+    await _finish_stage(db, transfer_out, idempotency)
+    return transfer_out, states
+
+
+async def get_transfer_detail(db: AsyncSession, transaction_id: int) -> Optional[dict]:
+    legs = list((await db.scalars(crud.transfer_legs_stmt(transaction_id))).unique())
+    if legs or not archive.enabled():
+        return crud.transfer_detail(legs)
+    legs = [archive.as_transaction(row) for row in await db.execute(archive.transfer_legs_stmt(transaction_id))]
+    users = {user.id: user for user in await db.scalars(select(User).where(User.id.in_(crud.leg_user_ids(legs))))}
+    return crud.transfer_detail(legs, users)
+
+
+async def transfer_batch(db: AsyncSession, transfers: List[schemas.TransferItem], mode: schemas.BatchMode = schemas.BatchMode.ALL_OR_NOTHING) -> dict:
+    account_ids = {item.sender_id for item in transfers} | {item.recipient_id for item in transfers}
+    for user_id in account_ids & set(hot_accounts.registry.accounts()):
+        await hot_accounts.sweep_async(db, user_id)
+    balances = dict((await db.execute(select(User.id, User.balance).where(User.id.in_(account_ids)))).all())
+    results, updates, ledger = crud.plan_transfer_batch(transfers, balances, mode == schemas.BatchMode.ALL_OR_NOTHING)
+    if not ledger:
+        return crud.batch_result(mode, results, committed=False)
+    if updates and (await db.execute(crud.batch_balance_update_stmt(), updates)).rowcount != len(updates):
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Balances changed during the batch; retry")
+    crud.fill_batch_balance_after(ledger, dict((await db.execute(select(User.id, User.balance).where(User.id.in_(account_ids)))).all()))
+    stmt, returning = crud.batch_insert_stmt(db.get_bind().dialect)
+    if returning:
+        crud.attach_transfer_ids(results, ledger, (await db.execute(stmt, ledger)).all())
+    else:
+        await db.execute(stmt, ledger)
+    await db.execute(outbox.transfer_group_events_stmt([entry["transfer_group"] for entry in ledger[0::2]]))
+    await db.commit()
+    for update_params in updates:
+        balance_cache.invalidate(update_params["uid"])
+    recent_writes.note({entry["user_id"] for entry in ledger})
+    return crud.batch_result(mode, results, committed=True)
+
@@ -0,0 +1,200 @@
+"""Digital Wallet authentication
+
+``POST /auth/login`` checks a username and password on the hashing pool
+(see ``passwords``) and returns a bearer token ``<payload>.<signature>``:
+a base64url JSON payload with the user id, the expiry and a fingerprint
+of the stored password hash, and a base64url HMAC-SHA256 of it under
+AUTH_TOKEN_SECRET.
+
+Validating a token costs an HMAC and one user lookup, which confirms the
+account is still active and its password unchanged since the token was
+issued. ``current_user_id`` remembers the outcome per token in
+``token_cache`` for up to AUTH_TOKEN_CACHE_TTL seconds, never past the
+token's expiry, so repeat requests pay neither. A deactivation or
+password change can therefore take that long to reach a token this
+process has already verified.
+
+    AUTH_TOKEN_SECRET      HMAC key (default: random per process, so tokens
+                           survive neither a restart nor another worker)
+    AUTH_TOKEN_TTL         seconds a token is valid (default 3600)
+    AUTH_TOKEN_CACHE_SIZE  verified tokens kept (default 100000, 0 disables)
+    AUTH_TOKEN_CACHE_TTL   seconds a verification is reused (default 30)
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from fastapi import Header, HTTPException, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import passwords
+from balance_cache import balance_cache
+from database import async_read_session_factory, recent_writes
+from models import User
+
+AUTH_TOKEN_SECRET = (os.getenv("AUTH_TOKEN_SECRET") or "").encode() or os.urandom(32)
+AUTH_TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", "3600"))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "100000"))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "30"))
+
+
+"""tokens"""
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(AUTH_TOKEN_SECRET, payload.encode(), hashlib.sha256).digest())
+
+
+def fingerprint(hashed_password: str) -> str:
+    """Changes whenever the stored password does, revoking older tokens."""
+    return hashlib.sha256(hashed_password.encode()).hexdigest()[:16]
+
+
+def issue_token(user_id: int, hashed_password: str, ttl: int = AUTH_TOKEN_TTL) -> Dict[str, object]:
+    expires = int(time.time()) + ttl
+    claims = {"sub": user_id, "exp": expires, "pwd": fingerprint(hashed_password)}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return {
+        "access_token": f"{payload}.{_sign(payload)}",
+        "token_type": "bearer",
+        "expires_at": datetime.utcfromtimestamp(expires),
+    }
+
+
+def decode_token(token: str) -> Optional[dict]:
+    """The claims of a well-formed, correctly signed, unexpired token, else None."""
+    payload, _, signature = token.partition(".")
+    if not signature or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get("exp"), int) or claims["exp"] <= time.time():
+        return None
+    return claims
+
+
+class VerifiedTokens:
+    """Bounded LRU map of token -> user id, each entry expiring on its own deadline."""
+
+    def __init__(self, max_size: int = AUTH_TOKEN_CACHE_SIZE, ttl: float = AUTH_TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, token: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            user_id, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[token]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return user_id
+
+    def set(self, token: str, user_id: int, token_expires: float):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + min(self.ttl, token_expires - time.time())
+        with self._lock:
+            self._entries[token] = (user_id, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+token_cache = VerifiedTokens()
+
+
+"""login and request authentication"""
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail,
+                         headers={"WWW-Authenticate": "Bearer"})
+
+
+async def login(db: AsyncSession, username: str, password: str) -> Dict[str, object]:
+    """Verify the credentials and issue a token; re-hashes passwords stored with old parameters.
+
+    The user row is read and the session's connection released before
+    the password is checked, so no connection is held while hashing.
+    """
+    row = (await db.execute(
+        select(User.id, User.is_active, User.hashed_password).where(User.username == username)
+    )).first()
+    await db.rollback()
+    stored = row.hashed_password if row is not None else await passwords.dummy_hash()
+    if not await passwords.verify_async(password, stored) or row is None:
+        raise _unauthorized("Incorrect username or password")
+    if not row.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+    if passwords.needs_rehash(stored):
+        stored = await passwords.hash_async(password)
+        await db.execute(update(User).where(User.id == row.id).values(hashed_password=stored, version=User.version + 1))
+        await db.commit()
+        balance_cache.invalidate(row.id)
+        recent_writes.note([row.id])
+    return issue_token(row.id, stored)
+
+
+async def current_user_id(authorization: Optional[str] = Header(None)) -> int:
+    """Dependency: the id of the user whose bearer token authorizes the request."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise _unauthorized("Not authenticated")
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    claims = decode_token(token)
+    if claims is None:
+        raise _unauthorized("Invalid or expired token")
+    user_id = claims["sub"]
+    async with async_read_session_factory(user_id)() as db:
+        row = (await db.execute(select(User.is_active, User.hashed_password).where(User.id == user_id))).first()
+    if row is None or not row.is_active or fingerprint(row.hashed_password) != claims.get("pwd"):
+        raise _unauthorized("Invalid or expired token")
+    token_cache.set(token, user_id, claims["exp"])
+    return user_id
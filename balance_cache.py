@@ -0,0 +1,101 @@
+"""Digital Wallet in-process balance cache
+
+A bounded LRU map of user id -> balance with a per-entry TTL, placed in
+front of ``get_user_balance``. Every mutation path in ``async_crud``
+writes the committed balance through after its commit.
+
+Each entry also holds the account's version (``hot_accounts.total_version``),
+which the conditional GETs of a user and its balance compare against
+``If-None-Match``. Writers take the new version from the same UPDATE
+that moved the balance, so when two commits write through out of order,
+or a read that started before a write finishes after it, ``set`` keeps
+the newer version instead of the last caller's balance.
+
+The cache is per process: with several workers, a write on one worker is
+only seen by the others once their entry expires, so the TTL is the upper
+bound on staleness across workers.
+
+    BALANCE_CACHE_SIZE   maximum entries (default 100000, 0 disables)
+    BALANCE_CACHE_TTL    seconds an entry stays valid (default 5)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", "100000"))
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "5"))
+
+
+class BalanceCache:
+    def __init__(self, max_size: int = BALANCE_CACHE_SIZE, ttl: float = BALANCE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user_id: int) -> Optional[float]:
+        entry = self._lookup(user_id)
+        return entry[0] if entry is not None else None
+
+    def get_state(self, user_id: int) -> Optional[Tuple[float, int]]:
+        """The cached ``(balance, version)``, or None when missing."""
+        entry = self._lookup(user_id)
+        return entry[:2] if entry is not None else None
+
+    def _lookup(self, user_id: int) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] < time.monotonic():
+                del self._entries[user_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry
+
+    def set(self, user_id: int, balance: float, version: int):
+        """Cache ``balance`` at ``version``, unless a newer version is already cached."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > version and entry[2] >= now:
+                return
+            self._entries[user_id] = (balance, version, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+balance_cache = BalanceCache()
@@ -0,0 +1,200 @@
+"""Digital Wallet historical balances
+
+Every ledger row written by the money-moving paths in ``async_crud``,
+the only write path, carries ``balance_after``: the owner's balance right
+after it, taken from the same conditional UPDATE that moved the money.
+Those rows are checkpoints, so "what was the balance at T" is one lookup on
+``ix_transactions_user_created_id``.
+
+Hot-account rows and rows written before the column existed have no
+``balance_after``. For them the answer is the nearest checkpoint (via the
+partial index ``ix_transactions_user_checkpoint``) adjusted by the signed
+amounts in between, or the current balance adjusted by everything after T
+when the user has no checkpoint at all. ``backfill`` fills the gaps, per
+user in keyset chunks, walking back from the newest checkpoint or the
+current balance.
+
+Both the fallback and the backfill assume that every ledger row moved
+its owner's balance by ``models.BALANCE_SIGN``, as the wallet routes and
+the seed data do; rows recorded through ``POST /transactions/`` without a
+balance change break that assumption.
+
+    BALANCE_BACKFILL_CHUNK_SIZE  rows read and updated per chunk (default 1000)
+"""
+
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import bindparam, case, func, select, tuple_, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import hot_accounts
+from models import BALANCE_SIGN, Transaction, User
+
+BALANCE_BACKFILL_CHUNK_SIZE = int(os.getenv("BALANCE_BACKFILL_CHUNK_SIZE", "1000"))
+
+logger = logging.getLogger(__name__)
+
+# Amount with the sign its type applies to the owner's balance.
+signed_amount = Transaction.amount * case(
+    (Transaction.transaction_type.in_([t for t, sign in BALANCE_SIGN.items() if sign > 0]), 1),
+    (Transaction.transaction_type.in_([t for t, sign in BALANCE_SIGN.items() if sign < 0]), -1),
+    else_=0,
+)
+
+
+def naive_utc(at: datetime) -> datetime:
+    """Ledger timestamps are naive UTC; convert an aware ``at`` to match."""
+    if at.tzinfo is not None:
+        return at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+
+"""balance-at statements"""
+
+def latest_row_stmt(user_id: int, at: datetime):
+    """The user's last ledger row at or before ``at``."""
+    return (
+        select(Transaction.id, Transaction.created_at, Transaction.balance_after)
+        .where(Transaction.user_id == user_id, Transaction.created_at <= at)
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .limit(1)
+    )
+
+
+def checkpoint_before_stmt(user_id: int, at: datetime):
+    return (
+        select(Transaction.id, Transaction.created_at, Transaction.balance_after)
+        .where(Transaction.user_id == user_id, Transaction.created_at <= at, Transaction.balance_after.is_not(None))
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .limit(1)
+    )
+
+
+def checkpoint_after_stmt(user_id: int, at: datetime):
+    return (
+        select(Transaction.id, Transaction.created_at, Transaction.balance_after)
+        .where(Transaction.user_id == user_id, Transaction.created_at > at, Transaction.balance_after.is_not(None))
+        .order_by(Transaction.created_at, Transaction.id)
+        .limit(1)
+    )
+
+
+def signed_sum_stmt(user_id: int, after=None, through=None, at_most: Optional[datetime] = None,
+                    later_than: Optional[datetime] = None):
+    """Net balance change of the rows strictly after ``after`` and up to ``through``.
+
+    ``after`` and ``through`` are ledger rows (``created_at`` and ``id``);
+    ``at_most`` and ``later_than`` bound ``created_at`` instead.
+    """
+    stmt = select(func.coalesce(func.sum(signed_amount), 0.0)).where(Transaction.user_id == user_id)
+    position = tuple_(Transaction.created_at, Transaction.id)
+    if after is not None:
+        stmt = stmt.where(position > tuple_(after.created_at, after.id))
+    if through is not None:
+        stmt = stmt.where(position <= tuple_(through.created_at, through.id))
+    if at_most is not None:
+        stmt = stmt.where(Transaction.created_at <= at_most)
+    if later_than is not None:
+        stmt = stmt.where(Transaction.created_at > later_than)
+    return stmt
+
+
+def _position(row):
+    return row.created_at, row.id
+
+
+def later(first, second):
+    """The later of two optional ledger rows, by (created_at, id)."""
+    if first is None or second is None:
+        return first if second is None else second
+    return max(first, second, key=_position)
+
+
+def earlier(first, second):
+    if first is None or second is None:
+        return first if second is None else second
+    return min(first, second, key=_position)
+
+
+"""backfill"""
+
+def _chunk_stmt(user_id: int, before, chunk_size: int):
+    stmt = (
+        select(Transaction.id, Transaction.created_at, Transaction.transaction_type, Transaction.amount,
+               Transaction.balance_after)
+        .where(Transaction.user_id == user_id)
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .limit(chunk_size)
+    )
+    if before is not None:
+        stmt = stmt.where(tuple_(Transaction.created_at, Transaction.id) < tuple_(before.created_at, before.id))
+    return stmt
+
+
+def _fill_stmt():
+    table = Transaction.__table__
+    return update(table).where(table.c.id == bindparam("tid")).values(balance_after=bindparam("balance_after"))
+
+
+def backfill_user(db: Session, user_id: int, chunk_size: int = BALANCE_BACKFILL_CHUNK_SIZE) -> int:
+    """Fill ``balance_after`` on one user's rows that lack it; returns rows filled.
+
+    Walks the ledger newest first, starting from the current balance read
+    under a row lock together with the first chunk, and re-anchors on
+    every row that already has a value. Commits after each chunk; rows
+    added meanwhile are newer than the walk and carry their own value.
+    Safe to rerun.
+    """
+    if db.execute(select(User.id).where(User.id == user_id).with_for_update()).first() is None:
+        return 0
+    running = db.execute(hot_accounts.total_balance_stmt(user_id)).scalar_one()
+    filled = 0
+    last = None
+    while True:
+        rows = db.execute(_chunk_stmt(user_id, last, chunk_size)).all()
+        if not rows:
+            break
+        fills = []
+        for row in rows:
+            if row.balance_after is None:
+                fills.append({"tid": row.id, "balance_after": running})
+            else:
+                running = row.balance_after
+            running -= BALANCE_SIGN[row.transaction_type] * row.amount
+        if fills:
+            db.execute(_fill_stmt(), fills)
+        db.commit()
+        filled += len(fills)
+        last = rows[-1]
+    db.commit()
+    return filled
+
+
+def users_missing_balance_after(db: Session) -> Iterable[int]:
+    return db.scalars(select(Transaction.user_id).where(Transaction.balance_after.is_(None)).distinct()).all()
+
+
+def backfill(session_factory: Callable[[], Session], chunk_size: int = BALANCE_BACKFILL_CHUNK_SIZE,
+             user_ids: Optional[Iterable[int]] = None, attempts: int = 3) -> int:
+    """Run ``backfill_user`` for ``user_ids`` (default: every user with gaps)."""
+    if user_ids is None:
+        with session_factory() as db:
+            user_ids = users_missing_balance_after(db)
+    filled = 0
+    for user_id in user_ids:
+        for attempt in range(1, attempts + 1):
+            try:
+                with session_factory() as db:
+                    filled += backfill_user(db, user_id, chunk_size)
+                break
+            except OperationalError:
+                # SQLite refuses to upgrade a read snapshot another writer has
+                # moved past; the walk is idempotent, so start the user over.
+                if attempt == attempts:
+                    raise
+                logger.warning("balance backfill of user %d conflicted; retrying", user_id)
+    return filled
@@ -0,0 +1,46 @@
+"""Test setup shared by every module
+
+The suite runs against one SQLite file in a temporary directory, set
+here before any module imports ``database`` and migrated at startup
+instead of by ``scripts/migrate.py``. Modules talk to the app through
+the ``client`` fixture and make accounts with ``create_user``; a module
+that must configure the app before its lifespan starts overrides
+``app_setup``. Every module shares the database, so tests use the ids
+they created and usernames carry the module's prefix.
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "wallet_tests.db"))
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.setdefault("SCHEMA_AUTO_MIGRATE", "1")
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def app_setup():
+    """Runs around the module's ``client``; override to configure the app first."""
+    yield
+
+
+@pytest.fixture(scope="module")
+def client(app_setup):
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def create_user(client):
+    """Factory registering a user through the API; returns its id."""
+    def create(name: str, balance: float = 0.0, password: str = "x") -> int:
+        response = client.post("/users/", json={"username": name, "email": f"{name}@example.com",
+                                                "password": password, "initial_balance": balance})
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+
+    return create
@@ -1,251 +1,334 @@
-"""Digital Wallet Crud operations Module"""
-
-from sqlalchemy.orm import Session
-from models import User, Transaction, TransactionType
-import schemas,models
-from sqlalchemy import and_, or_
-from sqlalchemy.exc import IntegrityError
-from fastapi import HTTPException, status
-from database import get_db
-from typing import List, Optional
+"""Digital Wallet Crud operations Module
+
+Every route writes through ``async_crud``. This module keeps the sync
+reads that ``main`` still serves from a thread and the parts the async
+operations are built from: statement builders, ledger and batch
+planning and the balance-cache write-through, so each exists once.
+"""
+
+from sqlalchemy.orm import Session, joinedload
+from models import BALANCE_SIGN, User, Transaction, TransactionType
+import schemas
+from sqlalchemy import Float, bindparam, cast, insert, or_, select, tuple_, update
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 from datetime import datetime
+import math
+import uuid
+from pagination import encode_cursor, decode_cursor
+from balance_cache import balance_cache
+import archive
+import hot_accounts
 
 """User CRUD Operations"""
 
 def get_user(db: Session, user_id: int) -> Optional[User]:
     return db.query(User).filter(User.id == user_id).first()
 
-def get_user_by_username(db: Session, username: str) -> Optional[User]:
-    return db.query(User).filter(User.username == username).first()
-
-def create_user(db: Session, user: schemas.UserCreate) -> User:
-    db_user = User(
-        username=user.username,
-        email=user.email,
-        full_name=user.full_name,
-        phone_number=user.phone_number,
-        balance=user.initial_balance if user.initial_balance else 0.0,
-        hashed_password=user.password,  # Note: In a real app, you should hash the password
-        created_at=datetime.utcnow()
-          
+def opening_deposit(db_user: User) -> Transaction:
+    return Transaction(
+        user_id=db_user.id,
+        transaction_type=TransactionType.DEPOSIT,
+        amount=db_user.balance,
+        description="Opening balance",
+        balance_after=db_user.balance,
+        created_at=db_user.created_at,
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
-
-def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate) -> Optional[User]:
-    db_user = get_user(db, user_id)
-    if not db_user:
+
+
+"""account versions for conditional GETs"""
+
+def get_balance_state(db: Session, user_id: int) -> Optional[Tuple[float, int]]:
+    """The balance and version (``hot_accounts.total_version``), from the cache or one read of both."""
+    state = balance_cache.get_state(user_id)
+    if state is not None:
+        return state
+    row = db.execute(hot_accounts.total_balance_stmt(user_id)).first()
+    if row is None:
         return None
-    for var, value in vars(user_update).items():
-        if value is not None:
-            setattr(db_user, var, value)
-    db_user.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    balance_cache.set(user_id, row.balance, row.version)
+    return row.balance, row.version
+
 
+def get_user_version(db: Session, user_id: int) -> Optional[int]:
+    """The account's version, without loading the ``User`` row; None if it does not exist."""
+    state = get_balance_state(db, user_id)
+    return state[1] if state is not None else None
 
-"""wallet balance operations"""
 
-""""get balance of user"""
+def user_version(db: Session, db_user: User) -> int:
+    """The account version matching a loaded ``User``; hot accounts add their slots' versions."""
+    if not hot_accounts.registry.slots(db_user.id):
+        return db_user.version
+    return db_user.version + db.scalar(hot_accounts.slot_versions_stmt(db_user.id))
 
-def get_user_balance(db: Session, user_id: int) -> Optional[float]:
-    db_user = get_user(db, user_id) 
-    if db_user:
-        return db_user.balance
+
+"""atomic balance mutations"""
+
+def amount_error(amount: float) -> Optional[str]:
+    """Why ``amount`` cannot be moved, or None; NaN and infinity never can."""
+    if not math.isfinite(amount):
+        return "Amount must be a finite number"
+    if amount <= 0:
+        return "Amount must be positive"
     return None
 
 
+def balance_update_stmt(user_id: int, delta: float):
+    """Build the conditional UPDATE that adds ``delta`` to a user's balance.
 
+    Debits only match while the stored balance still covers them, so the
+    check and the write happen atomically in the database instead of in
+    Python.
+    """
+    stmt = update(User).where(User.id == user_id)
+    if delta < 0:
+        stmt = stmt.where(User.balance >= -delta)
+    stmt = stmt.values(balance=User.balance + delta, version=User.version + 1, updated_at=datetime.utcnow())
+    return stmt.execution_options(synchronize_session=False)
 
-"""update balance of user"""
-def update_user_balance(db: Session, user_id: int, new_balance: float) -> Optional[User]:
-    db_user = get_user(db, user_id)
-    if not db_user:
-        return None
-    db_user.balance = new_balance
-    db_user.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_user)
-    return db_user
 
+# SQLite's RETURNING hands back integral REAL values as ints; keep them floats.
+RETURNED_STATE = (cast(User.balance, Float).label("balance"), User.version)
 
-def add_money(db: Session, user_id: int, amount: float, description: Optional[str] = None) -> Optional[Transaction]:
-    if amount <= 0:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount must be positive")
-    db_user = get_user(db, user_id)
-    if not db_user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    new_balance = db_user.balance + amount
-    db_user.balance = new_balance
-    db_user.updated_at = datetime.utcnow()
-    db_transaction = Transaction(
-        user_id=user_id,
-        transaction_type=TransactionType.CREDIT,
-        amount=amount,
-        description=description,
-        created_at=datetime.utcnow()
-    )
-    db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    return db_transaction
 
+def balance_state_stmt(user_id: int):
+    return select(*RETURNED_STATE).where(User.id == user_id)
 
 
-def withdraw_money(db: Session, user_id: int, amount: float, description: Optional[str] = None) -> Optional[Transaction]:
-    if amount <= 0:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount must be positive")  
-    db_user = get_user(db, user_id)
-    if not db_user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    if db_user.balance < amount:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient balance")
-    new_balance = db_user.balance - amount
-    db_user.balance = new_balance
-    db_user.updated_at = datetime.utcnow()
-    db_transaction = Transaction(
-        user_id=user_id,
-        transaction_type=TransactionType.DEBIT,
-        amount=amount,
-        description=description,
-        created_at=datetime.utcnow()
-    )
-    db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    return db_transaction
+def cache_balances(states: Dict[int, Tuple[float, int]]):
+    """Write committed ``(balance, version)`` pairs through to the cache.
+
+    A hot account's total is spread over its slots, so its entry is
+    dropped instead and the next read sums the slots.
+    """
+    for user_id, (balance, version) in states.items():
+        if hot_accounts.registry.slots(user_id):
+            balance_cache.invalidate(user_id)
+        else:
+            balance_cache.set(user_id, balance, version)
+
+
+def ledger_balance_after(user_id: int, balance: float) -> Optional[float]:
+    """``balance`` as a ledger row's ``balance_after``, unless it is only part of a hot account's total."""
+    return None if hot_accounts.registry.slots(user_id) else balance
 
 
 """Transaction CRUD Operations"""
 
 
-def get_transactions(db: Session, user_id: int, skip: int = 0, limit: int = 10) -> List[Transaction]:
-    return db.query(Transaction).filter(Transaction.user_id == user_id).offset(skip).limit(limit).all()
+def transactions_page_stmt(user_id: int, cursor: Optional[str], limit: int, transaction_type: Optional[TransactionType] = None, columns: Optional[Sequence] = None):
+    """Newest-first page of a user's history starting after ``cursor``.
 
-def get_transaction(db: Session, transaction_id: int) -> Optional[Transaction]:
-    return db.query(Transaction).filter(Transaction.id == transaction_id).first()
+    Selects one row more than ``limit`` so callers can tell whether a next
+    page exists. Served by ix_transactions_user_created_id, so every page
+    costs the same regardless of depth. With ``columns``, selects those
+    instead of ``Transaction`` entities.
+    """
+    stmt = select(*columns) if columns is not None else select(Transaction)
+    stmt = stmt.where(Transaction.user_id == user_id)
+    if transaction_type is not None:
+        stmt = stmt.where(Transaction.transaction_type == transaction_type)
+    position = decode_cursor(cursor)
+    if position is not None:
+        stmt = stmt.where(tuple_(Transaction.created_at, Transaction.id) < tuple_(*position))
+    return stmt.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit + 1)
 
-def create_transaction(db: Session, transaction: schemas.TransactionCreate, user_id: int) -> Transaction:
-    db_transaction = Transaction(
-        user_id=transaction.user_id,
-        transaction_type=transaction.transaction_type,
-        amount=transaction.amount,
-        description=transaction.description,
-        reference_transaction_id=transaction.reference_transaction_id,
-        recipient_user_id=transaction.recipient_user_id,
-        sender_user_id=transaction.sender_user_id,
-        created_at=datetime.utcnow()
-    )
-    db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    return db_transaction
-
-def get_user_transactions(db: Session, user_id: int, page: int = 1, limit: int = 10) -> List[Transaction]:
-    offset = (page - 1) * limit
-    return db.query(Transaction).filter(Transaction.user_id == user_id).offset(offset).limit(limit).all()
-def get_transactions_by_type(db: Session, user_id: int, transaction_type: TransactionType, page: int = 1, limit: int = 10) -> List[Transaction]:
-    offset = (page - 1) * limit
-    return db.query(Transaction).filter(
-        and_(
-            Transaction.user_id == user_id,
-            Transaction.transaction_type == transaction_type
-        )
-    ).offset(offset).limit(limit).all()
+
+def split_page(rows: List[Transaction], limit: int) -> Tuple[List[Transaction], Optional[str]]:
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def archive_page_stmt(rows: List[Transaction], user_id: int, cursor: Optional[str], limit: int, transaction_type: Optional[TransactionType] = None, columns: Optional[Sequence] = None):
+    """Continue a short page of hot rows into the archive, or None.
+
+    The archive part starts strictly older than the last hot row, so a row
+    present on both sides while a batch is being moved appears once. With
+    ``columns``, selects the archived columns of the same names.
+    """
+    if len(rows) > limit or not archive.enabled():
+        return None
+    before = (rows[-1].created_at, rows[-1].id) if rows else decode_cursor(cursor)
+    names = [column.name for column in columns] if columns is not None else None
+    return archive.page_stmt(user_id, before, limit + 1 - len(rows), transaction_type, names)
 
 
 "Transfer money between users"
 
-def transfer_money(db: Session, sender_id: int, recipient_id: int, amount: float, description: Optional[str] = None) -> Optional[Transaction]:
-    if amount <= 0:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount must be positive")
-    if sender_id == recipient_id:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot transfer to self")
-    sender = get_user(db, sender_id)
-    recipient = get_user(db, recipient_id)
-    if not sender or not recipient:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    if sender.balance < amount:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient balance")
-    sender.balance -= amount
-    recipient.balance += amount
-    sender.updated_at = datetime.utcnow()
-    recipient.updated_at = datetime.utcnow()
-    transfer_out = Transaction(
-        user_id=sender_id,
-        transaction_type=TransactionType.TRANSFER_OUT,
-        amount=amount,
-        description=description or f"Transfer to user {recipient_id}",
-        recipient_user_id=recipient_id,
-        created_at=datetime.utcnow()
-    )
-    
-    transfer_in = Transaction(
-        user_id=recipient_id,
-        transaction_type=TransactionType.TRANSFER_IN,
-        amount=amount,
-        description=description or f"Transfer from user {sender_id}",
-        recipient_user_id=recipient_id,
-        sender_user_id=sender_id,
-        created_at=datetime.utcnow()
-    )
-    db.add(transfer_out)
-    db.add(transfer_in)
-    db.commit()
-    db.refresh(transfer_out)
-    return transfer_out
+def new_transfer_group() -> str:
+    """Identifier written on both legs of one transfer."""
+    return uuid.uuid4().hex
 
 
-"create end point tranfer moeny with transfer id"
+def transfer_legs_stmt(transaction_id: int):
+    """Both legs of the transfer containing ``transaction_id``, with their users, in one query.
 
-def transfer_money_with_reference(db: Session, sender_id: int, recipient_id: int, amount: float, reference_transaction_id: int, description: Optional[str] = None) -> Optional[Transaction]:
-    if amount <= 0:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount must be positive")
-    if sender_id == recipient_id:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot transfer to self")
-    sender = get_user(db, sender_id)
-    recipient = get_user(db, recipient_id)
-    if not sender or not recipient:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    if sender.balance < amount:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient balance")
-    reference_transaction = get_transaction(db, reference_transaction_id)
-    if not reference_transaction:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reference transaction not found")
-    sender.balance -= amount
-    recipient.balance += amount
-    sender.updated_at = datetime.utcnow()
-    recipient.updated_at = datetime.utcnow()
-    transfer_out = Transaction(
-        user_id=sender_id,
-        transaction_type=TransactionType.TRANSFER_OUT,
-        amount=amount,
-        description=description or f"Transfer to user {recipient_id}",
-        recipient_user_id=recipient_id,
-        reference_transaction_id=reference_transaction_id,
-        created_at=datetime.utcnow()
+    Transfers written before transfer groups existed have no group and
+    come back as the single requested leg.
+    """
+    group = select(Transaction.transfer_group).where(Transaction.id == transaction_id).scalar_subquery()
+    return (
+        select(Transaction)
+        .where(or_(Transaction.id == transaction_id, Transaction.transfer_group == group))
+        .where(Transaction.transaction_type.in_([TransactionType.TRANSFER_OUT, TransactionType.TRANSFER_IN]))
+        .options(joinedload(Transaction.user), joinedload(Transaction.recipient), joinedload(Transaction.sender))
+        .order_by(Transaction.id)
     )
-    transfer_in = Transaction(
-        user_id=recipient_id,
-        transaction_type=TransactionType.TRANSFER_IN,
-        amount=amount,
-        description=description or f"Transfer from user {sender_id}",
-        recipient_user_id=recipient_id,
-        sender_user_id=sender_id,
-        reference_transaction_id=reference_transaction_id,
-        created_at=datetime.utcnow()
-    )
-    db.add(transfer_out)
-    db.add(transfer_in)
-    db.commit()
-    db.refresh(transfer_out)
-    return transfer_out
 
 
+def transfer_detail(legs: List[Transaction], users: Optional[Dict[int, User]] = None) -> Optional[dict]:
+    """Detail of a transfer from its legs.
 
+    Archived legs are not attached to a session, so their users are
+    passed in ``users`` by id instead of loaded through the relationships.
+    """
+    if not legs:
+        return None
+    transfer_out = next((leg for leg in legs if leg.transaction_type == TransactionType.TRANSFER_OUT), None)
+    transfer_in = next((leg for leg in legs if leg.transaction_type == TransactionType.TRANSFER_IN), None)
+    first = transfer_out or transfer_in
+    if users is None:
+        sender = transfer_out.user if transfer_out else transfer_in.sender
+        recipient = transfer_in.user if transfer_in else transfer_out.recipient
+    else:
+        sender = users.get(transfer_out.user_id if transfer_out else transfer_in.sender_user_id)
+        recipient = users.get(transfer_in.user_id if transfer_in else transfer_out.recipient_user_id)
+    return {
+        "transfer_group": first.transfer_group,
+        "amount": first.amount,
+        "created_at": first.created_at,
+        "sender": sender,
+        "recipient": recipient,
+        "transfer_out": transfer_out,
+        "transfer_in": transfer_in,
+    }
+
+
+def leg_user_ids(legs: List[Transaction]) -> Set[int]:
+    return {user_id for leg in legs for user_id in (leg.user_id, leg.sender_user_id, leg.recipient_user_id) if user_id is not None}
+
+
+"batch transfers: one account load, one bulk ledger insert, one commit"
+
+def batch_balance_update_stmt():
+    """Executemany form of the conditional balance UPDATE, keyed by ``uid``/``delta``."""
+    delta = bindparam("delta")
+    return (
+        update(User.__table__)
+        .where(User.__table__.c.id == bindparam("uid"))
+        .where(or_(delta >= 0, User.__table__.c.balance + delta >= 0))
+        .values(balance=User.__table__.c.balance + delta, version=User.__table__.c.version + 1,
+                updated_at=bindparam("updated_at"))
+    )
 
 
+def plan_transfer_batch(transfers: List[schemas.TransferItem], balances: Dict[int, float], atomic: bool):
+    """Validate a batch in submission order against in-memory balances.
+
+    Returns the per-item results, the net balance delta per account and
+    the ledger rows to insert (two per successful transfer). In atomic mode
+    a single failure turns every success into ``rolled_back`` and nothing
+    is written.
+    """
+    now = datetime.utcnow()
+    results = []
+    deltas: Dict[int, float] = {}
+    ledger = []
+    for index, item in enumerate(transfers):
+        detail = amount_error(item.amount)
+        if detail is None:
+            if item.sender_id == item.recipient_id:
+                detail = "Cannot transfer to self"
+            elif item.sender_id not in balances or item.recipient_id not in balances:
+                detail = "User not found"
+            elif balances[item.sender_id] < item.amount:
+                detail = "Insufficient balance"
+        if detail:
+            results.append({"index": index, "status": "failed", "detail": detail})
+            continue
+        balances[item.sender_id] -= item.amount
+        balances[item.recipient_id] += item.amount
+        deltas[item.sender_id] = deltas.get(item.sender_id, 0.0) - item.amount
+        deltas[item.recipient_id] = deltas.get(item.recipient_id, 0.0) + item.amount
+        results.append({"index": index, "status": "success"})
+        transfer_group = new_transfer_group()
+        ledger.append({
+            "user_id": item.sender_id,
+            "transaction_type": TransactionType.TRANSFER_OUT,
+            "amount": item.amount,
+            "description": item.description or f"Transfer to user {item.recipient_id}",
+            "recipient_user_id": item.recipient_id,
+            "sender_user_id": None,
+            "transfer_group": transfer_group,
+            "balance_after": None,
+            "created_at": now,
+        })
+        ledger.append({
+            "user_id": item.recipient_id,
+            "transaction_type": TransactionType.TRANSFER_IN,
+            "amount": item.amount,
+            "description": item.description or f"Transfer from user {item.sender_id}",
+            "recipient_user_id": item.recipient_id,
+            "sender_user_id": item.sender_id,
+            "transfer_group": transfer_group,
+            "balance_after": None,
+            "created_at": now,
+        })
+    failed = sum(1 for result in results if result["status"] == "failed")
+    if atomic and failed:
+        for result in results:
+            if result["status"] == "success":
+                result["status"] = "rolled_back"
+        return results, {}, []
+    updates = [{"uid": uid, "delta": delta, "updated_at": now} for uid, delta in deltas.items() if delta != 0]
+    return results, updates, ledger
+
+
+def fill_batch_balance_after(ledger: List[dict], balances: Dict[int, float]) -> None:
+    """Set ``balance_after`` on a batch's ledger rows from the balances after its UPDATE.
+
+    Walks the rows backwards from each account's final balance, read in
+    the same transaction, so concurrent writers cannot skew it.
+    """
+    running = dict(balances)
+    for entry in reversed(ledger):
+        user_id = entry["user_id"]
+        entry["balance_after"] = ledger_balance_after(user_id, running[user_id])
+        running[user_id] -= BALANCE_SIGN[entry["transaction_type"]] * entry["amount"]
+
+
+def batch_result(mode: schemas.BatchMode, results: List[dict], committed: bool) -> dict:
+    succeeded = sum(1 for result in results if result["status"] == "success")
+    return {
+        "mode": mode,
+        "committed": committed,
+        "succeeded": succeeded,
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+        "results": results,
+    }
+
+
+def attach_transfer_ids(results: List[dict], ledger: List[dict], returned) -> None:
+    """Pair inserted TRANSFER_OUT ids with the successful items by transfer group.
+
+    RETURNING order is not guaranteed for a multi-row INSERT, and asking
+    for it makes SQLite fall back to one INSERT per row.
+    """
+    ids = {row.transfer_group: row.id for row in returned if row.transaction_type == TransactionType.TRANSFER_OUT}
+    out_rows = iter(ledger[0::2])
+    for result in results:
+        if result["status"] == "success":
+            result["transaction_id"] = ids.get(next(out_rows)["transfer_group"])
+
+
+def batch_insert_stmt(db_dialect):
+    # Core insert: the ORM bulk path splits rows by which columns are None
+    # and would issue one INSERT per TRANSFER_OUT / TRANSFER_IN run.
+    table = Transaction.__table__
+    stmt = insert(table)
+    if db_dialect.insert_executemany_returning:
+        return stmt.returning(table.c.id, table.c.transaction_type, table.c.transfer_group), True
+    return stmt, False
 
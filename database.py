@@ -1,18 +1,128 @@
-"""Digital Wallet API Database Module"""
+"""Digital Wallet API Database Module
+
+Writes go through ``get_db`` / ``get_async_db``. Read-only routes use
+``get_read_db`` / ``get_async_read_db``, whose sessions come from separate
+read-only engines and pools (see ``db_config.READ_DATABASE_URL``), so
+lookups never queue behind writers for a connection or a lock.
+
+A read that must observe the caller's own writes is sent to the primary
+according to READ_STALENESS_POLICY:
+
+    replica            always read from the read engine
+    read_your_writes   use the primary for a user written by this process
+                       in the last READ_YOUR_WRITES_SECONDS (default 5)
+    primary            no split; every read uses the primary
+"""
 #sesion,base,engine
-from sqlalchemy import create_engine
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from fastapi import Request
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import admission
+import db_config
+import instrumentation
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./wallet.db"
+SQLALCHEMY_DATABASE_URL = db_config.DATABASE_URL
+ASYNC_SQLALCHEMY_DATABASE_URL = db_config.ASYNC_DATABASE_URL
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = db_config.build_engine(SQLALCHEMY_DATABASE_URL)
+instrumentation.instrument_engine(engine)
+admission.install_deadlines(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for the wallet, transaction and transfer routes. Objects are
+# not expired on commit so that handlers can serialize them without
+# triggering implicit IO outside the event loop.
+async_engine = db_config.build_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+instrumentation.instrument_engine(async_engine)
+admission.install_deadlines(async_engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# Read side: read-only connections on their own pools. Without a separate
+# read URL (in-memory SQLite) the read sessions share the write engines.
+if db_config.READ_DATABASE_URL:
+    read_engine = db_config.build_engine(db_config.READ_DATABASE_URL, read_only=True)
+    instrumentation.instrument_engine(read_engine)
+    admission.install_deadlines(read_engine)
+    async_read_engine = db_config.build_async_engine(db_config.ASYNC_READ_DATABASE_URL, read_only=True)
+    instrumentation.instrument_engine(async_read_engine)
+    admission.install_deadlines(async_read_engine)
+else:
+    read_engine, async_read_engine = engine, async_engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+
+"""read staleness policy"""
+
+READ_STALENESS_POLICY = os.getenv("READ_STALENESS_POLICY", "read_your_writes")
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+if READ_STALENESS_POLICY not in ("replica", "read_your_writes", "primary"):
+    raise ValueError(f"Unknown READ_STALENESS_POLICY {READ_STALENESS_POLICY!r}")
+
+
+class RecentWrites:
+    """User ids this process wrote within the last ``window`` seconds."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._written: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def note(self, user_ids: Iterable[int]):
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                self._written[user_id] = now
+                self._written.move_to_end(user_id)
+            # Oldest first, so expired entries are always at the front.
+            while self._written:
+                user_id, written_at = next(iter(self._written.items()))
+                if now - written_at < self.window:
+                    break
+                del self._written[user_id]
+
+    def recent(self, user_id: int) -> bool:
+        with self._lock:
+            written_at = self._written.get(user_id)
+        return written_at is not None and time.monotonic() - written_at < self.window
+
+    def clear(self):
+        with self._lock:
+            self._written.clear()
+
+
+recent_writes = RecentWrites(READ_YOUR_WRITES_SECONDS)
+
+
+def reads_from_primary(user_id: Optional[int]) -> bool:
+    if READ_STALENESS_POLICY == "primary":
+        return True
+    if READ_STALENESS_POLICY == "replica" or user_id is None:
+        return False
+    return recent_writes.recent(user_id)
+
+
+def _path_user_id(request: Request) -> Optional[int]:
+    try:
+        return int(request.path_params["user_id"])
+    except (KeyError, ValueError):
+        return None
+
+
+def async_read_session_factory(user_id: Optional[int] = None):
+    return AsyncSessionLocal if reads_from_primary(user_id) else AsyncReadSessionLocal
+
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -20,3 +130,30 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_read_db(request: Request):
+    db = SessionLocal() if reads_from_primary(_path_user_id(request)) else ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(request: Request):
+    async with async_read_session_factory(_path_user_id(request))() as db:
+        yield db
+
+
+def pool_status():
+    """Pool counters for the sync and async engines, write and read side."""
+    status = {
+        "sync": db_config.pool_status(engine),
+        "async": db_config.pool_status(async_engine),
+    }
+    if read_engine is not engine:
+        status["sync_read"] = db_config.pool_status(read_engine)
+        status["async_read"] = db_config.pool_status(async_read_engine)
+    return status
@@ -0,0 +1,233 @@
+"""Digital Wallet Database Engine Configuration Module
+
+Engine settings come from the environment so the service can be pointed
+at another file or backend without code changes:
+
+    DATABASE_URL            sync SQLAlchemy URL (default sqlite:///./wallet.db)
+    ASYNC_DATABASE_URL      async URL, derived from DATABASE_URL when unset
+    DB_POOL_SIZE            connections kept open per engine (default 5)
+    DB_MAX_OVERFLOW         extra connections allowed under burst (default 10)
+    DB_POOL_TIMEOUT         seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE         seconds before a connection is replaced (default -1, never)
+    SQLITE_PRAGMA_PROFILE   one of PRAGMA_PROFILES (default "wal")
+    READ_DATABASE_URL       URL for read-only routes (default: a ``mode=ro``
+                            view of a SQLite DATABASE_URL, else DATABASE_URL
+                            itself on a separate pool); point it at a replica
+    ASYNC_READ_DATABASE_URL async read URL, derived from READ_DATABASE_URL when unset
+    ARCHIVE_PATH            SQLite file attached as schema ``archive`` to every
+                            SQLite connection (default unset: no archive; see
+                            ``archive``)
+
+Individual pragmas of the chosen profile can be overridden with
+SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT,
+SQLITE_CACHE_SIZE and SQLITE_MMAP_SIZE.
+"""
+
+import os
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./wallet.db")
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+
+SQLITE_PRAGMA_PROFILE = os.getenv("SQLITE_PRAGMA_PROFILE", "wal")
+
+"""SQLite pragma profiles applied to every new connection"""
+
+PRAGMA_PROFILES: Dict[str, Dict[str, object]] = {
+    # SQLite's own defaults: rollback journal, fsync on every commit.
+    "legacy": {},
+    # Readers never block the writer; fsync only at checkpoints.
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+    },
+    # WAL concurrency with an fsync on every commit.
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+    },
+}
+
+_PRAGMA_ENV_OVERRIDES = {
+    "journal_mode": "SQLITE_JOURNAL_MODE",
+    "synchronous": "SQLITE_SYNCHRONOUS",
+    "busy_timeout": "SQLITE_BUSY_TIMEOUT",
+    "cache_size": "SQLITE_CACHE_SIZE",
+    "mmap_size": "SQLITE_MMAP_SIZE",
+}
+
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def _is_sqlite_memory(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def async_url(url: str) -> str:
+    """Swap the driver of a sync URL for its async counterpart."""
+    parsed = make_url(url)
+    if parsed.drivername in _ASYNC_DRIVERS.values():
+        return url
+    backend = parsed.get_backend_name()
+    if backend not in _ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {backend!r}; set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=_ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_url(DATABASE_URL)
+
+
+def read_only_url(url: str) -> Optional[str]:
+    """Read-only view of ``url``, or None when it cannot have one.
+
+    A SQLite file is reopened as a ``mode=ro`` URI; under WAL such
+    connections read a committed snapshot without ever taking the write
+    lock. In-memory SQLite databases are private to their connection, so
+    they have no separate read side. Other backends are returned as is.
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite":
+        return url
+    if _is_sqlite_memory(parsed):
+        return None
+    if parsed.query.get("uri") == "true":
+        return url
+    database = "file:" + quote(os.path.abspath(parsed.database))
+    return parsed.set(database=database, query={**parsed.query, "mode": "ro", "uri": "true"}).render_as_string(
+        hide_password=False
+    )
+
+
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL") or read_only_url(DATABASE_URL)
+ASYNC_READ_DATABASE_URL = os.getenv("ASYNC_READ_DATABASE_URL") or (
+    async_url(READ_DATABASE_URL) if READ_DATABASE_URL else None
+)
+
+
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH") or None
+
+
+def sqlite_pragmas(profile: Optional[str] = None) -> Dict[str, object]:
+    """Resolve a pragma profile, applying any per-pragma environment overrides."""
+    profile = profile or SQLITE_PRAGMA_PROFILE
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f"Unknown SQLite pragma profile {profile!r}; expected one of {sorted(PRAGMA_PROFILES)}")
+    pragmas = dict(PRAGMA_PROFILES[profile])
+    for name, env_var in _PRAGMA_ENV_OVERRIDES.items():
+        value = os.getenv(env_var)
+        if value:
+            pragmas[name] = value
+    return pragmas
+
+
+def engine_kwargs(url: str) -> Dict[str, object]:
+    """Connection and pool arguments for ``create_engine`` / ``create_async_engine``."""
+    parsed = make_url(url)
+    kwargs: Dict[str, object] = {}
+    if parsed.get_backend_name() == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if not _is_sqlite_memory(parsed):
+        kwargs.update(
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+        )
+    return kwargs
+
+
+def install_sqlite_pragmas(engine: Engine, pragmas: Dict[str, object]):
+    """Run ``PRAGMA name=value`` on every new DBAPI connection of ``engine``."""
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def install_archive_attach(engine: Engine):
+    """ATTACH ``ARCHIVE_PATH`` as ``archive`` on connections of ``engine``.
+
+    Done at checkout rather than connect so ``archive.configure`` takes
+    effect on connections already in the pool; a connection re-attaches
+    only when the path changed.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "checkout")
+    def _attach_archive(dbapi_connection, connection_record, connection_proxy):
+        path = ARCHIVE_PATH
+        attached = connection_record.info.get("archive_path")
+        if path is None or path == attached:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            if attached is not None:
+                cursor.execute("DETACH DATABASE archive")
+            cursor.execute("ATTACH DATABASE ? AS archive", (path,))
+        finally:
+            cursor.close()
+        connection_record.info["archive_path"] = path
+
+
+def read_pragmas(profile: Optional[str] = None) -> Dict[str, object]:
+    """Pragmas for read-only connections: the profile minus anything that writes."""
+    pragmas = {name: value for name, value in sqlite_pragmas(profile).items()
+               if name not in ("journal_mode", "synchronous")}
+    pragmas["query_only"] = "ON"
+    return pragmas
+
+
+def build_engine(url: Optional[str] = None, profile: Optional[str] = None, read_only: bool = False) -> Engine:
+    url = url or DATABASE_URL
+    engine = create_engine(url, **engine_kwargs(url))
+    install_sqlite_pragmas(engine, read_pragmas(profile) if read_only else sqlite_pragmas(profile))
+    install_archive_attach(engine)
+    return engine
+
+
+def build_async_engine(url: Optional[str] = None, profile: Optional[str] = None, read_only: bool = False) -> AsyncEngine:
+    url = url or ASYNC_DATABASE_URL
+    engine = create_async_engine(url, **engine_kwargs(url))
+    install_sqlite_pragmas(engine.sync_engine, read_pragmas(profile) if read_only else sqlite_pragmas(profile))
+    install_archive_attach(engine.sync_engine)
+    return engine
+
+
+def pool_status(engine) -> Dict[str, object]:
+    """Snapshot of an engine's connection pool counters."""
+    if isinstance(engine, AsyncEngine):
+        engine = engine.sync_engine
+    pool = engine.pool
+    stats: Dict[str, object] = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        counter = getattr(pool, name, None)
+        if callable(counter):
+            stats[name] = counter()
+    return stats
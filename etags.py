@@ -0,0 +1,30 @@
+"""Digital Wallet conditional GETs
+
+Clients polling ``GET /users/{id}`` and ``GET /wallet/{id}/balance`` send
+back the ``ETag`` of their last response as ``If-None-Match`` and get an
+empty ``304`` while nothing changed. The tag is strong and built from the
+account's version (``hot_accounts.total_version``), which every write to
+the user row or its balance slots bumps. ``crud.get_user_version``
+answers it from the balance cache or a read of the balance and version,
+so a ``304`` never loads the ``User`` row or encodes a body.
+"""
+
+from typing import Optional
+
+from fastapi.responses import Response
+
+
+def etag(user_id: int, version: int) -> str:
+    return f'"{user_id}.{version}"'
+
+
+def matches(if_none_match: Optional[str], tag: str) -> bool:
+    """Whether ``If-None-Match`` names ``tag``; weak comparison, as RFC 9110 asks for this header."""
+    if not if_none_match:
+        return False
+    candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+    return "*" in candidates or tag in candidates or f"W/{tag}" in candidates
+
+
+def not_modified(tag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": tag})
@@ -0,0 +1,240 @@
+"""Digital Wallet hot-account balance sharding
+
+Accounts with heavy fan-in (merchants receiving thousands of transfers a
+minute) can be designated hot. A hot account's balance is split across
+``balance_slots`` rows: credits add to a randomly chosen slot instead of
+``users.balance``, so concurrent credits rarely touch the same row.
+Debits first try ``users.balance`` and, when it does not cover them,
+sweep the slots into it and try again. The account's exact total is
+always ``users.balance`` plus the sum of its slots, which is what
+``get_user_balance`` returns.
+Each slot also keeps a version, bumped by every credit to it, so the
+account's version (``total_version``) moves with each write without
+credits touching ``users``.
+
+A background consolidator periodically sweeps every hot account's slots
+back into ``users.balance`` so the main row stays close to the total.
+
+    HOT_ACCOUNTS                      ids to designate at startup, e.g. "17,42:32"
+                                      (``id:slots``; slots default to HOT_ACCOUNT_SLOTS)
+    HOT_ACCOUNT_SLOTS                 default slots per hot account (default 16)
+    HOT_ACCOUNT_CONSOLIDATE_INTERVAL  seconds between consolidation runs (default 1)
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+from typing import Dict, List, Tuple
+
+from sqlalchemy import Float, bindparam, cast, delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from balance_cache import balance_cache
+from models import BalanceSlot, User
+
+HOT_ACCOUNT_SLOTS = int(os.getenv("HOT_ACCOUNT_SLOTS", "16"))
+HOT_ACCOUNT_CONSOLIDATE_INTERVAL = float(os.getenv("HOT_ACCOUNT_CONSOLIDATE_INTERVAL", "1"))
+
+logger = logging.getLogger(__name__)
+
+
+def parse_hot_accounts(text: str, default_slots: int = HOT_ACCOUNT_SLOTS) -> Dict[int, int]:
+    """Parse ``17,42:32`` into ``{17: default_slots, 42: 32}``."""
+    accounts = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        user_id, _, slots = part.partition(":")
+        accounts[int(user_id)] = int(slots) if slots else default_slots
+    return accounts
+
+
+class HotAccountRegistry:
+    """In-process map of hot account id -> slot count.
+
+    A stale view is harmless: a credit for an account this process does
+    not know is hot goes to ``users.balance``, which is still part of the
+    total, and a credit to a slot that no longer exists falls back to it.
+    """
+
+    def __init__(self):
+        self._slots: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def slots(self, user_id: int) -> int:
+        return self._slots.get(user_id, 0)
+
+    def accounts(self) -> List[int]:
+        with self._lock:
+            return sorted(self._slots)
+
+    def set(self, user_id: int, slots: int):
+        with self._lock:
+            self._slots[user_id] = slots
+
+    def remove(self, user_id: int):
+        with self._lock:
+            self._slots.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+
+
+registry = HotAccountRegistry()
+
+
+"""statements"""
+
+def total_balance():
+    """``users.balance`` plus the sum of the account's slots (0 for normal accounts)."""
+    slots = select(func.sum(BalanceSlot.balance)).where(BalanceSlot.user_id == User.id).scalar_subquery()
+    return cast(User.balance + func.coalesce(slots, 0.0), Float).label("balance")
+
+
+def total_version():
+    """``users.version`` plus the versions of the account's slots; changes with every write to either."""
+    slots = select(func.sum(BalanceSlot.version)).where(BalanceSlot.user_id == User.id).scalar_subquery()
+    return (User.version + func.coalesce(slots, 0)).label("version")
+
+
+def slot_versions_stmt(user_id: int):
+    return select(func.coalesce(func.sum(BalanceSlot.version), 0)).where(BalanceSlot.user_id == user_id)
+
+
+def total_balance_stmt(user_id: int):
+    """The account's balance and version, read together so they always match."""
+    return select(total_balance(), total_version()).where(User.id == user_id)
+
+
+# SQLite's RETURNING hands back integral REAL values as ints; keep them floats.
+# The slot's own balance and version, not the account's; see ``total_balance_stmt``.
+RETURNED_SLOT_STATE = (cast(BalanceSlot.balance, Float).label("balance"), BalanceSlot.version)
+
+
+def credit_stmt(user_id: int, slots: int, amount: float):
+    """Add ``amount`` to one randomly chosen slot of a hot account."""
+    return (
+        update(BalanceSlot)
+        .where(BalanceSlot.user_id == user_id, BalanceSlot.slot == random.randrange(slots))
+        .values(balance=BalanceSlot.balance + amount, version=BalanceSlot.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _slot_balances_stmt(user_id: int):
+    return select(BalanceSlot.slot, BalanceSlot.balance).where(
+        BalanceSlot.user_id == user_id, BalanceSlot.balance != 0
+    )
+
+
+def _drain_stmt():
+    # Subtract exactly what was read, so credits that land between the read
+    # and this UPDATE stay in their slot instead of being lost.
+    table = BalanceSlot.__table__
+    return (
+        update(table)
+        .where(table.c.user_id == bindparam("uid"), table.c.slot == bindparam("slot_no"))
+        .values(balance=table.c.balance - bindparam("taken"), version=table.c.version + 1)
+    )
+
+
+def _sweep_plan(user_id: int, rows) -> Tuple[List[dict], float]:
+    params = [{"uid": user_id, "slot_no": slot, "taken": balance} for slot, balance in rows]
+    return params, sum(balance for _, balance in rows)
+
+
+def _main_credit_stmt(user_id: int, amount: float):
+    return (
+        update(User)
+        .where(User.id == user_id)
+        .values(balance=User.balance + amount, version=User.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+"""sweeping slots into users.balance"""
+
+def sweep(db: Session, user_id: int) -> float:
+    """Move a hot account's slot balances into ``users.balance``; returns the amount moved."""
+    params, moved = _sweep_plan(user_id, db.execute(_slot_balances_stmt(user_id)).all())
+    if params:
+        db.execute(_drain_stmt(), params)
+        db.execute(_main_credit_stmt(user_id, moved))
+    return moved
+
+
+async def sweep_async(db: AsyncSession, user_id: int) -> float:
+    params, moved = _sweep_plan(user_id, (await db.execute(_slot_balances_stmt(user_id))).all())
+    if params:
+        await db.execute(_drain_stmt(), params)
+        await db.execute(_main_credit_stmt(user_id, moved))
+    return moved
+
+
+"""designation"""
+
+def designate(db: Session, user_id: int, slots: int = HOT_ACCOUNT_SLOTS):
+    """Make ``user_id`` a hot account with ``slots`` sub-balances (idempotent)."""
+    existing = set(db.scalars(select(BalanceSlot.slot).where(BalanceSlot.user_id == user_id)))
+    db.add_all(BalanceSlot(user_id=user_id, slot=slot, balance=0.0) for slot in range(slots) if slot not in existing)
+    db.commit()
+    registry.set(user_id, max(slots, len(existing)))
+
+
+def _fold_versions_stmt(user_id: int):
+    # Keeps the account's version from going back to an earlier value once its slots are deleted.
+    return update(User).where(User.id == user_id).values(version=total_version() + 1)
+
+
+def release(db: Session, user_id: int):
+    """Fold a hot account back into a single balance row."""
+    registry.remove(user_id)
+    sweep(db, user_id)
+    db.execute(_fold_versions_stmt(user_id))
+    db.execute(delete(BalanceSlot).where(BalanceSlot.user_id == user_id))
+    db.commit()
+    balance_cache.invalidate(user_id)
+
+
+def load(db: Session, configured: Dict[int, int] = None):
+    """Fill the registry from ``balance_slots`` and designate configured accounts."""
+    rows = db.execute(select(BalanceSlot.user_id, func.count()).group_by(BalanceSlot.user_id)).all()
+    for user_id, slots in rows:
+        registry.set(user_id, slots)
+    if configured is None:
+        configured = parse_hot_accounts(os.getenv("HOT_ACCOUNTS", ""))
+    for user_id, slots in configured.items():
+        if db.get(User, user_id) is None:
+            logger.warning("HOT_ACCOUNTS names unknown user %d", user_id)
+            continue
+        designate(db, user_id, slots)
+
+
+"""background consolidation"""
+
+async def consolidate(session_factory) -> float:
+    """Sweep every hot account once, one short transaction per account."""
+    moved = 0.0
+    for user_id in registry.accounts():
+        async with session_factory() as db:
+            swept = await sweep_async(db, user_id)
+            await db.commit()
+        if swept:
+            # The total is unchanged, but users.balance and the version moved.
+            balance_cache.invalidate(user_id)
+        moved += swept
+    return moved
+
+
+async def consolidate_forever(session_factory, interval: float = HOT_ACCOUNT_CONSOLIDATE_INTERVAL):
+    """Background task: consolidate hot accounts every ``interval`` seconds."""
+    while True:
+        try:
+            await consolidate(session_factory)
+        except Exception:
+            logger.exception("hot account consolidation failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,159 @@
+"""Digital Wallet idempotency keys for money-moving requests
+
+A client may send an ``Idempotency-Key`` header with
+``POST /wallet/{user_id}/add``, ``/withdraw`` and ``/transfer/``. The key,
+a hash of the request and the resulting transaction are written in the
+same database transaction as the ledger rows, so a retry either finds the
+stored result with one primary-key read or runs the operation for the
+first time; it can never apply the operation twice.
+
+Keys are scoped to the account the request moves money out of or into
+(the user, or a transfer's sender) and stored as ``<owner>:<key>``, so
+the same header value sent for another account never replays its
+response. Looking a key up only reads: an expired row is overwritten by
+the upsert that stores the new result, inside the operation's own
+transaction, so a request never writes outside the group writer.
+
+    IDEMPOTENCY_KEY_TTL            seconds a key is honoured (default 86400)
+    IDEMPOTENCY_PURGE_INTERVAL     seconds between purge runs (default 300)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import schemas
+from models import IdempotencyKey, Transaction
+
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "300"))
+PURGE_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotentRequest(NamedTuple):
+    key: str
+    request_hash: str
+
+
+class KeyInUse(Exception):
+    """A concurrent request with the same key stored its result first."""
+
+
+def build_request(key: Optional[str], operation: str, owner: int, **params) -> Optional[IdempotentRequest]:
+    """Fingerprint an operation and its parameters, under ``owner``'s keys; None when no key was sent."""
+    if not key:
+        return None
+    payload = json.dumps({"operation": operation, "params": params}, sort_keys=True, default=str)
+    return IdempotentRequest(f"{owner}:{key}", hashlib.sha256(payload.encode()).hexdigest())
+
+
+_UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def record_for(dialect, request: IdempotentRequest, transaction: Transaction):
+    """Upsert storing ``transaction`` as the result of ``request``, once it has been flushed.
+
+    It replaces a row under the same key only when that row has expired;
+    a live row is left alone and the statement changes nothing.
+    """
+    values = {
+        "key": request.key,
+        "request_hash": request.request_hash,
+        "response_body": schemas.Transaction.model_validate(transaction).model_dump_json(),
+        "created_at": datetime.utcnow(),
+    }
+    stmt = _UPSERTS[dialect.name](IdempotencyKey).values(**values)
+    return stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.key],
+        set_={name: stmt.excluded[name] for name in values if name != "key"},
+        where=IdempotencyKey.created_at < _cutoff(),
+    )
+
+
+async def store_record(db: AsyncSession, request: IdempotentRequest, transaction: Transaction):
+    """Write the record inside the operation's transaction; ``KeyInUse`` if a live one exists."""
+    if (await db.execute(record_for(db.get_bind().dialect, request, transaction))).rowcount == 0:
+        raise KeyInUse(request.key)
+
+
+def _cutoff() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+
+
+async def replay(db: AsyncSession, request: IdempotentRequest) -> Optional[dict]:
+    """Stored result for ``request``, or None if the key is new or has expired."""
+    row = await db.get(IdempotencyKey, request.key)
+    if row is None or row.created_at < _cutoff():
+        return None
+    if row.request_hash != request.request_hash:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    return json.loads(row.response_body)
+
+
+async def execute(db: AsyncSession, request: Optional[IdempotentRequest],
+                  operation: Callable[[Optional[IdempotentRequest]], Awaitable]):
+    """Return the stored result for ``request`` or run ``operation`` once.
+
+    If a concurrent retry with the same key commits first, storing our
+    record raises ``KeyInUse``, the whole transaction (ledger rows
+    included) rolls back, and the winner's stored result is returned
+    instead.
+    """
+    if request is None:
+        return await operation(None)
+    stored = await replay(db, request)
+    if stored is not None:
+        return stored
+    # Release the connection: under group commit the operation runs on the
+    # writer's session and this request only waits.
+    await db.rollback()
+    try:
+        return await operation(request)
+    except KeyInUse:
+        await db.rollback()
+        stored = await replay(db, request)
+        if stored is None:
+            raise
+        return stored
+
+
+"""expired key purging"""
+
+async def purge_expired(db: AsyncSession) -> int:
+    """Delete expired keys in bounded batches so writers are never blocked for long."""
+    purged = 0
+    cutoff = _cutoff()
+    while True:
+        batch = select(IdempotencyKey.key).where(IdempotencyKey.created_at < cutoff).limit(PURGE_BATCH_SIZE)
+        result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key.in_(batch)))
+        await db.commit()
+        purged += result.rowcount
+        if result.rowcount < PURGE_BATCH_SIZE:
+            return purged
+
+
+async def purge_forever(session_factory, interval: float = IDEMPOTENCY_PURGE_INTERVAL):
+    """Background task: purge expired keys every ``interval`` seconds."""
+    while True:
+        try:
+            async with session_factory() as db:
+                purged = await purge_expired(db)
+            if purged:
+                logger.info("purged %d expired idempotency keys", purged)
+        except Exception:
+            logger.exception("idempotency key purge failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,209 @@
+"""Digital Wallet per-request SQL instrumentation
+
+Engine event hooks count statements, database time and commits, and a
+pool wrapper measures how long each connection checkout waited. All of
+it is attributed to the HTTP request running in the current context and
+aggregated per route for ``GET /metrics``.
+
+    SLOW_QUERY_MS   log statements slower than this many ms (default 0, off)
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from metrics import Histogram
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+HANDLER_SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+slow_query_log = logging.getLogger("wallet.slow_query")
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_seconds", "commits", "pool_wait_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.commits = 0
+        self.pool_wait_seconds = 0.0
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("wallet_request_stats", default=None)
+
+
+def begin_request() -> Tuple[RequestStats, contextvars.Token]:
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token: contextvars.Token):
+    _current.reset(token)
+
+
+"""engine hooks"""
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._wallet_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_wallet_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_log.warning("slow query (%.1f ms): %s; parameters=%r", elapsed * 1000, statement, parameters)
+
+
+def _on_commit(conn):
+    stats = _current.get()
+    if stats is not None:
+        stats.commits += 1
+
+
+def _timed_pool_class(pool_class: type) -> type:
+    """Subclass of ``pool_class`` recording how long ``connect()`` waited."""
+    if pool_class not in _timed_pool_classes:
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                return pool_class.connect(self)
+            finally:
+                stats = _current.get()
+                if stats is not None:
+                    stats.pool_wait_seconds += time.perf_counter() - started
+
+        _timed_pool_classes[pool_class] = type(
+            f"Timed{pool_class.__name__}", (pool_class,), {"connect": connect, "_wallet_timed": True}
+        )
+    return _timed_pool_classes[pool_class]
+
+
+_timed_pool_classes: Dict[type, type] = {}
+
+
+def instrument_engine(engine):
+    """Attach statement, commit and pool-wait hooks to a sync or async engine."""
+    if isinstance(engine, AsyncEngine):
+        engine = engine.sync_engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "commit", _on_commit)
+    if not getattr(engine.pool, "_wallet_timed", False):
+        # recreate() on dispose() keeps the instrumented class.
+        engine.pool.__class__ = _timed_pool_class(type(engine.pool))
+    return engine
+
+
+"""per-route aggregation"""
+
+class RouteMetrics:
+    def __init__(self):
+        self.requests: Dict[int, int] = {}
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.commits = 0
+        self.pool_wait_seconds = 0.0
+        self.handler_seconds = Histogram(HANDLER_SECONDS_BUCKETS)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self._lock = threading.Lock()
+        self.last_request: Optional[RequestStats] = None
+
+    def record(self, method: str, route: str, status_code: int, stats: RequestStats, handler_seconds: float):
+        with self._lock:
+            metrics = self._routes.setdefault((method, route), RouteMetrics())
+            metrics.requests[status_code] = metrics.requests.get(status_code, 0) + 1
+            metrics.statements += stats.statements
+            metrics.db_seconds += stats.db_seconds
+            metrics.commits += stats.commits
+            metrics.pool_wait_seconds += stats.pool_wait_seconds
+            self.last_request = stats
+        metrics.handler_seconds.observe(handler_seconds)
+
+    def routes(self) -> List[Tuple[Tuple[str, str], RouteMetrics]]:
+        with self._lock:
+            return sorted(self._routes.items())
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self.last_request = None
+
+
+registry = MetricsRegistry()
+
+
+"""Prometheus text exposition"""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class PrometheusWriter:
+    def __init__(self):
+        self._lines: List[str] = []
+        self._declared = set()
+
+    def _declare(self, name: str, kind: str, help_text: str):
+        if name not in self._declared:
+            self._declared.add(name)
+            self._lines.append(f"# HELP {name} {help_text}")
+            self._lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, kind: str, help_text: str, value: float, **labels):
+        self._declare(name, kind, help_text)
+        self._lines.append(f"{name}{_labels(**labels)} {value}")
+
+    def histogram(self, name: str, help_text: str, snapshot: dict, **labels):
+        self._declare(name, "histogram", help_text)
+        for bound, count in snapshot["buckets"].items():
+            self._lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {count}")
+        self._lines.append(f"{name}_sum{_labels(**labels)} {snapshot['sum']}")
+        self._lines.append(f"{name}_count{_labels(**labels)} {snapshot['count']}")
+
+    def render(self) -> str:
+        return "\n".join(self._lines) + "\n"
+
+
+def write_route_metrics(out: PrometheusWriter):
+    routes = [({"method": method, "route": route}, metrics) for (method, route), metrics in registry.routes()]
+    for labels, metrics in routes:
+        for status_code, count in sorted(metrics.requests.items()):
+            out.sample("wallet_http_requests_total", "counter", "HTTP requests handled.", count,
+                       status=status_code, **labels)
+    counters = (
+        ("wallet_db_statements_total", "SQL statements executed.", "statements"),
+        ("wallet_db_seconds_total", "Time spent executing SQL.", "db_seconds"),
+        ("wallet_db_commits_total", "Database commits.", "commits"),
+        ("wallet_db_pool_wait_seconds_total", "Time spent waiting for a pooled connection.", "pool_wait_seconds"),
+    )
+    for name, help_text, attribute in counters:
+        for labels, metrics in routes:
+            out.sample(name, "counter", help_text, getattr(metrics, attribute), **labels)
+    for labels, metrics in routes:
+        out.histogram("wallet_http_handler_seconds", "Request handling time.", metrics.handler_seconds.snapshot(),
+                      **labels)
@@ -1,20 +1,116 @@
 from fastapi import FastAPI
-from database import Base, engine
-import models,schemas,crud
+from database import engine
+import models,schemas,crud,async_crud,admission,etags,idempotency,export,group_commit,instrumentation,hot_accounts,schema,outbox,serialization,auth,passwords
 from sqlalchemy.orm import Session
-from database import get_db
-from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_read_db, get_async_read_db, async_read_session_factory, SessionLocal, AsyncSessionLocal, pool_status
+from balance_cache import balance_cache
+from fastapi import Depends, Header, Query, Request, Response
 from typing import List, Optional
 from fastapi import HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from datetime import datetime
+from contextlib import asynccontextmanager
+import asyncio
+import time
 
 
 
 
-# Create the database tables
-Base.metadata.create_all(bind=engine)
+# Refuse to start on a database older than this code; scripts/migrate.py upgrades it
+schema.startup_check(engine)
 
-app = FastAPI(title="Digital Wallet API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with SessionLocal() as db:
+        hot_accounts.load(db)
+    await passwords.dummy_hash()
+    purger = asyncio.create_task(idempotency.purge_forever(AsyncSessionLocal))
+    consolidator = asyncio.create_task(hot_accounts.consolidate_forever(AsyncSessionLocal))
+    outbox.start()
+    try:
+        yield
+    finally:
+        purger.cancel()
+        consolidator.cancel()
+        await outbox.shutdown()
+        await group_commit.shutdown()
+        passwords.pool.shutdown()
+
+app = FastAPI(title="Digital Wallet API", version="1.0.0", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def sql_instrumentation(request: Request, call_next):
+    stats, token = instrumentation.begin_request()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        instrumentation.end_request(token)
+        route = request.scope.get("route")
+        instrumentation.registry.record(
+            request.method, getattr(route, "path", "<unmatched>"), status_code, stats,
+            time.perf_counter() - started,
+        )
+
+
+# Added last so it runs first: a shed request costs no routing, SQL hooks or handler.
+app.add_middleware(admission.AdmissionMiddleware)
+
+
+@app.exception_handler(admission.DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: admission.DeadlineExceeded):
+    return admission.unavailable("Request deadline exceeded")
+
+
+"Prometheus metrics: per-route SQL stats, pools, caches, the group-commit writer, the outbox, password hashing and admission control"
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    out = instrumentation.PrometheusWriter()
+    instrumentation.write_route_metrics(out)
+    for engine_name, stats in pool_status().items():
+        for field in ("size", "checkedin", "checkedout", "overflow"):
+            if field in stats:
+                out.sample(f"wallet_db_pool_{field}", "gauge", f"Connection pool {field}.", stats[field], engine=engine_name)
+    for field, value in balance_cache.stats().items():
+        kind = "gauge" if field == "size" else "counter"
+        name = "wallet_balance_cache_size" if field == "size" else f"wallet_balance_cache_{field}_total"
+        out.sample(name, kind, f"Balance cache {field}.", value)
+    if group_commit.writer is not None:
+        writer_stats = group_commit.writer.stats()
+        out.sample("wallet_group_commit_queue_depth", "gauge", "Operations waiting for the writer.", writer_stats["queue_depth"])
+        out.histogram("wallet_group_commit_batch_size", "Operations per group commit.", writer_stats["batch_size"])
+        out.histogram("wallet_group_commit_queue_wait_seconds", "Time from enqueue to batch start.", writer_stats["queue_wait_seconds"])
+    if outbox.dispatcher is not None:
+        outbox_stats = outbox.dispatcher.stats()
+        for field in ("delivered", "failed", "dead"):
+            out.sample(f"wallet_outbox_{field}_total", "counter", f"Outbox events {field}.", outbox_stats[field])
+        out.sample("wallet_outbox_lag_seconds", "gauge", "Age of the oldest due event at the last poll.", outbox_stats["lag_seconds"])
+        out.histogram("wallet_outbox_delivery_lag_seconds", "Time from commit to delivery.", outbox_stats["delivery_lag_seconds"])
+    for field, value in passwords.pool.stats().items():
+        if field == "pending":
+            out.sample("wallet_password_hash_pending", "gauge", "Hash and verify calls queued or running.", value)
+        else:
+            out.sample(f"wallet_password_hash_{field}_total", "counter", f"Password hashing pool {field}.", value)
+    for field, value in auth.token_cache.stats().items():
+        kind = "gauge" if field == "size" else "counter"
+        name = "wallet_token_cache_size" if field == "size" else f"wallet_token_cache_{field}_total"
+        out.sample(name, kind, f"Verified-token cache {field}.", value)
+    for limiter in admission.limiters():
+        admission_stats = limiter.stats()
+        out.sample("wallet_admission_in_flight", "gauge", "Admitted requests running.", admission_stats["in_flight"], limit=limiter.name)
+        out.sample("wallet_admission_queue_depth", "gauge", "Requests waiting for admission.", admission_stats["queue_depth"], limit=limiter.name)
+        out.sample("wallet_admission_admitted_total", "counter", "Requests admitted.", admission_stats["admitted"], limit=limiter.name)
+        for reason, count in admission_stats["shed"].items():
+            out.sample("wallet_admission_shed_total", "counter", "Requests turned away with 503.", count, limit=limiter.name, reason=reason)
+        out.histogram("wallet_admission_queue_wait_seconds", "Time from arrival to admission.", admission_stats["queue_wait_seconds"], limit=limiter.name)
+    out.sample("wallet_request_deadline_exceeded_total", "counter", "Requests failed by their deadline.", admission.deadlines_exceeded)
+    return PlainTextResponse(out.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def read_root():
@@ -24,67 +120,147 @@ def read_root():
 
 "create_user for user registration"
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await async_crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return crud.create_user(db=db, user=user)
+    # Release the connection while the password is hashed on the hashing pool.
+    await db.rollback()
+    hashed_password = await passwords.hash_async(user.password)
+    return await async_crud.create_user(db, user, hashed_password)
+
+"log in with username and password for a bearer token"
+
+@app.post("/auth/login", response_model=schemas.Token)
+async def login(credentials: schemas.LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    return await auth.login(db, credentials.username, credentials.password)
 
-"get user by id"
+@app.get("/auth/me", response_model=schemas.TokenUser)
+async def read_token_user(user_id: int = Depends(auth.current_user_id)):
+    return {"user_id": user_id}
+
+"get user by id; If-None-Match with the last ETag answers 304 while the user is unchanged"
 
 @app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
+def read_user(user_id: int, response: Response, if_none_match: Optional[str] = Header(None),
+              db: Session = Depends(get_read_db)):
+    if if_none_match:
+        version = crud.get_user_version(db, user_id=user_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        tag = etags.etag(user_id, version)
+        if etags.matches(if_none_match, tag):
+            return etags.not_modified(tag)
     db_user = crud.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    response.headers["ETag"] = etags.etag(user_id, crud.user_version(db, db_user))
     return db_user
 
 "update user details"
 
 @app.put("/users/{user_id}", response_model=schemas.User)
-def update_user(user_id: int, user_update: schemas.UserUpdate, db: Session = Depends(get_db)):
-    db_user = crud.update_user(db, user_id=user_id, user_update=user_update)
+async def update_user(user_id: int, user_update: schemas.UserUpdate, db: AsyncSession = Depends(get_async_db)):
+    hashed_password = await passwords.hash_async(user_update.password) if user_update.password else None
+    db_user = await async_crud.update_user(db, user_id=user_id, user_update=user_update, hashed_password=hashed_password)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
-"get userID balance details"
+"get userID balance details, now (with an ETag for If-None-Match) or as of ?at=<timestamp>"
 
 @app.get("/wallet/{user_id}/balance")
-def get_balance(user_id: int, db: Session = Depends(get_db)):
-    balance = crud.get_user_balance(db, user_id=user_id)
-    if balance is None:
+async def get_balance(user_id: int, response: Response, at: Optional[datetime] = None,
+                      if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_read_db)):
+    if at is not None:
+        balance = await async_crud.get_balance_at(db, user_id=user_id, at=at)
+        if balance is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return {"user_id": user_id, "balance": balance, "at": at}
+    state = await async_crud.get_balance_state(db, user_id=user_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="User not found")
+    balance, version = state
+    tag = etags.etag(user_id, version)
+    if etags.matches(if_none_match, tag):
+        return etags.not_modified(tag)
+    response.headers["ETag"] = tag
     return {"user_id": user_id, "balance": balance}
 
 
 "add money to wallet"
 
-@app.post("/wallet/{user_id}/add")
-def add_money(user_id: int, amount: float, description: Optional[str] = None, db: Session = Depends(get_db)):
-    transaction = crud.add_money(db, user_id=user_id, amount=amount, description=description)
+@app.post("/wallet/{user_id}/add", response_model=schemas.TransactionResult)
+async def add_money(user_id: int, amount: float, description: Optional[str] = None, idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    request = idempotency.build_request(idempotency_key, "add", owner=user_id, user_id=user_id, amount=amount, description=description)
+    transaction = await idempotency.execute(db, request, lambda idem: async_crud.add_money(
+        db, user_id=user_id, amount=amount, description=description, idempotency=idem))
     return {"message": "Money added successfully", "transaction": transaction}
 
 "withdraw money from wallet"
 
-@app.post("/wallet/{user_id}/withdraw")
-def withdraw_money(user_id: int, amount: float, description: Optional[str] = None, db: Session = Depends(get_db)):
-    transaction = crud.withdraw_money(db, user_id=user_id, amount=amount, description=description)
+@app.post("/wallet/{user_id}/withdraw", response_model=schemas.TransactionResult)
+async def withdraw_money(user_id: int, amount: float, description: Optional[str] = None, idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    request = idempotency.build_request(idempotency_key, "withdraw", owner=user_id, user_id=user_id, amount=amount, description=description)
+    transaction = await idempotency.execute(db, request, lambda idem: async_crud.withdraw_money(
+        db, user_id=user_id, amount=amount, description=description, idempotency=idem))
     return {"message": "Money withdrawn successfully", "transaction": transaction}
 
-"get the transaction of the user by userID using pagination"
+"get the transaction of the user by userID, newest first, using cursor pagination"
+
+@app.get("/transactions/{user_id}", response_model=schemas.TransactionPage) 
+async def get_transactions(user_id: int, cursor: Optional[str] = None, limit: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_read_db)):
+    transactions, next_cursor = await async_crud.get_transactions(db, user_id=user_id, cursor=cursor, limit=limit)
+    return serialization.page_response(transactions, next_cursor)
+
 
-@app.get("/transactions/{user_id}", response_model=List[schemas.Transaction]) 
-def get_transactions(user_id: int, skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    transactions = crud.get_transactions(db, user_id=user_id, skip=skip, limit=limit)
-    return transactions 
+"search a user's transactions by type, date, amount, counterparty and description text"
+
+@app.get("/transactions/{user_id}/search", response_model=schemas.TransactionPage)
+async def search_transactions(
+    user_id: int,
+    types: Optional[List[schemas.TransactionType]] = Query(None, alias="type"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    counterparty: Optional[int] = None,
+    q: Optional[str] = Query(None, max_length=200),
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    filters = schemas.TransactionSearch(types=types, start=start, end=end, min_amount=min_amount,
+                                        max_amount=max_amount, counterparty=counterparty, q=q)
+    transactions, next_cursor = await async_crud.search_transactions(db, user_id, filters, cursor=cursor, limit=limit)
+    return serialization.page_response(transactions, next_cursor)
+
+
+"stream a user's full transaction history as NDJSON or CSV"
+
+@app.get("/transactions/{user_id}/export")
+async def export_transactions(
+    user_id: int,
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    if not await async_crud.get_user(db, user_id=user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    return StreamingResponse(
+        export.stream_transactions(export.export_stmts(user_id, start, end), export_format,
+                                   session_factory=async_read_session_factory(user_id)),
+        media_type=export.MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="transactions-{user_id}.{export_format}"'},
+    )
 
 
 "Get transaction by transaction ID"
 
 @app.get("/transaction/{transaction_id}", response_model=schemas.Transaction)   
-def get_transaction(transaction_id: int, db: Session = Depends(get_db)):
-    db_transaction = crud.get_transaction(db, transaction_id=transaction_id)
+async def get_transaction(transaction_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    db_transaction = await async_crud.get_transaction(db, transaction_id=transaction_id)
     if db_transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found")  
     return db_transaction
@@ -92,26 +268,40 @@ def get_transaction(transaction_id: int, db: Session = Depends(get_db)):
 "Create a transaction (for transfers, payments, etc.)"
 
 @app.post("/transactions/", response_model=schemas.Transaction) 
-def create_transaction(transaction: schemas.TransactionCreate, db: Session = Depends(get_db)):
+async def create_transaction(transaction: schemas.TransactionCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if user exists
-    if not crud.get_user(db, user_id=transaction.user_id):
+    if not await async_crud.get_user(db, user_id=transaction.user_id):
         raise HTTPException(status_code=404, detail="User not found")   
-    db_transaction = crud.create_transaction(db, transaction=transaction, user_id=transaction.user_id)
+    db_transaction = await async_crud.create_transaction(db, transaction=transaction)
     return db_transaction
 
 "transfer money between users"
 
 "POST /transfer"
-@app.post("/transfer/")
-def transfer_money(sender_id: int, recipient_id: int, amount: float, description: Optional[str] = None, db: Session = Depends(get_db)):
-    transaction = crud.transfer_money(db, sender_id=sender_id, recipient_id=recipient_id, amount=amount, description=description)
+@app.post("/transfer/", response_model=schemas.TransactionResult)
+async def transfer_money(sender_id: int, recipient_id: int, amount: float, description: Optional[str] = None, idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    request = idempotency.build_request(idempotency_key, "transfer", owner=sender_id, sender_id=sender_id, recipient_id=recipient_id, amount=amount, description=description)
+    transaction = await idempotency.execute(db, request, lambda idem: async_crud.transfer_money(
+        db, sender_id=sender_id, recipient_id=recipient_id, amount=amount, description=description, idempotency=idem))
     if transaction is None:
         raise HTTPException(status_code=400, detail="Transfer failed")
     return {"message": "Transfer successful", "transaction": transaction}
 
+"POST /transfers/batch: many transfers, one commit"
+@app.post("/transfers/batch", response_model=schemas.BatchTransferResult)
+async def transfer_batch(batch: schemas.BatchTransferRequest, db: AsyncSession = Depends(get_async_db)):
+    return await async_crud.transfer_batch(db, batch.transfers, mode=batch.mode)
+
+@app.get("/transfers/{transfer_id}/full", response_model=schemas.TransferDetail)
+async def get_transfer_detail(transfer_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    detail = await async_crud.get_transfer_detail(db, transaction_id=transfer_id)
+    if detail is None:
+        raise HTTPException(status_code=404, detail="Transfer not found")
+    return detail
+
 @app.get("/transfer/{transfer_id}", response_model=schemas.Transaction)
-def get_transfer(transfer_id: int, db: Session = Depends(get_db)):
-    transaction = crud.get_transaction(db, transaction_id=transfer_id)
-    if transaction is None or transaction.transaction_type not in [schemas.TransactionType.TRANSFER_IN, schemas.TransactionType.TRANSFER_OUT]:
+async def get_transfer(transfer_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    transaction = await async_crud.get_transaction(db, transaction_id=transfer_id)
+    if transaction is None or transaction.transaction_type not in [models.TransactionType.TRANSFER_IN, models.TransactionType.TRANSFER_OUT]:
         raise HTTPException(status_code=404, detail="Transfer not found")
     return transaction
\ No newline at end of file
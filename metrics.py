@@ -0,0 +1,32 @@
+"""Digital Wallet in-process metrics primitives"""
+
+import bisect
+import threading
+from typing import Dict, Sequence
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        """Cumulative counts keyed by upper bound, plus ``sum`` and ``count``."""
+        with self._lock:
+            cumulative = {}
+            running = 0
+            for bound, count in zip(self.buckets + [float("inf")], self._counts):
+                running += count
+                cumulative["+Inf" if bound == float("inf") else repr(bound)] = running
+            return {"buckets": cumulative, "sum": self._sum, "count": self._count}
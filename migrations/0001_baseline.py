@@ -0,0 +1,120 @@
+"""Baseline: the schema as of the first migration
+
+Generated by ``scripts/migrate.py generate`` on 2026-10-17, then extended
+by hand for databases made by ``create_all`` before migrations existed:
+their ``transactions`` table may predate ``transfer_group`` and
+``balance_after``, and the search FTS table and its triggers (see
+``search``) are created here, rebuilt from the existing rows when new.
+"""
+
+from schema import add_column, create_index, create_table, execute
+
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts "
+    "USING fts5(description, content='transactions', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS transactions_fts_ai AFTER INSERT ON transactions BEGIN "
+    "INSERT INTO transactions_fts(rowid, description) VALUES (new.id, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS transactions_fts_ad AFTER DELETE ON transactions BEGIN "
+    "INSERT INTO transactions_fts(transactions_fts, rowid, description) VALUES ('delete', old.id, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS transactions_fts_au AFTER UPDATE OF description ON transactions BEGIN "
+    "INSERT INTO transactions_fts(transactions_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+    "INSERT INTO transactions_fts(rowid, description) VALUES (new.id, new.description); END",
+)
+
+
+def upgrade(conn):
+    create_table(conn, "idempotency_keys", """
+        CREATE TABLE idempotency_keys (
+            "key" VARCHAR NOT NULL,
+            request_hash VARCHAR NOT NULL,
+            response_body VARCHAR NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY ("key")
+        )
+    """)
+    create_index(conn, "ix_idempotency_keys_created_at", "idempotency_keys", ["created_at"])
+    create_table(conn, "users", """
+        CREATE TABLE users (
+            id INTEGER NOT NULL,
+            username VARCHAR NOT NULL,
+            email VARCHAR NOT NULL,
+            full_name VARCHAR,
+            hashed_password VARCHAR NOT NULL,
+            is_active INTEGER,
+            phone_number VARCHAR,
+            balance FLOAT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME,
+            PRIMARY KEY (id)
+        )
+    """)
+    create_index(conn, "ix_users_email", "users", ["email"], unique=True)
+    create_index(conn, "ix_users_id", "users", ["id"])
+    create_index(conn, "ix_users_username", "users", ["username"], unique=True)
+    create_table(conn, "balance_slots", """
+        CREATE TABLE balance_slots (
+            user_id INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            balance FLOAT NOT NULL,
+            PRIMARY KEY (user_id, slot),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+    """)
+    create_table(conn, "transactions", """
+        CREATE TABLE transactions (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            transaction_type VARCHAR(12) NOT NULL,
+            amount FLOAT NOT NULL,
+            description VARCHAR,
+            reference_transaction_id INTEGER,
+            recipient_user_id INTEGER,
+            sender_user_id INTEGER,
+            transfer_group VARCHAR(32),
+            balance_after FLOAT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id),
+            FOREIGN KEY(reference_transaction_id) REFERENCES transactions (id),
+            FOREIGN KEY(recipient_user_id) REFERENCES users (id),
+            FOREIGN KEY(sender_user_id) REFERENCES users (id)
+        )
+    """)
+    add_column(conn, "transactions", "transfer_group", "transfer_group VARCHAR(32)")
+    add_column(conn, "transactions", "balance_after", "balance_after FLOAT")
+    create_index(conn, "ix_transactions_id", "transactions", ["id"])
+    create_index(conn, "ix_transactions_transfer_group", "transactions", ["transfer_group"])
+    create_index(conn, "ix_transactions_user_amount", "transactions", ["user_id", "amount"])
+    create_index(conn, "ix_transactions_user_checkpoint", "transactions", ["user_id", "created_at", "id"],
+                 where="balance_after IS NOT NULL")
+    create_index(conn, "ix_transactions_user_created_id", "transactions", ["user_id", "created_at", "id"])
+    create_index(conn, "ix_transactions_user_recipient_created", "transactions",
+                 ["user_id", "recipient_user_id", "created_at"])
+    create_index(conn, "ix_transactions_user_sender_created", "transactions",
+                 ["user_id", "sender_user_id", "created_at"])
+    create_index(conn, "ix_transactions_user_type_created_id", "transactions",
+                 ["user_id", "transaction_type", "created_at", "id"])
+    create_table(conn, "outbox_events", """
+        CREATE TABLE outbox_events (
+            id INTEGER NOT NULL,
+            event_type VARCHAR NOT NULL,
+            transaction_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at DATETIME NOT NULL,
+            available_at DATETIME NOT NULL,
+            attempts INTEGER NOT NULL,
+            dead INTEGER NOT NULL,
+            last_error VARCHAR,
+            PRIMARY KEY (id),
+            FOREIGN KEY(transaction_id) REFERENCES transactions (id)
+        )
+    """)
+    create_index(conn, "ix_outbox_events_due", "outbox_events", ["dead", "available_at", "id"])
+
+    if conn.dialect.name == "sqlite":
+        fts_exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions_fts'"
+        ).first()
+        execute(conn, *FTS_DDL)
+        if not fts_exists:
+            execute(conn, "INSERT INTO transactions_fts(transactions_fts) VALUES ('rebuild')")
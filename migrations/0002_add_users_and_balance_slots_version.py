@@ -0,0 +1,11 @@
+"""add users and balance_slots version
+
+Generated by ``scripts/migrate.py generate`` on 2026-10-17.
+"""
+
+from schema import add_column
+
+
+def upgrade(conn):
+    add_column(conn, "users", "version", "version INTEGER DEFAULT '1' NOT NULL")
+    add_column(conn, "balance_slots", "version", "version INTEGER DEFAULT '0' NOT NULL")
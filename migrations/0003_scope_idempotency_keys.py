@@ -0,0 +1,17 @@
+"""scope idempotency keys to their account
+
+Keys are now stored as ``<owner>:<key>`` (see ``idempotency``). Rows
+written before that are renamed after the account in their stored
+response, the user of an add or withdrawal and the sender of a transfer,
+so a retry in flight across the deploy still replays. The rename runs in
+the same transaction that records this version, so it happens once.
+"""
+
+from schema import execute
+
+
+def upgrade(conn):
+    execute(conn, """
+        UPDATE idempotency_keys
+        SET key = json_extract(response_body, '$.user_id') || ':' || key
+    """)
@@ -0,0 +1,20 @@
+"""hash plain-text passwords
+
+Accounts created before password hashing, and users loaded by older
+``scripts/seed_data.py`` runs, store the password itself. Since the API
+used to return the stored value, those rows are hashed here and
+``passwords.verify_password`` no longer accepts plain text. Each row gets
+its own salted hash.
+"""
+
+from sqlalchemy import text
+
+from passwords import SCHEME, hash_password
+
+
+def upgrade(conn):
+    plain = conn.execute(text("SELECT id, hashed_password FROM users WHERE hashed_password NOT LIKE :hashed"),
+                         {"hashed": SCHEME + "$%"}).all()
+    for user_id, value in plain:
+        conn.execute(text("UPDATE users SET hashed_password = :hashed WHERE id = :id"),
+                     {"hashed": hash_password(value), "id": user_id})
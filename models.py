@@ -9,6 +9,8 @@ from sqlalchemy import DateTime
 import datetime
 import enum
 from sqlalchemy import Enum
+from sqlalchemy import Index
+from sqlalchemy import text
 
 
 
@@ -52,6 +54,22 @@ class TransactionType(enum.Enum):
     REVERSAL = "REVERSAL"
     CHARGEBACK = "CHARGEBACK"
 
+# Direction in which each transaction type moves the owning user's balance.
+BALANCE_SIGN = {
+    TransactionType.CREDIT: 1,
+    TransactionType.DEBIT: -1,
+    TransactionType.TRANSFER_IN: 1,
+    TransactionType.TRANSFER_OUT: -1,
+    TransactionType.REFUND: 1,
+    TransactionType.PAYMENT: -1,
+    TransactionType.WITHDRAWAL: -1,
+    TransactionType.DEPOSIT: 1,
+    TransactionType.FEE: -1,
+    TransactionType.ADJUSTMENT: 1,
+    TransactionType.REVERSAL: 1,
+    TransactionType.CHARGEBACK: 1,
+}
+
 class User(Base):
     __tablename__ = "users"     
     id = Column(Integer, primary_key=True, index=True)
@@ -64,6 +82,8 @@ class User(Base):
     balance = Column(Float, default=0.00)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), default=func.now())
+    # Bumped by every write to the row; with the slots' versions it makes the ETag of the user and balance reads.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     transactions = relationship("Transaction", back_populates="user", foreign_keys="Transaction.user_id")
     received_transactions = relationship("Transaction", back_populates="recipient", foreign_keys="Transaction.recipient_user_id")
@@ -71,6 +91,18 @@ class User(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Serves newest-first keyset pagination of a user's history.
+        Index("ix_transactions_user_created_id", "user_id", "created_at", "id"),
+        # Search filters (search.search_stmt); each starts with user_id.
+        Index("ix_transactions_user_type_created_id", "user_id", "transaction_type", "created_at", "id"),
+        Index("ix_transactions_user_amount", "user_id", "amount"),
+        Index("ix_transactions_user_recipient_created", "user_id", "recipient_user_id", "created_at"),
+        Index("ix_transactions_user_sender_created", "user_id", "sender_user_id", "created_at"),
+        # Nearest balance checkpoint to a point in time (balance_history).
+        Index("ix_transactions_user_checkpoint", "user_id", "created_at", "id",
+              sqlite_where=text("balance_after IS NOT NULL"), postgresql_where=text("balance_after IS NOT NULL")),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     transaction_type = Column(Enum(TransactionType), nullable=False)
@@ -79,16 +111,59 @@ class Transaction(Base):
     reference_transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=True)
     recipient_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     sender_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    # Shared by the TRANSFER_OUT and TRANSFER_IN legs of one transfer.
+    transfer_group = Column(String(32), nullable=True, index=True)
+    # The owner's balance right after this row; None where it was not known
+    # atomically (hot-account rows, rows older than the column).
+    balance_after = Column(Float, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    related_transaction = relationship("Transaction", remote_side=[id], uselist=False)
 
     user = relationship("User", back_populates="transactions", foreign_keys="Transaction.user_id")
     recipient = relationship("User", back_populates="received_transactions", foreign_keys="Transaction.recipient_user_id")
     sender = relationship("User", back_populates="sent_transactions", foreign_keys="Transaction.sender_user_id")
     reference = relationship("Transaction", remote_side=[id], uselist=False)
 
-         
+
+class IdempotencyKey(Base):
+    """Stored outcome of a money-moving request, keyed by its Idempotency-Key header."""
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    response_body = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class OutboxEvent(Base):
+    """A ledger write waiting to be delivered to downstream consumers.
+
+    Written in the same commit as the transaction it refers to and
+    deleted by ``outbox.OutboxDispatcher`` once every sink has it.
+    """
+    __tablename__ = "outbox_events"
+    __table_args__ = (
+        # Serves the dispatcher's "due, oldest first" poll.
+        Index("ix_outbox_events_due", "dead", "available_at", "id"),
+    )
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String, nullable=False)
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=False)
+    user_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    available_at = Column(DateTime(timezone=True), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    dead = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
 
 
+class BalanceSlot(Base):
+    """One sub-balance of a hot account.
 
-    
\ No newline at end of file
+    A hot account's balance is ``users.balance`` plus the sum of its slots;
+    credits land on a random slot so concurrent writers do not all update
+    the same row.
+    """
+    __tablename__ = "balance_slots"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    balance = Column(Float, nullable=False, default=0.0)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
@@ -0,0 +1,392 @@
+"""Digital Wallet transactional outbox
+
+Every money-moving write, all of them in ``async_crud``, records one
+``models.OutboxEvent`` per ledger row in the same commit, so an event
+exists if and only if its transaction does. ``OutboxDispatcher`` runs as a
+background task on its own engine: it reads due events in batches,
+delivers each to every configured sink with bounded concurrency, deletes
+the delivered ones and reschedules failures with exponential backoff
+until ``OUTBOX_MAX_ATTEMPTS``, after which they are kept with ``dead=1``.
+Requests never wait on a sink.
+
+Delivery is at least once: an event whose delivery to one sink failed is
+retried on all of them, and events of one user may arrive out of order
+when delivered concurrently. Consumers deduplicate on the event ``id``.
+
+    OUTBOX_DISPATCH         0 to write events without delivering them (default 1)
+    OUTBOX_SINKS            comma-separated: memory, http, file (default memory)
+    OUTBOX_HTTP_URL         endpoint for the http sink; unset posts to an in-process stand-in
+    OUTBOX_FILE_PATH        NDJSON file for the file sink (default ./outbox.ndjson)
+    OUTBOX_MEMORY_SIZE      events the memory sink keeps (default 10000)
+    OUTBOX_BATCH_SIZE       events read per poll (default 100)
+    OUTBOX_CONCURRENCY      deliveries in flight at once (default 8)
+    OUTBOX_MAX_ATTEMPTS     attempts before an event is dead-lettered (default 10)
+    OUTBOX_POLL_INTERVAL    seconds between polls when idle (default 0.25)
+    OUTBOX_DELIVERY_TIMEOUT seconds one delivery may take (default 5)
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import bindparam, delete, insert, literal, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import db_config
+from metrics import Histogram
+from models import OutboxEvent, Transaction
+
+OUTBOX_DISPATCH = os.getenv("OUTBOX_DISPATCH", "1") == "1"
+OUTBOX_SINKS = os.getenv("OUTBOX_SINKS", "memory")
+OUTBOX_HTTP_URL = os.getenv("OUTBOX_HTTP_URL")
+OUTBOX_FILE_PATH = os.getenv("OUTBOX_FILE_PATH", "./outbox.ndjson")
+OUTBOX_MEMORY_SIZE = int(os.getenv("OUTBOX_MEMORY_SIZE", "10000"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.25"))
+OUTBOX_DELIVERY_TIMEOUT = float(os.getenv("OUTBOX_DELIVERY_TIMEOUT", "5"))
+
+BALANCE_CHANGED = "balance.changed"
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 300.0
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+logger = logging.getLogger(__name__)
+
+
+"""writing events"""
+
+def _event_rows(transactions: Sequence[Transaction]) -> List[dict]:
+    now = datetime.utcnow()
+    return [
+        {"event_type": BALANCE_CHANGED, "transaction_id": transaction.id, "user_id": transaction.user_id,
+         "created_at": now, "available_at": now, "attempts": 0, "dead": 0}
+        for transaction in transactions
+    ]
+
+
+def record(db, *transactions: Transaction):
+    """Add one event per ledger row to ``db``'s uncommitted transaction.
+
+    Flushes first for the ids, then inserts with one Core executemany:
+    ORM-added rows would each be a separate INSERT on SQLite, which has
+    to hand every primary key back.
+    """
+    db.flush()
+    db.execute(insert(OutboxEvent.__table__), _event_rows(transactions))
+
+
+async def record_async(db, *transactions: Transaction):
+    await db.flush()
+    await db.execute(insert(OutboxEvent.__table__), _event_rows(transactions))
+
+
+def transfer_group_events_stmt(transfer_groups: Sequence[str]):
+    """INSERT ... SELECT of one event per ledger row of the given transfers.
+
+    Used by the batch transfer path, which inserts its ledger rows with a
+    Core executemany and so has no ORM objects to hang events on.
+    """
+    now = datetime.utcnow()
+    rows = select(
+        literal(BALANCE_CHANGED), Transaction.id, Transaction.user_id,
+        literal(now), literal(now), literal(0), literal(0),
+    ).where(Transaction.transfer_group.in_(bindparam("transfer_groups", list(transfer_groups), expanding=True)))
+    return insert(OutboxEvent).from_select(
+        ["event_type", "transaction_id", "user_id", "created_at", "available_at", "attempts", "dead"], rows,
+    )
+
+
+"""sinks"""
+
+class MemorySink:
+    """Keeps the latest ``maxlen`` events for in-process consumers and tests."""
+
+    def __init__(self, maxlen: int = OUTBOX_MEMORY_SIZE):
+        self.events = deque(maxlen=maxlen)
+
+    async def deliver(self, event: dict):
+        self.events.append(event)
+
+    def drain(self) -> List[dict]:
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+
+class FileSink:
+    """Appends events to an NDJSON file from a worker thread."""
+
+    def __init__(self, path: str = OUTBOX_FILE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _append(self, line: str):
+        with self._lock, open(self.path, "a", encoding="utf-8") as handle:
+            handle.write(line)
+
+    async def deliver(self, event: dict):
+        await asyncio.to_thread(self._append, json.dumps(event) + "\n")
+
+
+def stand_in_app(received: Optional[list] = None, delay: float = 0.0, status_code: int = 204):
+    """Minimal ASGI consumer that records POSTed events, for local runs and tests."""
+    received = [] if received is None else received
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+        if delay:
+            await asyncio.sleep(delay)
+        if status_code < 300:
+            received.append(json.loads(body))
+        await send({"type": "http.response.start", "status": status_code, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    app.received = received
+    return app
+
+
+class HttpSink:
+    """POSTs each event as JSON; any non-2xx response counts as a failure."""
+
+    def __init__(self, url: Optional[str] = OUTBOX_HTTP_URL, transport=None, timeout: float = OUTBOX_DELIVERY_TIMEOUT):
+        import httpx
+
+        if url is None:
+            url = "http://outbox-stand-in/events"
+            transport = transport or httpx.ASGITransport(app=stand_in_app())
+        self.url = url
+        self.client = httpx.AsyncClient(transport=transport, timeout=timeout)
+
+    async def deliver(self, event: dict):
+        response = await self.client.post(self.url, json=event)
+        response.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_SINKS: Dict[str, Callable[[], object]] = {
+    "memory": MemorySink,
+    "http": HttpSink,
+    "file": FileSink,
+}
+
+
+def build_sinks(names: str = OUTBOX_SINKS) -> list:
+    sinks = []
+    for name in (part.strip() for part in names.split(",")):
+        if not name:
+            continue
+        if name not in _SINKS:
+            raise ValueError(f"unknown outbox sink {name!r}; expected one of {', '.join(_SINKS)}")
+        sinks.append(_SINKS[name]())
+    return sinks
+
+
+"""dispatcher"""
+
+_EVENT_COLUMNS = (
+    OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.attempts, OutboxEvent.created_at,
+    Transaction.id.label("transaction_id"), Transaction.user_id, Transaction.transaction_type, Transaction.amount,
+    Transaction.description, Transaction.recipient_user_id, Transaction.sender_user_id, Transaction.transfer_group,
+    Transaction.balance_after,
+    Transaction.created_at.label("transaction_created_at"),
+)
+
+
+def _due_events_stmt(now: datetime, limit: int):
+    return (
+        select(*_EVENT_COLUMNS)
+        .join(Transaction, Transaction.id == OutboxEvent.transaction_id)
+        .where(OutboxEvent.dead == 0, OutboxEvent.available_at <= now)
+        .order_by(OutboxEvent.available_at, OutboxEvent.id)
+        .limit(limit)
+    )
+
+
+def _event_payload(row) -> dict:
+    return {
+        "id": row.id,
+        "type": row.event_type,
+        "created_at": row.created_at.isoformat(),
+        "transaction": {
+            "id": row.transaction_id,
+            "user_id": row.user_id,
+            "transaction_type": row.transaction_type.value,
+            "amount": row.amount,
+            "description": row.description,
+            "recipient_user_id": row.recipient_user_id,
+            "sender_user_id": row.sender_user_id,
+            "transfer_group": row.transfer_group,
+            "balance_after": row.balance_after,
+            "created_at": row.transaction_created_at.isoformat(),
+        },
+    }
+
+
+def backoff(attempts: int) -> float:
+    """Seconds to wait before attempt ``attempts + 1``."""
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+class OutboxDispatcher:
+    def __init__(self, sinks: Optional[list] = None, url: Optional[str] = None, batch_size: int = OUTBOX_BATCH_SIZE,
+                 concurrency: int = OUTBOX_CONCURRENCY, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL, delivery_timeout: float = OUTBOX_DELIVERY_TIMEOUT):
+        self.sinks = build_sinks() if sinks is None else sinks
+        # Its own engine, so polling never waits for (or holds) a request's connection.
+        self.engine = db_config.build_async_engine(url)
+        self.session_factory = async_sessionmaker(bind=self.engine, autoflush=False, expire_on_commit=False)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.delivery_timeout = delivery_timeout
+        self.delivered = 0
+        self.failed = 0
+        self.dead = 0
+        self.lag_seconds = 0.0
+        self.delivery_lag = Histogram(LAG_BUCKETS)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            # A fresh context keeps the dispatcher's statements out of request metrics.
+            self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for sink in self.sinks:
+            if hasattr(sink, "close"):
+                await sink.close()
+        await self.engine.dispose()
+
+    async def _run(self):
+        while True:
+            try:
+                handled = await self.run_once()
+            except Exception:
+                logger.exception("outbox dispatch failed")
+                handled = 0
+            if handled < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self) -> int:
+        """Deliver one batch of due events; returns how many were attempted."""
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            rows = (await db.execute(_due_events_stmt(now, self.batch_size))).all()
+        if not rows:
+            self.lag_seconds = 0.0
+            return 0
+        self.lag_seconds = max(0.0, (now - min(row.created_at for row in rows)).total_seconds())
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(row):
+            async with semaphore:
+                try:
+                    await asyncio.wait_for(self._deliver(_event_payload(row)), self.delivery_timeout)
+                except Exception as exc:
+                    return exc
+                return None
+
+        errors = await asyncio.gather(*(deliver(row) for row in rows))
+        await self._record(rows, errors)
+        return len(rows)
+
+    async def _deliver(self, event: dict):
+        for sink in self.sinks:
+            await sink.deliver(event)
+
+    async def _record(self, rows, errors):
+        now = datetime.utcnow()
+        delivered = [row.id for row, error in zip(rows, errors) if error is None]
+        retries = []
+        for row, error in zip(rows, errors):
+            if error is None:
+                self.delivery_lag.observe(max(0.0, (now - row.created_at).total_seconds()))
+                continue
+            attempts = row.attempts + 1
+            dead = attempts >= self.max_attempts
+            retries.append({
+                "event_id": row.id,
+                "attempts": attempts,
+                "available_at": now + timedelta(seconds=backoff(attempts)),
+                "last_error": f"{type(error).__name__}: {error}"[:500],
+                "dead": int(dead),
+            })
+            self.dead += dead
+            if dead:
+                logger.warning("outbox event %d dead-lettered after %d attempts: %s", row.id, attempts, error)
+        async with self.session_factory() as db:
+            if delivered:
+                await db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(delivered)))
+            if retries:
+                await db.execute(
+                    update(OutboxEvent.__table__)
+                    .where(OutboxEvent.__table__.c.id == bindparam("event_id"))
+                    .values(attempts=bindparam("attempts"), available_at=bindparam("available_at"),
+                            last_error=bindparam("last_error"), dead=bindparam("dead")),
+                    retries,
+                )
+            await db.commit()
+        self.delivered += len(delivered)
+        self.failed += len(retries)
+
+    def stats(self):
+        return {
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dead": self.dead,
+            "lag_seconds": self.lag_seconds,
+            "delivery_lag_seconds": self.delivery_lag.snapshot(),
+        }
+
+
+dispatcher: Optional[OutboxDispatcher] = None
+
+
+def configure(enable: bool, **dispatcher_options):
+    """Switch background delivery on or off, replacing the dispatcher when enabling."""
+    global OUTBOX_DISPATCH, dispatcher
+    OUTBOX_DISPATCH = enable
+    dispatcher = OutboxDispatcher(**dispatcher_options) if enable else None
+
+
+def start():
+    global dispatcher
+    if not OUTBOX_DISPATCH:
+        return
+    if dispatcher is None:
+        dispatcher = OutboxDispatcher()
+    dispatcher.start()
+
+
+async def shutdown():
+    global dispatcher
+    if dispatcher is not None:
+        await dispatcher.stop()
+        # The engine is bound to this event loop; the next start builds a new one.
+        dispatcher = None
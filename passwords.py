@@ -0,0 +1,159 @@
+"""Digital Wallet password hashing
+
+Passwords are stored as scrypt hashes, ``scrypt$<n>$<r>$<p>$<salt>$<hash>``
+with base64 salt and hash, so the cost parameters travel with every hash
+and can be raised without invalidating existing ones: ``needs_rehash``
+tells the login path to re-hash a password it has just verified.
+Only hashes verify: accounts created before hashing had their plain
+passwords hashed by migration 0004, so a stored value is never itself a
+credential.
+
+Hashing and verifying take tens of milliseconds of CPU by design, so the
+async routes hand them to a dedicated pool (``hash_async`` /
+``verify_async``) and the event loop and request threads stay free.
+``hashlib.scrypt`` releases the GIL, so a thread pool hashes in parallel
+up to the number of cores; a process pool is available for builds where
+it does not.
+
+    PASSWORD_HASH_N        scrypt CPU/memory cost, a power of two (default 16384)
+    PASSWORD_HASH_R        scrypt block size (default 8)
+    PASSWORD_HASH_P        scrypt parallelism (default 1)
+    PASSWORD_HASH_POOL     "thread" or "process" (default thread)
+    PASSWORD_HASH_WORKERS  pool size (default: CPU count)
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional
+
+PASSWORD_HASH_N = int(os.getenv("PASSWORD_HASH_N", "16384"))
+PASSWORD_HASH_R = int(os.getenv("PASSWORD_HASH_R", "8"))
+PASSWORD_HASH_P = int(os.getenv("PASSWORD_HASH_P", "1"))
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+if PASSWORD_HASH_POOL not in ("thread", "process"):
+    raise ValueError(f"Unknown PASSWORD_HASH_POOL {PASSWORD_HASH_POOL!r}")
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # scrypt needs 128 * n * r bytes; allow that plus headroom over OpenSSL's 32 MiB default.
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES,
+                          maxmem=256 * n * r + 1024 * 1024)
+
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode()
+
+
+def hash_password(password: str, n: int = PASSWORD_HASH_N, r: int = PASSWORD_HASH_R,
+                  p: int = PASSWORD_HASH_P) -> str:
+    salt = os.urandom(SALT_BYTES)
+    return f"{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def verify_password(password: str, stored: str) -> bool:
+    """Check ``password`` against a stored hash; anything else never matches."""
+    if not stored.startswith(SCHEME + "$"):
+        return False
+    try:
+        _, n, r, p, salt, expected = stored.split("$")
+        computed = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(computed, base64.b64decode(expected))
+
+
+def needs_rehash(stored: str) -> bool:
+    """True for hashes made with other cost parameters."""
+    return not stored.startswith(f"{SCHEME}${PASSWORD_HASH_N}${PASSWORD_HASH_R}${PASSWORD_HASH_P}$")
+
+
+# A real hash to verify against when the user does not exist, so a login
+# for an unknown name costs as much as one with a wrong password. Made on
+# the hashing pool at startup (see ``main.lifespan``), so no login pays for it.
+_DUMMY_HASH: Optional[str] = None
+
+
+async def dummy_hash() -> str:
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None:
+        _DUMMY_HASH = await hash_async("not a password")
+    return _DUMMY_HASH
+
+
+"""hashing pool"""
+
+class HashPool:
+    """The executor running hash and verify calls, with counters for ``/metrics``."""
+
+    def __init__(self, kind: str = PASSWORD_HASH_POOL, workers: int = PASSWORD_HASH_WORKERS):
+        self.kind = kind
+        self.workers = workers
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.hashes = 0
+        self.verifies = 0
+        self.pending = 0
+        self.seconds = 0.0
+
+    def executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+            return self._executor
+
+    async def _run(self, counter: str, function, *args):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.pending += 1
+        started = loop.time()
+        try:
+            return await loop.run_in_executor(self.executor(), function, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                setattr(self, counter, getattr(self, counter) + 1)
+                self.seconds += loop.time() - started
+
+    async def hash(self, password: str) -> str:
+        # The parameters are passed explicitly so process workers use this process's settings.
+        return await self._run("hashes", hash_password, password, PASSWORD_HASH_N, PASSWORD_HASH_R,
+                               PASSWORD_HASH_P)
+
+    async def verify(self, password: str, stored: str) -> bool:
+        return await self._run("verifies", verify_password, password, stored)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"hashes": self.hashes, "verifies": self.verifies, "pending": self.pending,
+                    "seconds": self.seconds}
+
+
+pool = HashPool()
+
+
+async def hash_async(password: str) -> str:
+    return await pool.hash(password)
+
+
+async def verify_async(password: str, stored: str) -> bool:
+    return await pool.verify(password, stored)
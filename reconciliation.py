@@ -0,0 +1,192 @@
+"""Digital Wallet ledger reconciliation
+
+Checks that every user's balance (``users.balance`` plus any hot-account
+slots) equals the signed sum of their ledger, per ``models.BALANCE_SIGN``.
+The users table is split into id-range partitions that a process pool
+reconciles independently. For each partition the database aggregates
+the ledger per user and type in one GROUP BY, joined to the balances,
+so the check reads both from a single statement snapshot and Python only
+sees a handful of rows per user.
+
+With an archive configured (``archive``), archived rows count towards
+the ledger too: the aggregate runs over both tables.
+
+Workers connect read-only (``db_config.read_only_url`` on SQLite), so the
+job takes no write locks, and memory stays bounded by one partition's
+aggregates plus the ``max_drifts`` largest drifts kept for the report.
+
+    RECONCILE_PARTITION_SIZE  users per partition (default 10000)
+    RECONCILE_WORKERS         worker processes (default: CPU count)
+    RECONCILE_TOLERANCE       largest |drift| still considered in balance (default 0.005)
+"""
+
+import heapq
+import math
+import os
+import time
+from datetime import datetime
+from multiprocessing import Pool
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, select, union_all
+from sqlalchemy.engine import Engine
+
+import archive
+import db_config
+import hot_accounts
+from models import BALANCE_SIGN, Transaction, TransactionType, User
+
+RECONCILE_PARTITION_SIZE = int(os.getenv("RECONCILE_PARTITION_SIZE", "10000"))
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", str(os.cpu_count() or 1)))
+RECONCILE_TOLERANCE = float(os.getenv("RECONCILE_TOLERANCE", "0.005"))
+
+
+def partitions(engine: Engine, size: int = RECONCILE_PARTITION_SIZE) -> List[Tuple[int, int]]:
+    """Half-open ``[lo, hi)`` user id ranges covering the users table."""
+    with engine.connect() as conn:
+        low, high = conn.execute(select(func.min(User.id), func.max(User.id))).one()
+    if low is None:
+        return []
+    return [(lo, min(lo + size, high + 1)) for lo in range(low, high + 1, size)]
+
+
+def partition_stmt(lo: int, hi: int, with_archive: bool = False):
+    """Each user's balance next to their ledger total and row count per type."""
+    rows = (
+        select(Transaction.user_id, Transaction.transaction_type, Transaction.amount)
+        .where(Transaction.user_id >= lo, Transaction.user_id < hi)
+    )
+    if with_archive:
+        rows = union_all(rows, archive.ledger_stmt(lo, hi))
+    rows = rows.subquery()
+    ledger = (
+        select(rows.c.user_id, rows.c.transaction_type, func.sum(rows.c.amount).label("total"),
+               func.count().label("rows"))
+        .group_by(rows.c.user_id, rows.c.transaction_type)
+        .subquery()
+    )
+    return (
+        select(User.id, hot_accounts.total_balance(), ledger.c.transaction_type, ledger.c.total, ledger.c.rows)
+        .outerjoin(ledger, ledger.c.user_id == User.id)
+        .where(User.id >= lo, User.id < hi)
+        .order_by(User.id)
+    )
+
+
+def _user_result(user_id: int, balance: float, by_type: Dict[str, float]) -> dict:
+    ledger_total = math.fsum(BALANCE_SIGN[TransactionType(name)] * total for name, total in by_type.items())
+    return {
+        "user_id": user_id,
+        "balance": balance,
+        "ledger_total": ledger_total,
+        "drift": balance - ledger_total,
+        "by_type": by_type,
+    }
+
+
+def reconcile_partition(engine: Engine, lo: int, hi: int, tolerance: float = RECONCILE_TOLERANCE,
+                        with_archive: bool = False) -> dict:
+    """Reconcile users ``lo <= id < hi``; returns counts, type totals and drifted users."""
+    users = rows = 0
+    type_totals: Dict[str, float] = {}
+    drifts = []
+    balance_total = ledger_total = 0.0
+
+    def finish(user_id, balance, by_type):
+        nonlocal users, balance_total, ledger_total
+        result = _user_result(user_id, balance, by_type)
+        users += 1
+        balance_total += balance
+        ledger_total += result["ledger_total"]
+        if abs(result["drift"]) > tolerance:
+            drifts.append(result)
+
+    current = None
+    with engine.connect() as conn:
+        for row in conn.execution_options(stream_results=True).execute(partition_stmt(lo, hi, with_archive)):
+            if current is None or current[0] != row.id:
+                if current is not None:
+                    finish(*current)
+                current = (row.id, row.balance or 0.0, {})
+            if row.transaction_type is not None:
+                name = row.transaction_type.value
+                current[2][name] = row.total
+                type_totals[name] = type_totals.get(name, 0.0) + row.total
+                rows += row.rows
+    if current is not None:
+        finish(*current)
+    return {
+        "lo": lo, "hi": hi, "users": users, "rows": rows, "type_totals": type_totals,
+        "balance_total": balance_total, "ledger_total": ledger_total, "drifts": drifts,
+    }
+
+
+_worker_engine: Optional[Engine] = None
+
+
+def _init_worker(url: str, archive_path: Optional[str]):
+    global _worker_engine
+    archive.configure(archive_path)
+    _worker_engine = db_config.build_engine(db_config.read_only_url(url) or url, read_only=True)
+
+
+def _run_partition(task: Tuple[int, int, float, bool]) -> dict:
+    lo, hi, tolerance, with_archive = task
+    return reconcile_partition(_worker_engine, lo, hi, tolerance, with_archive)
+
+
+def _results(url: str, tasks: List[Tuple[int, int, float, bool]], workers: int) -> Iterator[dict]:
+    if workers <= 1:
+        _init_worker(url, db_config.ARCHIVE_PATH)
+        try:
+            yield from map(_run_partition, tasks)
+        finally:
+            _worker_engine.dispose()
+        return
+    with Pool(workers, initializer=_init_worker, initargs=(url, db_config.ARCHIVE_PATH)) as pool:
+        yield from pool.imap_unordered(_run_partition, tasks)
+
+
+def reconcile(url: Optional[str] = None, partition_size: int = RECONCILE_PARTITION_SIZE,
+              workers: int = RECONCILE_WORKERS, tolerance: float = RECONCILE_TOLERANCE, max_drifts: int = 1000,
+              on_drift: Optional[Callable[[dict], None]] = None,
+              on_partition: Optional[Callable[[dict], None]] = None) -> dict:
+    """Reconcile every user and return the drift report.
+
+    ``on_drift`` sees every drifted user as partitions finish; the report
+    keeps only the ``max_drifts`` largest by absolute drift.
+    """
+    url = url or db_config.DATABASE_URL
+    started = time.perf_counter()
+    engine = db_config.build_engine(db_config.read_only_url(url) or url, read_only=True)
+    try:
+        ranges = partitions(engine, partition_size)
+        with_archive = archive.has_tables(engine)
+    finally:
+        engine.dispose()
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "partitions": len(ranges), "users": 0, "rows": 0, "type_totals": {},
+        "balance_total": 0.0, "ledger_total": 0.0, "drifted_users": 0, "drift_total": 0.0,
+    }
+    largest: List[Tuple[float, int, dict]] = []
+    for result in _results(url, [(lo, hi, tolerance, with_archive) for lo, hi in ranges], workers):
+        for field in ("users", "rows", "balance_total", "ledger_total"):
+            report[field] += result[field]
+        for name, total in result["type_totals"].items():
+            report["type_totals"][name] = report["type_totals"].get(name, 0.0) + total
+        for drift in result["drifts"]:
+            report["drifted_users"] += 1
+            report["drift_total"] += drift["drift"]
+            if on_drift is not None:
+                on_drift(drift)
+            entry = (abs(drift["drift"]), drift["user_id"], drift)
+            if len(largest) < max_drifts:
+                heapq.heappush(largest, entry)
+            elif max_drifts:
+                heapq.heappushpop(largest, entry)
+        if on_partition is not None:
+            on_partition(result)
+    report["drifts"] = [drift for _, _, drift in sorted(largest, key=lambda entry: (-entry[0], entry[1]))]
+    report["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    return report
@@ -0,0 +1,304 @@
+"""Digital Wallet schema migrations
+
+The schema is built by the numbered files in ``migrations/``
+(``0001_baseline.py``, ...), each with an ``upgrade(conn)`` made of the
+operations below. ``scripts/migrate.py`` applies the pending ones once
+per deploy and records each in ``schema_version``; application startup
+only compares that version with the newest file (``startup_check``), so
+a worker pays one query instead of reflecting and creating the schema.
+
+Every operation is idempotent (``create_table`` skips existing tables,
+``add_column`` existing columns, ``create_index`` existing indexes), so
+a migration interrupted before its version was recorded can simply be
+run again, and the baseline also upgrades databases created by
+``create_all`` before migrations existed.
+
+A migration that sets ``ONLINE = True`` runs outside a transaction so
+its index builds do not hold one open: on PostgreSQL ``create_index``
+then uses ``CREATE INDEX CONCURRENTLY`` and writers carry on. SQLite has
+no online build; the index is built in its own short write transaction,
+WAL readers are unaffected and writers wait on ``busy_timeout``, so
+builds on large tables belong in a quiet period.
+
+``generate`` writes the next migration from the difference between
+``models.py`` and the schema the existing migrations produce: new
+tables, new columns that are nullable or have a server default, and new
+indexes, with DDL rendered for SQLite. Drops, type changes and data migrations are written by hand.
+
+    SCHEMA_AUTO_MIGRATE  apply pending migrations at startup instead of refusing
+                         to start (default 0; for tests and local development)
+"""
+
+import importlib.util
+import json
+import logging
+import os
+import re
+import textwrap
+import time
+from datetime import datetime
+from types import ModuleType
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, create_engine, func, insert, inspect, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+import archive
+import models  # noqa: F401  registers every table on Base.metadata
+from database import Base
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_AUTO_MIGRATE = os.getenv("SCHEMA_AUTO_MIGRATE", "0") == "1"
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+_MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.py$")
+
+version_metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+    Column("seconds", Float, nullable=False),
+)
+
+
+class SchemaVersionError(RuntimeError):
+    """The database has not been migrated to the version this code needs."""
+
+
+"""operations used by migrations"""
+
+def create_table(conn: Connection, name: str, ddl: str):
+    if not inspect(conn).has_table(name):
+        conn.exec_driver_sql(ddl)
+        logger.info("created table %s", name)
+
+
+def add_column(conn: Connection, table: str, name: str, ddl: str):
+    """``ALTER TABLE ... ADD COLUMN``; the column must be nullable or have a default."""
+    if name not in {column["name"] for column in inspect(conn).get_columns(table)}:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+        logger.info("added column %s.%s", table, name)
+
+
+def create_index(conn: Connection, name: str, table: str, columns: Sequence[str], unique: bool = False,
+                 where: Optional[str] = None):
+    """``CREATE INDEX IF NOT EXISTS``, concurrently on PostgreSQL outside a transaction."""
+    quote = conn.dialect.identifier_preparer.quote
+    autocommit = conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+    concurrently = conn.dialect.name == "postgresql" and autocommit
+    started = time.perf_counter()
+    conn.exec_driver_sql(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX {'CONCURRENTLY ' if concurrently else ''}"
+        f"IF NOT EXISTS {quote(name)} ON {quote(table)} ({', '.join(quote(column) for column in columns)})"
+        + (f" WHERE {where}" if where else "")
+    )
+    logger.info("index %s on %s ready in %.2f s", name, table, time.perf_counter() - started)
+
+
+def execute(conn: Connection, *statements: str):
+    for statement in statements:
+        conn.exec_driver_sql(statement)
+
+
+"""versions"""
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    path: str
+
+    def load(self) -> ModuleType:
+        spec = importlib.util.spec_from_file_location(f"migrations.m{self.version:04d}_{self.name}", self.path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+
+def migrations(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    """The migration files in ``directory``, by version; none are imported."""
+    found = []
+    for filename in os.listdir(directory):
+        match = _MIGRATION_FILE.match(filename)
+        if match:
+            found.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    found.sort()
+    for previous, migration in zip(found, found[1:]):
+        if previous.version == migration.version:
+            raise RuntimeError(f"two migrations numbered {migration.version}: {previous.path}, {migration.path}")
+    return found
+
+
+def head_version(directory: str = MIGRATIONS_DIR) -> int:
+    found = migrations(directory)
+    return found[-1].version if found else 0
+
+
+def current_version(conn: Connection) -> int:
+    """The newest applied version; 0 for a database never migrated."""
+    try:
+        return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except DBAPIError:
+        conn.rollback()
+        return 0
+
+
+def check(engine: Engine, directory: str = MIGRATIONS_DIR) -> int:
+    """Raise ``SchemaVersionError`` unless the database is at least at the newest version.
+
+    A newer database is accepted, with a warning: migrations only add, so
+    workers still running the previous release keep working during a deploy.
+    """
+    head = head_version(directory)
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version < head:
+        raise SchemaVersionError(
+            f"database schema is at version {version} but this code needs {head}; run scripts/migrate.py"
+        )
+    if version > head:
+        logger.warning("database schema is at version %s, newer than this code's %s", version, head)
+    return version
+
+
+def startup_check(engine: Engine):
+    """Called by ``main`` at import: the version check, or an upgrade with SCHEMA_AUTO_MIGRATE."""
+    if SCHEMA_AUTO_MIGRATE:
+        upgrade(engine)
+    else:
+        check(engine)
+
+
+"""applying migrations"""
+
+def _apply(engine: Engine, migration: Migration):
+    module = migration.load()
+    started = time.perf_counter()
+    if getattr(module, "ONLINE", False):
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            module.upgrade(conn)
+        with engine.begin() as conn:
+            _record(conn, migration, time.perf_counter() - started)
+    else:
+        with engine.begin() as conn:
+            module.upgrade(conn)
+            _record(conn, migration, time.perf_counter() - started)
+
+
+def _record(conn: Connection, migration: Migration, seconds: float):
+    recorded = select(schema_version.c.version).where(schema_version.c.version == migration.version)
+    if conn.execute(recorded).first() is None:
+        conn.execute(insert(schema_version).values(
+            version=migration.version, name=migration.name, applied_at=datetime.utcnow(), seconds=seconds,
+        ))
+
+
+def apply_migrations(engine: Engine, target: Optional[int] = None, directory: str = MIGRATIONS_DIR,
+                     on_step: Optional[Callable[[Migration, float], None]] = None) -> List[Migration]:
+    """Apply the migrations newer than the database, up to ``target``; returns those applied."""
+    with engine.begin() as conn:
+        version_metadata.create_all(conn)
+        version = current_version(conn)
+    applied = []
+    for migration in migrations(directory):
+        if migration.version <= version or (target is not None and migration.version > target):
+            continue
+        started = time.perf_counter()
+        _apply(engine, migration)
+        applied.append(migration)
+        logger.info("applied migration %04d_%s", migration.version, migration.name)
+        if on_step:
+            on_step(migration, time.perf_counter() - started)
+    return applied
+
+
+def upgrade(engine: Engine, target: Optional[int] = None, directory: str = MIGRATIONS_DIR,
+            on_step: Optional[Callable[[Migration, float], None]] = None) -> List[Migration]:
+    """``apply_migrations``, then the attached archive's tables when ARCHIVE_PATH is set."""
+    applied = apply_migrations(engine, target, directory, on_step)
+    archive.ensure_archive_schema(engine)
+    return applied
+
+
+"""generating migrations"""
+
+def _scratch_engine(directory: str) -> Engine:
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    apply_migrations(engine, directory=directory)
+    return engine
+
+
+def _literal(value: str) -> str:
+    return json.dumps(value)
+
+
+def _index_call(index) -> str:
+    where = index.dialect_options["sqlite"].get("where")
+    columns = ", ".join(_literal(column.name) for column in index.columns)
+    args = [_literal(index.name), _literal(index.table.name), f"[{columns}]"]
+    if index.unique:
+        args.append("unique=True")
+    if where is not None:
+        args.append(f"where={_literal(str(where))}")
+    return f"create_index(conn, {', '.join(args)})"
+
+
+def changes(metadata: MetaData = Base.metadata, directory: str = MIGRATIONS_DIR) -> List[str]:
+    """Operation calls bringing the migrated schema up to ``metadata``; see ``generate``."""
+    engine = _scratch_engine(directory)
+    calls = []
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                ddl = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+                ddl = "\n".join(line.rstrip() for line in ddl.expandtabs(4).splitlines())
+                calls.append(f'create_table(conn, {_literal(table.name)}, """\n{textwrap.indent(ddl, " " * 4)}\n""")')
+                calls.extend(_index_call(index) for index in sorted(table.indexes, key=lambda index: index.name))
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    raise RuntimeError(f"{table.name}.{column.name} is NOT NULL without a server default "
+                                       "and cannot be added automatically")
+                ddl = str(CreateColumn(column).compile(dialect=conn.dialect))
+                calls.append(f"add_column(conn, {_literal(table.name)}, {_literal(column.name)}, {_literal(ddl)})")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            calls.extend(_index_call(index) for index in sorted(table.indexes, key=lambda index: index.name)
+                         if index.name not in indexes)
+    engine.dispose()
+    return calls
+
+
+def generate(name: str, metadata: MetaData = Base.metadata, directory: str = MIGRATIONS_DIR) -> Optional[str]:
+    """Write the next migration for ``changes``; returns its path, or None when up to date.
+
+    It is marked ``ONLINE`` when it only builds indexes on existing tables.
+    """
+    calls = changes(metadata, directory)
+    if not calls:
+        return None
+    slug = re.sub(r"\W+", "_", name.lower()).strip("_")
+    version = head_version(directory) + 1
+    operations = sorted({call.partition("(")[0] for call in calls})
+    online = operations == ["create_index"]
+    body = "\n".join(textwrap.indent(call, " " * 4) for call in calls)
+    source = (
+        f'"""{name}\n\nGenerated by ``scripts/migrate.py generate`` on {datetime.utcnow():%Y-%m-%d}.\n"""\n\n'
+        f"from schema import {', '.join(operations)}\n\n"
+        + ("ONLINE = True\n\n" if online else "")
+        + f"\ndef upgrade(conn):\n{body}\n"
+    )
+    path = os.path.join(directory, f"{version:04d}_{slug}.py")
+    with open(path, "x") as out:
+        out.write(source)
+    return path
@@ -1,6 +1,6 @@
 """Digital Wallet API Schemas Module"""
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List
 from datetime import datetime
 import enum 
@@ -41,7 +41,6 @@ class UserUpdate(BaseModel):
 
 class User(UserBase):
     id: int
-    hashed_password: str
     is_active: int
     balance: float
     created_at: datetime
@@ -50,6 +49,20 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+"""Auth Schemas"""
+
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_at: datetime
+
+class TokenUser(BaseModel):
+    user_id: int
+
 """Transaction Schemas"""
 
 class TransactionBase(BaseModel):
@@ -66,7 +79,72 @@ class TransactionCreate(TransactionBase):
 class Transaction(TransactionBase):
     id: int
     user_id: int
+    transfer_group: Optional[str] = None
+    balance_after: Optional[float] = None
     created_at: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class TransactionResult(BaseModel):
+    message: str
+    transaction: Transaction
+
+class TransactionPage(BaseModel):
+    transactions: List[Transaction]
+    next_cursor: Optional[str] = None
+
+class TransactionSearch(BaseModel):
+    types: Optional[List[TransactionType]] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    counterparty: Optional[int] = None
+    q: Optional[str] = Field(None, max_length=200)
+
+class UserSummary(BaseModel):
+    id: int
+    username: str
+    full_name: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class TransferDetail(BaseModel):
+    transfer_group: Optional[str] = None
+    amount: float
+    created_at: datetime
+    sender: Optional[UserSummary] = None
+    recipient: Optional[UserSummary] = None
+    transfer_out: Optional[Transaction] = None
+    transfer_in: Optional[Transaction] = None
+
+"""Batch Transfer Schemas"""
+
+class BatchMode(str, enum.Enum):
+    ALL_OR_NOTHING = "all_or_nothing"
+    BEST_EFFORT = "best_effort"
+
+class TransferItem(BaseModel):
+    sender_id: int
+    recipient_id: int
+    amount: float
+    description: Optional[str] = None
+
+class BatchTransferRequest(BaseModel):
+    transfers: List[TransferItem] = Field(..., min_length=1, max_length=10000)
+    mode: BatchMode = BatchMode.ALL_OR_NOTHING
+
+class BatchTransferItemResult(BaseModel):
+    index: int
+    status: str  # "success", "failed" or "rolled_back"
+    detail: Optional[str] = None
+    transaction_id: Optional[int] = None
+
+class BatchTransferResult(BaseModel):
+    mode: BatchMode
+    committed: bool
+    succeeded: int
+    failed: int
+    results: List[BatchTransferItemResult]
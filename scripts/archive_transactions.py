@@ -0,0 +1,70 @@
+"""Move ledger rows older than a cutoff into the archive database.
+
+Runs ``archive.archive_transactions`` against ``--archive-path`` (default
+ARCHIVE_PATH), batch by batch, each verified against its checksum before
+the hot rows are deleted, so it can be interrupted and rerun at any point.
+``--verify`` only rechecks every archived batch against its checksum.
+
+    python scripts/archive_transactions.py --archive-path ./wallet_archive.db
+    python scripts/archive_transactions.py --database-url sqlite:///./load.db --archive-path ./load_archive.db --older-than-days 90
+    python scripts/archive_transactions.py --archive-path ./wallet_archive.db --verify
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to DATABASE_URL")
+    parser.add_argument("--archive-path", help="archive SQLite file (ARCHIVE_PATH)")
+    parser.add_argument("--older-than-days", type=int, help="archive rows older than this (ARCHIVE_AFTER_DAYS)")
+    parser.add_argument("--before", type=datetime.fromisoformat, help="explicit cutoff timestamp, UTC")
+    parser.add_argument("--batch-size", type=int, help="rows per batch (ARCHIVE_BATCH_SIZE)")
+    parser.add_argument("--verify", action="store_true", help="recheck archived batches instead of archiving")
+    args = parser.parse_args()
+
+    # db_config reads these at import time, so set them before importing the app modules.
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    if args.archive_path:
+        os.environ["ARCHIVE_PATH"] = args.archive_path
+
+    import archive
+    import schema
+    from database import SessionLocal, engine
+
+    if not archive.enabled():
+        parser.error("set --archive-path or ARCHIVE_PATH")
+    schema.upgrade(engine)
+    if args.verify:
+        with SessionLocal() as db:
+            failed = archive.verify(db)
+        for batch_id in failed:
+            print(f"batch {batch_id} does not match its checksum")
+        sys.exit(1 if failed else 0)
+
+    cutoff = args.before or datetime.utcnow() - timedelta(days=args.older_than_days or archive.ARCHIVE_AFTER_DAYS)
+
+    def on_batch(period: str, rows: int):
+        print(f"{period}  {rows:>8,} rows", file=sys.stderr, flush=True)
+
+    started = time.perf_counter()
+    report = archive.archive_transactions(SessionLocal, cutoff, args.batch_size or archive.ARCHIVE_BATCH_SIZE,
+                                          on_batch=on_batch)
+    elapsed = time.perf_counter() - started
+    print(f"cutoff:      {report['cutoff']}")
+    print(f"resumed:     {report['resumed']:,} batches")
+    print(f"backfilled:  {report['backfilled']:,} rows")
+    print(f"archived:    {report['rows']:,} rows in {report['batches']:,} batches "
+          f"({report['rows'] / elapsed if elapsed else 0.0:,.0f} rows/s)")
+    print(f"elapsed:     {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Fill ``transactions.balance_after`` where it is missing.
+
+Runs ``balance_history.backfill`` for every user with rows lacking the
+value (or only the given ``--users``), one user at a time and
+``--chunk-size`` rows per transaction, so it can run against a live
+database and be interrupted and restarted at any point.
+
+    python scripts/backfill_balance_after.py
+    python scripts/backfill_balance_after.py --database-url sqlite:///./load.db --chunk-size 5000
+    python scripts/backfill_balance_after.py --users 17,42
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def _int_list(text: str) -> list:
+    return [int(part) for part in text.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to DATABASE_URL")
+    parser.add_argument("--chunk-size", type=int, default=None, help="rows per chunk (BALANCE_BACKFILL_CHUNK_SIZE)")
+    parser.add_argument("--users", type=_int_list, help="comma-separated user ids; default every user with gaps")
+    args = parser.parse_args()
+
+    # db_config reads this at import time, so set it before importing the app modules.
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    import balance_history
+    import schema
+    from database import SessionLocal, engine
+
+    schema.upgrade(engine)
+    started = time.perf_counter()
+    filled = balance_history.backfill(SessionLocal, args.chunk_size or balance_history.BALANCE_BACKFILL_CHUNK_SIZE,
+                                      user_ids=args.users)
+    print(f"filled balance_after on {filled:,} rows in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
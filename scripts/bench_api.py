@@ -0,0 +1,222 @@
+"""In-process load and latency benchmark for the wallet API.
+
+Drives ``main.app`` through ``httpx.ASGITransport`` (no server, no
+sockets) against a freshly seeded temporary SQLite database. Each
+scenario is run at every ``--concurrency`` level and reports throughput,
+p50/p95/p99 latency and the number of failed or non-2xx responses.
+
+    python scripts/bench_api.py --concurrency 1,10,50 --requests 2000 --output bench.json
+    python scripts/bench_api.py --baseline bench.json --tolerance 0.2
+
+With ``--baseline`` every scenario/concurrency pair is compared to the
+stored run; a throughput drop or p95 increase beyond ``--tolerance`` is
+reported as a regression and the script exits with status 1.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCENARIOS = ("balance", "add", "withdraw", "transfer", "history")
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+class Scenario:
+    """Builds the next request for one scenario; ``history`` follows ``next_cursor``."""
+
+    def __init__(self, name: str, users: int, page_size: int, rng: random.Random):
+        self.name = name
+        self.users = users
+        self.page_size = page_size
+        self.rng = rng
+
+    def _user(self) -> int:
+        return self.rng.randint(1, self.users)
+
+    async def call(self, client, state: dict):
+        if self.name == "balance":
+            return await client.get(f"/wallet/{self._user()}/balance")
+        if self.name == "add":
+            return await client.post(f"/wallet/{self._user()}/add", params={"amount": 5.0})
+        if self.name == "withdraw":
+            return await client.post(f"/wallet/{self._user()}/withdraw", params={"amount": 1.0})
+        if self.name == "transfer":
+            sender = self._user()
+            recipient = sender % self.users + 1
+            return await client.post("/transfer/", params={"sender_id": sender, "recipient_id": recipient,
+                                                           "amount": 1.0})
+        params = {"limit": self.page_size}
+        if state.get("cursor"):
+            params["cursor"] = state["cursor"]
+        else:
+            state["user_id"] = self._user()
+        response = await client.get(f"/transactions/{state['user_id']}", params=params)
+        state["cursor"] = response.json().get("next_cursor") if response.status_code == 200 else None
+        return response
+
+
+async def run_level(client, scenario: Scenario, concurrency: int, requests: int) -> dict:
+    latencies = []
+    errors = non_2xx = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors, non_2xx
+        state = {}
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await scenario.call(client, state)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            if not 200 <= response.status_code < 300:
+                non_2xx += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "elapsed_seconds": round(elapsed, 4),
+        "throughput_rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "errors": errors,
+        "non_2xx": non_2xx,
+    }
+
+
+def seed_database(args):
+    import schema
+    import seed_data
+    from database import engine
+
+    schema.upgrade(engine)
+    opts = seed_data.generation_options(seed=args.seed, mean_transactions=args.mean_transactions)
+    seed_data.load(engine, args.users, opts)
+
+
+async def benchmark(args) -> dict:
+    import httpx
+    import main
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name in args.scenarios:
+            results[name] = {}
+            for concurrency in args.concurrency:
+                scenario = Scenario(name, args.users, args.page_size, random.Random(f"{args.seed}:{name}"))
+                if args.warmup:
+                    await run_level(client, scenario, concurrency, args.warmup)
+                level = await run_level(client, scenario, concurrency, args.requests)
+                results[name][str(concurrency)] = level
+                print(f"{name:<9} c={concurrency:<4} {level['throughput_rps']:>9,.0f} req/s  "
+                      f"p50 {level['p50_ms']:7.2f} ms  p95 {level['p95_ms']:7.2f} ms  "
+                      f"p99 {level['p99_ms']:7.2f} ms  errors {level['errors']}  non-2xx {level['non_2xx']}",
+                      flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of ``results`` against a stored run, as printable lines."""
+    regressions = []
+    for name, levels in results.items():
+        for concurrency, level in levels.items():
+            before = baseline.get("results", {}).get(name, {}).get(concurrency)
+            if before is None:
+                continue
+            if level["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+                regressions.append(f"{name} c={concurrency}: throughput {before['throughput_rps']:,.0f} -> "
+                                   f"{level['throughput_rps']:,.0f} req/s")
+            if level["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{name} c={concurrency}: p95 {before['p95_ms']:.2f} -> {level['p95_ms']:.2f} ms")
+    return regressions
+
+
+def _int_list(text: str) -> list:
+    return [int(part) for part in text.split(",") if part]
+
+
+def _scenario_list(text: str) -> list:
+    names = [part.strip() for part in text.split(",") if part.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 10, 50], help="comma-separated levels")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario and level")
+    parser.add_argument("--warmup", type=int, default=50, help="untimed requests before each level")
+    parser.add_argument("--scenarios", type=_scenario_list, default=list(SCENARIOS))
+    parser.add_argument("--users", type=int, default=1000, help="seeded users")
+    parser.add_argument("--mean-transactions", type=float, default=20.0, help="seeded ledger events per user")
+    parser.add_argument("--page-size", type=int, default=20, help="history page size")
+    parser.add_argument("--profile", default="wal", help="SQLite pragma profile from db_config")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    # db_config reads these at import time, so set them before importing the app modules.
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["SQLITE_PRAGMA_PROFILE"] = args.profile
+
+    seed_database(args)
+    results = asyncio.run(benchmark(args))
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "users": args.users,
+            "mean_transactions": args.mean_transactions,
+            "page_size": args.page_size,
+            "profile": args.profile,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Throughput of registration, login and token-authenticated requests.
+
+Drives ``main.app`` through ``httpx.ASGITransport`` against a temporary
+SQLite database for each hashing pool configuration in ``--pools``
+(``kind:workers``). While logins run, a probe keeps calling the cached
+``GET /auth/me``; its latency shows whether hashing stays off the event
+loop. ``/auth/me`` is also measured alone with the verified-token cache
+on and off.
+
+    python scripts/bench_auth.py --pools thread:1,thread:4,process:4 --concurrency 16 --requests 200
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_api import percentile  # noqa: E402
+
+
+class Calls:
+    """A ``bench_api.run_level`` scenario from a coroutine factory taking the request index."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.count = 0
+
+    async def call(self, client, state):
+        self.count += 1
+        return await self.factory(self.count)
+
+
+async def probe(client, token: str, stop: asyncio.Event) -> list:
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.005)
+    return sorted(latencies)
+
+
+def report(label: str, level: dict, extra: str = ""):
+    print(f"{label:<24} {level['throughput_rps']:>8,.0f} req/s  p50 {level['p50_ms']:8.2f} ms  "
+          f"p99 {level['p99_ms']:8.2f} ms  non-2xx {level['non_2xx']}{extra}", flush=True)
+
+
+async def run_pool(args, client, kind: str, workers: int, tag: str):
+    import auth
+    import passwords
+    from bench_api import run_level
+
+    passwords.pool.shutdown()
+    passwords.pool = passwords.HashPool(kind, workers)
+    label = f"{kind}:{workers}"
+
+    register = Calls(lambda i: client.post("/users/", json={
+        "username": f"{tag}_{i}", "email": f"{tag}_{i}@example.com", "password": f"pw-{i}"}))
+    report(f"{label} register", await run_level(client, register, args.concurrency, args.requests))
+
+    token = (await client.post("/auth/login", json={"username": f"{tag}_1", "password": "pw-1"})).json()["access_token"]
+    stop = asyncio.Event()
+    probing = asyncio.create_task(probe(client, token, stop))
+    users = register.count
+    login = Calls(lambda i: client.post("/auth/login", json={
+        "username": f"{tag}_{i % users + 1}", "password": f"pw-{i % users + 1}"}))
+    level = await run_level(client, login, args.concurrency, args.requests)
+    stop.set()
+    probe_latencies = await probing
+    report(f"{label} login", level, f"  probe p99 {percentile(probe_latencies, 0.99) * 1000:.2f} ms")
+
+    for cached in (True, False):
+        auth.token_cache.clear()
+        auth.token_cache.max_size = auth.AUTH_TOKEN_CACHE_SIZE if cached else 0
+        me = Calls(lambda i: client.get("/auth/me", headers={"Authorization": f"Bearer {token}"}))
+        report(f"{label} me ({'cached' if cached else 'uncached'})",
+               await run_level(client, me, args.concurrency, args.requests * 10))
+    auth.token_cache.max_size = auth.AUTH_TOKEN_CACHE_SIZE
+
+
+async def benchmark(args):
+    import httpx
+    import schema
+    from database import engine
+
+    schema.upgrade(engine)
+    import main
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+        for number, spec in enumerate(args.pools):
+            kind, _, workers = spec.partition(":")
+            await run_pool(args, client, kind, int(workers or os.cpu_count() or 1), f"bench{number}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pools", type=lambda text: [part for part in text.split(",") if part],
+                        default=["thread:1", f"thread:{os.cpu_count() or 1}"], help="comma-separated kind:workers")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="registrations and logins per pool")
+    args = parser.parse_args()
+
+    # db_config reads these at import time, so set them before importing the app modules.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["OUTBOX_DISPATCH"] = "0"
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Concurrency benchmark for atomic balance transfers.
+
+Fires thousands of concurrent ``async_crud.transfer_money`` calls against a fresh
+SQLite database and checks that money is neither created nor destroyed:
+the total balance must be unchanged and every user's balance must match
+their ledger.
+
+    python scripts/bench_concurrent_transfers.py --users 50 --transfers 5000 --workers 32
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine, func
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import async_crud
+from database import Base
+from models import Transaction, TransactionType, User
+
+
+def seed(SessionLocal, users: int, balance: float):
+    db = SessionLocal()
+    try:
+        db.add_all([
+            User(username=f"bench{i}", email=f"bench{i}@example.com", hashed_password="x", balance=balance)
+            for i in range(users)
+        ])
+        db.commit()
+        return [row.id for row in db.query(User.id).all()]
+    finally:
+        db.close()
+
+
+def run(args):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 60})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    user_ids = seed(SessionLocal, args.users, args.balance)
+    expected_total = args.users * args.balance
+    rng = random.Random(args.seed)
+    jobs = []
+    for _ in range(args.transfers):
+        sender, recipient = rng.sample(user_ids, 2)
+        jobs.append((sender, recipient, float(rng.randint(1, args.max_amount))))
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", connect_args={"timeout": 60})
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+    semaphore = asyncio.Semaphore(args.workers)
+
+    async def transfer(job):
+        async with semaphore, AsyncSessionLocal() as db:
+            try:
+                await async_crud.transfer_money(db, sender_id=job[0], recipient_id=job[1], amount=job[2])
+                return True
+            except HTTPException:
+                return False
+
+    async def transfer_all():
+        try:
+            return await asyncio.gather(*(transfer(job) for job in jobs))
+        finally:
+            await async_engine.dispose()
+
+    start = time.perf_counter()
+    outcomes = asyncio.run(transfer_all())
+    elapsed = time.perf_counter() - start
+
+    db = SessionLocal()
+    try:
+        total = db.query(func.sum(User.balance)).scalar()
+        negative = db.query(func.count(User.id)).filter(User.balance < 0).scalar()
+        ledger = dict(
+            db.query(Transaction.user_id, func.sum(Transaction.amount))
+            .filter(Transaction.transaction_type == TransactionType.TRANSFER_IN)
+            .group_by(Transaction.user_id)
+            .all()
+        )
+        spent = dict(
+            db.query(Transaction.user_id, func.sum(Transaction.amount))
+            .filter(Transaction.transaction_type == TransactionType.TRANSFER_OUT)
+            .group_by(Transaction.user_id)
+            .all()
+        )
+        drift = [
+            u.id for u in db.query(User).all()
+            if abs(args.balance + ledger.get(u.id, 0.0) - spent.get(u.id, 0.0) - u.balance) > 1e-6
+        ]
+    finally:
+        db.close()
+        engine.dispose()
+
+    ok = sum(outcomes)
+    print(f"transfers: {len(jobs)} ({ok} committed, {len(jobs) - ok} rejected)")
+    print(f"elapsed:   {elapsed:.2f}s ({len(jobs) / elapsed:.0f} transfers/s, {args.workers} concurrent)")
+    print(f"total:     {total:.2f} (expected {expected_total:.2f})")
+    print(f"negative balances: {negative}, users drifting from ledger: {len(drift)}")
+    if abs(total - expected_total) > 1e-6 or negative or drift:
+        print("FAILED: balances are inconsistent")
+        return 1
+    print("OK")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--transfers", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=32, help="transfers in flight at once")
+    parser.add_argument("--balance", type=float, default=100.0)
+    parser.add_argument("--max-amount", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=42)
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
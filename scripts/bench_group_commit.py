@@ -0,0 +1,98 @@
+"""Throughput of money-moving writes with group commit on and off.
+
+Runs ``--ops`` concurrent ``async_crud.add_money`` / ``withdraw_money``
+calls against a fresh SQLite database, first committing each request on
+its own and then through the group-commit writer, and reports ops/s plus
+the writer's batch-size and queue-wait histograms.
+
+    python scripts/bench_group_commit.py --ops 5000 --concurrency 200 --profile durable
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+async def run_mode(group: bool, args) -> float:
+    import async_crud
+    import group_commit
+    from database import AsyncSessionLocal
+    from fastapi import HTTPException
+
+    group_commit.configure(group, window_ms=args.window_ms, max_ops=args.max_ops)
+    rng = random.Random(args.seed)
+    jobs = [(rng.randint(1, args.users), rng.random() < 0.7) for _ in range(args.ops)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(user_id: int, credit: bool):
+        async with semaphore:
+            async with AsyncSessionLocal() as db:
+                try:
+                    if credit:
+                        await async_crud.add_money(db, user_id=user_id, amount=5.0)
+                    else:
+                        await async_crud.withdraw_money(db, user_id=user_id, amount=3.0)
+                except HTTPException:
+                    pass
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(*job) for job in jobs))
+    elapsed = time.perf_counter() - started
+    if group:
+        stats = group_commit.writer.stats()
+        batch = stats["batch_size"]
+        wait = stats["queue_wait_seconds"]
+        print(f"  batches: {batch['count']}, mean size {batch['sum'] / max(batch['count'], 1):.1f}")
+        print(f"  batch size buckets:  {batch['buckets']}")
+        print(f"  mean queue wait: {1000 * wait['sum'] / max(wait['count'], 1):.2f} ms")
+        await group_commit.shutdown()
+        group_commit.configure(False)
+    return args.ops / elapsed
+
+
+async def main_async(args):
+    from database import Base, engine, SessionLocal
+    from models import User
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    db.add_all([
+        User(username=f"bench{i}", email=f"bench{i}@example.com", hashed_password="x", balance=100.0)
+        for i in range(args.users)
+    ])
+    db.commit()
+    db.close()
+
+    off = await run_mode(False, args)
+    print(f"group commit off: {off:,.0f} ops/s")
+    on = await run_mode(True, args)
+    print(f"group commit on:  {on:,.0f} ops/s ({on / off:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    parser.add_argument("--max-ops", type=int, default=128)
+    parser.add_argument("--profile", default="durable", help="SQLite pragma profile from db_config")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    # db_config reads these at import time, so set them before importing the app modules.
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["SQLITE_PRAGMA_PROFILE"] = args.profile
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
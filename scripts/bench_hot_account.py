@@ -0,0 +1,122 @@
+"""Credit throughput to a single hot account by slot count.
+
+Runs ``--ops`` concurrent ``async_crud.transfer_money`` calls from many
+payers to one merchant, once with the merchant as a plain account and
+then sharded across each ``--slots`` count, reports transfers/s, and
+checks the merchant's balance against the credits it received.
+
+    python scripts/bench_hot_account.py --slots 1,4,16,64 --concurrency 64
+    python scripts/bench_hot_account.py --database-url postgresql://wallet@localhost/bench
+
+SQLite serializes all writers on its database lock, so there the numbers
+stay flat and only show the sharding overhead; the per-row contention
+that slots remove appears on backends with row-level locking.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def prepare(args, slots: int):
+    """Fresh merchant and payers for one run; returns (merchant id, payer ids)."""
+    import hot_accounts
+    from database import SessionLocal
+    from models import User
+
+    with SessionLocal() as db:
+        tag = f"{slots}_{time.time_ns()}"
+        merchant = User(username=f"merchant_{tag}", email=f"merchant_{tag}@example.com", hashed_password="x", balance=0.0)
+        payers = [
+            User(username=f"payer_{tag}_{i}", email=f"payer_{tag}_{i}@example.com", hashed_password="x", balance=1e6)
+            for i in range(args.payers)
+        ]
+        db.add(merchant)
+        db.add_all(payers)
+        db.commit()
+        if slots:
+            hot_accounts.designate(db, merchant.id, slots)
+        return merchant.id, [payer.id for payer in payers]
+
+
+async def run(args, slots: int) -> float:
+    import async_crud
+    import hot_accounts
+    from balance_cache import balance_cache
+    from database import AsyncSessionLocal, SessionLocal
+
+    merchant, payers = prepare(args, slots)
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    failures = 0
+
+    async def one(payer: int):
+        nonlocal failures
+        async with semaphore:
+            async with AsyncSessionLocal() as db:
+                try:
+                    await async_crud.transfer_money(db, sender_id=payer, recipient_id=merchant, amount=1.0)
+                except Exception:
+                    failures += 1
+
+    consolidator = asyncio.create_task(hot_accounts.consolidate_forever(AsyncSessionLocal, args.consolidate_interval))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(rng.choice(payers)) for _ in range(args.ops)))
+    elapsed = time.perf_counter() - started
+    consolidator.cancel()
+
+    balance_cache.invalidate(merchant)
+    async with AsyncSessionLocal() as db:
+        balance = await async_crud.get_user_balance(db, merchant)
+    expected = float(args.ops - failures)
+    label = f"{slots} slots" if slots else "unsharded"
+    print(f"{label:>10}: {(args.ops - failures) / elapsed:9,.0f} transfers/s  failures {failures}  "
+          f"balance {balance:,.0f} ({'exact' if balance == expected else f'expected {expected:,.0f}'})")
+    if slots:
+        with SessionLocal() as db:
+            hot_accounts.release(db, merchant)
+    return (args.ops - failures) / elapsed
+
+
+def _int_list(text: str) -> list:
+    return [int(part) for part in text.split(",") if part]
+
+
+async def main_async(args):
+    import schema
+    from database import engine
+
+    schema.upgrade(engine)
+    baseline = await run(args, 0)
+    for slots in args.slots:
+        rate = await run(args, slots)
+        print(f"{'':>10}  {rate / baseline:.2f}x unsharded")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to a fresh temporary SQLite file")
+    parser.add_argument("--ops", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--payers", type=int, default=500)
+    parser.add_argument("--slots", type=_int_list, default=[1, 4, 16, 64], help="comma-separated slot counts")
+    parser.add_argument("--consolidate-interval", type=float, default=0.5)
+    parser.add_argument("--profile", default="wal", help="SQLite pragma profile from db_config")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    # db_config reads these at import time, so set them before importing the app modules.
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["SQLITE_PRAGMA_PROFILE"] = args.profile
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Write-request latency with the outbox dispatcher behind slow consumers.
+
+Runs the ``add`` and ``transfer`` scenarios of ``bench_api`` once with no
+dispatcher and then with one delivering to an HTTP stand-in that takes
+each ``--sink-delay`` seconds per event. Request latency should not move
+with the delay; delivery lag and the backlog left at the end of the run
+do.
+
+    python scripts/bench_outbox.py --sink-delay 0,0.05,0.5 --concurrency 10 --requests 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_api import Scenario, run_level, seed_database  # noqa: E402
+
+BENCH_SCENARIOS = ("add", "transfer")
+
+
+async def backlog() -> int:
+    from sqlalchemy import func, select
+
+    from database import AsyncSessionLocal
+    from models import OutboxEvent
+
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(OutboxEvent).where(OutboxEvent.dead == 0))
+
+
+async def run(args, client, delay):
+    import httpx
+    import outbox
+
+    dispatcher = None
+    if delay is not None:
+        sink = outbox.HttpSink("http://stand-in/events",
+                               transport=httpx.ASGITransport(app=outbox.stand_in_app(delay=delay)),
+                               timeout=max(5.0, delay * 4))
+        dispatcher = outbox.OutboxDispatcher([sink], concurrency=args.dispatch_concurrency,
+                                             delivery_timeout=max(5.0, delay * 4))
+        dispatcher.start()
+    label = "no dispatcher" if delay is None else f"sink {delay * 1000:g} ms"
+    try:
+        for name in BENCH_SCENARIOS:
+            scenario = Scenario(name, args.users, 20, random.Random(f"{args.seed}:{name}"))
+            level = await run_level(client, scenario, args.concurrency, args.requests)
+            print(f"{label:>14} {name:<9} {level['throughput_rps']:>8,.0f} req/s  p50 {level['p50_ms']:7.2f} ms  "
+                  f"p95 {level['p95_ms']:7.2f} ms  p99 {level['p99_ms']:7.2f} ms  non-2xx {level['non_2xx']}",
+                  flush=True)
+        if dispatcher is not None:
+            deadline = time.perf_counter() + args.drain_seconds
+            while time.perf_counter() < deadline and await backlog():
+                await asyncio.sleep(0.1)
+            stats = dispatcher.stats()
+            lag = stats["delivery_lag_seconds"]
+            mean_lag = lag["sum"] / lag["count"] if lag["count"] else 0.0
+            print(f"{'':>14} delivered {stats['delivered']:,}  failed {stats['failed']:,}  "
+                  f"mean lag {mean_lag:.2f} s  backlog after {args.drain_seconds:g} s: {await backlog():,}",
+                  flush=True)
+    finally:
+        if dispatcher is not None:
+            await dispatcher.stop()
+    # Start every run from an empty outbox.
+    from sqlalchemy import delete
+
+    from database import AsyncSessionLocal
+    from models import OutboxEvent
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(OutboxEvent))
+        await db.commit()
+
+
+async def benchmark(args):
+    import httpx
+    import main
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+        for delay in [None] + args.sink_delay:
+            await run(args, client, delay)
+
+
+def _float_list(text: str) -> list:
+    return [float(part) for part in text.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sink-delay", type=_float_list, default=[0.0, 0.05, 0.5],
+                        help="comma-separated seconds the consumer takes per event")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario and delay")
+    parser.add_argument("--dispatch-concurrency", type=int, default=8, help="deliveries in flight")
+    parser.add_argument("--drain-seconds", type=float, default=5.0, help="how long to wait for the backlog")
+    parser.add_argument("--users", type=int, default=200, help="seeded users")
+    parser.add_argument("--mean-transactions", type=float, default=5.0, help="seeded ledger events per user")
+    parser.add_argument("--profile", default="wal", help="SQLite pragma profile from db_config")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # db_config reads these at import time, so set them before importing the app modules.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["SQLITE_PRAGMA_PROFILE"] = args.profile
+    os.environ["OUTBOX_DISPATCH"] = "0"
+
+    seed_database(args)
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Latency under rising offered load, with and without admission control.
+
+Measures capacity with a closed loop first, then offers an open-loop
+Poisson arrival stream at each ``--load`` multiple of it: requests are
+sent on schedule whether or not earlier ones finished, and latency is
+counted from the scheduled send time, so queueing is not hidden. The
+mix is ``--write-share`` ``add`` calls and history reads otherwise.
+Each level runs with admission control as configured (``ADMISSION_*``)
+and with its limits off (deadlines stay); p50/p99 of successful
+requests, goodput and the share answered 503 are reported.
+
+Requests go straight into ``main.app`` as ASGI calls, without httpx,
+to keep the load generator's share of the event loop and CPU small; it
+still runs in the same process as the service.
+
+    python scripts/bench_overload.py --load 0.5,1,2,4 --duration 10
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_api import percentile, seed_database  # noqa: E402
+
+
+class Mix:
+    """History reads with a share of ``add`` writes, as (method, path, query string)."""
+
+    def __init__(self, args, rng: random.Random):
+        self.rng = rng
+        self.users = args.users
+        self.page_size = args.page_size
+        self.write_share = args.write_share
+
+    def next(self):
+        user_id = self.rng.randint(1, self.users)
+        if self.rng.random() < self.write_share:
+            return "POST", f"/wallet/{user_id}/add", "amount=5.0"
+        return "GET", f"/transactions/{user_id}", f"limit={self.page_size}"
+
+
+async def call(app, method: str, path: str, query: str) -> int:
+    """One request straight into the ASGI app; returns the status code."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    status = 0
+    sent = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    return status
+
+
+async def capacity(app, mix: Mix, concurrency: int, requests: int) -> float:
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await call(app, *mix.next())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - started)
+
+
+async def offer(app, mix: Mix, rate: float, duration: float, rng: random.Random) -> dict:
+    loop = asyncio.get_running_loop()
+    latencies, statuses = [], {}
+
+    async def send(scheduled: float, request):
+        try:
+            status = await call(app, *request)
+        except Exception:
+            status = "error"
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == 200:
+            latencies.append(loop.time() - scheduled)
+
+    tasks = []
+    started = loop.time()
+    scheduled = started
+    while scheduled < started + duration:
+        # Only yield when ahead of schedule: overdue arrivals are all sent now.
+        if scheduled > loop.time():
+            await asyncio.sleep(scheduled - loop.time())
+        tasks.append(asyncio.create_task(send(scheduled, mix.next())))
+        scheduled += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - started
+    latencies.sort()
+    return {
+        "offered": len(tasks),
+        "goodput_rps": len(latencies) / elapsed,
+        "shed": statuses.get(503, 0) / len(tasks),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "other": {status: count for status, count in statuses.items() if status not in (200, 503)},
+    }
+
+
+def set_admission(enabled: bool, saved: dict):
+    import admission
+
+    for limiter in admission.limiters():
+        limiter.limit = saved[limiter.name] if enabled else 0
+
+
+async def benchmark(args):
+    import admission
+    import main
+
+    app = main.app
+    saved = {limiter.name: limiter.limit for limiter in admission.limiters()}
+    mix = Mix(args, random.Random(args.seed))
+    await capacity(app, mix, args.concurrency, args.warmup)
+    measured = await capacity(app, mix, args.concurrency, args.capacity_requests)
+    print(f"capacity ~{measured:,.0f} req/s at concurrency {args.concurrency}; limits {saved}", flush=True)
+    print(f"{'load':>5} {'admission':>9} {'offered/s':>10} {'goodput/s':>10} {'shed':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    for load in args.load:
+        for enabled in (True, False):
+            set_admission(enabled, saved)
+            result = await offer(app, mix, measured * load, args.duration, random.Random(args.seed))
+            other = f"  other {result['other']}" if result["other"] else ""
+            print(f"{load:>5.1f} {'on' if enabled else 'off':>9} {result['offered'] / args.duration:>10,.0f} "
+                  f"{result['goodput_rps']:>10,.0f} {result['shed']:>6.1%} {result['p50_ms']:>9.1f} "
+                  f"{result['p99_ms']:>9.1f}{other}", flush=True)
+            # Let the previous level's backlog drain before the next.
+            await asyncio.sleep(1.0)
+    set_admission(True, saved)
+
+
+def _float_list(text: str) -> list:
+    return [float(part) for part in text.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--load", type=_float_list, default=[0.5, 1.0, 2.0, 4.0],
+                        help="offered load as comma-separated multiples of measured capacity")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--write-share", type=float, default=0.2, help="fraction of requests that are adds")
+    parser.add_argument("--concurrency", type=int, default=32, help="closed-loop concurrency for capacity")
+    parser.add_argument("--capacity-requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000, help="seeded users")
+    parser.add_argument("--mean-transactions", type=float, default=20.0, help="seeded ledger events per user")
+    parser.add_argument("--page-size", type=int, default=20, help="history page size")
+    parser.add_argument("--profile", default="wal", help="SQLite pragma profile from db_config")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # db_config reads these at import time, so set them before importing the app modules.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["SQLITE_PRAGMA_PROFILE"] = args.profile
+    os.environ["OUTBOX_DISPATCH"] = "0"
+
+    seed_database(args)
+    started = time.perf_counter()
+    asyncio.run(benchmark(args))
+    print(f"done in {time.perf_counter() - started:.0f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Clients polling a user and its balance, with and without If-None-Match.
+
+Drives ``main.app`` through ``httpx.ASGITransport`` against a freshly
+seeded temporary SQLite database. Each poll reads ``GET /users/{id}`` or
+``GET /wallet/{id}/balance`` for one of ``--watched`` users; a
+``--write-share`` of the requests are ``add`` calls to those users, so
+some polls do find a change. Conditional clients send back the last
+ETag per path. Reported per mode: throughput, p50/p99, the share
+answered 304, SQL statements and response body bytes per poll.
+
+    python scripts/bench_polling.py --requests 5000 --concurrency 16 --write-share 0.02
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_api import percentile, seed_database  # noqa: E402
+
+
+async def run_mode(client, args, conditional: bool) -> dict:
+    import instrumentation
+
+    rng = random.Random(args.seed)
+    tags, latencies, statuses = {}, [], {}
+    body_bytes = polls = 0
+    remaining = iter(range(args.requests))
+
+    async def worker():
+        nonlocal body_bytes, polls
+        for _ in remaining:
+            user_id = rng.randint(1, args.watched)
+            if rng.random() < args.write_share:
+                await client.post(f"/wallet/{user_id}/add", params={"amount": 1.0})
+                continue
+            path = rng.choice((f"/users/{user_id}", f"/wallet/{user_id}/balance"))
+            headers = {"If-None-Match": tags[path]} if conditional and path in tags else {}
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            body_bytes += len(response.content)
+            polls += 1
+            if "ETag" in response.headers:
+                tags[path] = response.headers["ETag"]
+
+    instrumentation.registry.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    statements = sum(metrics.statements for (method, _), metrics in instrumentation.registry.routes()
+                     if method == "GET")
+    latencies.sort()
+    return {
+        "throughput_rps": args.requests / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "not_modified": statuses.get(304, 0) / polls,
+        "statements_per_poll": statements / polls,
+        "bytes_per_poll": body_bytes / polls,
+        "other": {status: count for status, count in statuses.items() if status not in (200, 304)},
+    }
+
+
+async def benchmark(args):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'mode':<12} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'304':>6} {'SQL/poll':>9} {'bytes/poll':>11}")
+        for conditional in (False, True):
+            await run_mode(client, args, conditional)
+            result = await run_mode(client, args, conditional)
+            other = f"  other {result['other']}" if result["other"] else ""
+            print(f"{'conditional' if conditional else 'plain':<12} {result['throughput_rps']:>8,.0f} "
+                  f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['not_modified']:>6.1%} "
+                  f"{result['statements_per_poll']:>9.2f} {result['bytes_per_poll']:>11.1f}{other}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000, help="requests per mode, polls and writes")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--watched", type=int, default=200, help="users being polled")
+    parser.add_argument("--write-share", type=float, default=0.02, help="fraction of requests that are adds")
+    parser.add_argument("--users", type=int, default=1000, help="seeded users")
+    parser.add_argument("--mean-transactions", type=float, default=5.0, help="seeded ledger events per user")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # db_config reads these at import time, so set them before importing the app modules.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["OUTBOX_DISPATCH"] = "0"
+
+    seed_database(args)
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Per-request CPU of the history and add routes, before and after the fast encoding path.
+
+Mounts the previous handlers next to the current ones on ``main.app``:
+``/before/transactions/{id}`` loads ORM objects and validates every row
+through ``schemas.TransactionPage``, and ``/before/wallet/{id}/add``
+returns the ORM object for ``jsonable_encoder``. Each route is driven
+sequentially through ``httpx.ASGITransport`` against a freshly seeded
+SQLite database, and the process CPU time per request is reported.
+
+    python scripts/bench_serialization.py --requests 2000 --page-size 20,100
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_api import seed_database  # noqa: E402
+
+
+def mount_before_routes(app):
+    """The handlers as they were before typed results and column-only pages."""
+    from typing import Optional
+
+    from fastapi import Depends, Header
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    import async_crud
+    import idempotency
+    import schemas
+    from crud import split_page, transactions_page_stmt
+    from database import get_async_db, get_async_read_db
+
+    @app.get("/before/transactions/{user_id}", response_model=schemas.TransactionPage)
+    async def before_transactions(user_id: int, cursor: Optional[str] = None, limit: int = 10,
+                                  db: AsyncSession = Depends(get_async_read_db)):
+        rows = list(await db.scalars(transactions_page_stmt(user_id, cursor, limit)))
+        transactions, next_cursor = split_page(rows, limit)
+        return {"transactions": transactions, "next_cursor": next_cursor}
+
+    @app.post("/before/wallet/{user_id}/add")
+    async def before_add(user_id: int, amount: float, description: Optional[str] = None,
+                         idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+        request = idempotency.build_request(idempotency_key, "add", owner=user_id, user_id=user_id, amount=amount,
+                                            description=description)
+        transaction = await idempotency.execute(db, request, lambda idem: async_crud.add_money(
+            db, user_id=user_id, amount=amount, description=description, idempotency=idem))
+        return {"message": "Money added successfully", "transaction": transaction}
+
+
+async def measure(client, requests: int, call) -> dict:
+    started_cpu, started = time.process_time(), time.perf_counter()
+    for _ in range(requests):
+        response = await call()
+        assert response.status_code == 200, response.text
+    cpu, elapsed = time.process_time() - started_cpu, time.perf_counter() - started
+    return {"cpu_us": cpu / requests * 1e6, "wall_us": elapsed / requests * 1e6}
+
+
+async def benchmark(args):
+    import httpx
+    import main
+
+    mount_before_routes(main.app)
+    rng = random.Random(args.seed)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+        cases = [(f"history limit={size}", lambda prefix, size=size: client.get(
+                      f"{prefix}/transactions/{rng.randint(1, args.users)}", params={"limit": size}))
+                 for size in args.page_size]
+        cases.append(("add", lambda prefix: client.post(f"{prefix}/wallet/{rng.randint(1, args.users)}/add",
+                                                        params={"amount": 1.0})))
+        print(f"{'route':<20} {'before cpu':>12} {'after cpu':>12} {'saved':>7}")
+        for name, call in cases:
+            results = {}
+            for label, prefix in (("before", "/before"), ("after", "")):
+                await measure(client, args.warmup, lambda: call(prefix))
+                results[label] = await measure(client, args.requests, lambda: call(prefix))
+            before, after = results["before"]["cpu_us"], results["after"]["cpu_us"]
+            print(f"{name:<20} {before:>9,.0f} us {after:>9,.0f} us {1 - after / before:>6.0%}", flush=True)
+
+
+def _int_list(text: str) -> list:
+    return [int(part) for part in text.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000, help="requests per route and variant")
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--page-size", type=_int_list, default=[20, 100], help="comma-separated history page sizes")
+    parser.add_argument("--users", type=int, default=200, help="seeded users")
+    parser.add_argument("--mean-transactions", type=float, default=150.0, help="seeded ledger events per user")
+    parser.add_argument("--profile", default="wal", help="SQLite pragma profile from db_config")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # db_config reads these at import time, so set them before importing the app modules.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["SQLITE_PRAGMA_PROFILE"] = args.profile
+    os.environ["OUTBOX_DISPATCH"] = "0"
+
+    seed_database(args)
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
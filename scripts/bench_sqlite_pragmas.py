@@ -0,0 +1,98 @@
+"""Read/write throughput of each SQLite pragma profile.
+
+For every profile in ``db_config.PRAGMA_PROFILES`` a fresh database is
+seeded, then writer tasks call ``async_crud.add_money`` while reader
+tasks call ``async_crud.get_user_balance`` for a fixed duration. Reports
+committed writes/s, reads/s and how many operations failed with
+"database is locked".
+
+    python scripts/bench_sqlite_pragmas.py --duration 5 --writers 4 --readers 8
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import async_crud
+import db_config
+from balance_cache import balance_cache
+from database import Base
+from models import User
+
+
+async def bench_profile(profile: str, args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = db_config.build_engine(f"sqlite:///{path}", profile=profile)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = SessionLocal()
+    db.add_all([
+        User(username=f"bench{i}", email=f"bench{i}@example.com", hashed_password="x", balance=0.0)
+        for i in range(args.users)
+    ])
+    db.commit()
+    db.close()
+    engine.dispose()
+    # Ids repeat across profiles; drop balances cached from the previous one.
+    balance_cache.clear()
+
+    async_engine = db_config.build_async_engine(f"sqlite+aiosqlite:///{path}", profile=profile)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(kind: str, seed: int):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            async with AsyncSessionLocal() as db:
+                try:
+                    user_id = rng.randint(1, args.users)
+                    if kind == "writes":
+                        await async_crud.add_money(db, user_id=user_id, amount=1.0)
+                    else:
+                        await async_crud.get_user_balance(db, user_id=user_id)
+                    counts[kind] += 1
+                except OperationalError:
+                    counts["locked"] += 1
+
+    workers = [worker("writes", i) for i in range(args.writers)]
+    workers += [worker("reads", 1000 + i) for i in range(args.readers)]
+    await asyncio.gather(*workers)
+    stats = db_config.pool_status(async_engine)
+    await async_engine.dispose()
+    return {
+        "profile": profile,
+        "writes_per_s": counts["writes"] / args.duration,
+        "reads_per_s": counts["reads"] / args.duration,
+        "locked": counts["locked"],
+        "pool": stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="*", default=sorted(db_config.PRAGMA_PROFILES))
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'profile':<10} {'writes/s':>10} {'reads/s':>10} {'locked':>8}")
+    for profile in args.profiles:
+        result = asyncio.run(bench_profile(profile, args))
+        print(f"{result['profile']:<10} {result['writes_per_s']:>10.0f} {result['reads_per_s']:>10.0f} {result['locked']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Apply, inspect or generate schema migrations (see ``schema``).
+
+Run once per deploy, before the new workers start; they refuse to start
+on a database older than their code. ``generate`` writes the next file in
+``migrations/`` from the difference between ``models.py`` and the
+migrated schema, to be reviewed and committed with the model change.
+
+    python scripts/migrate.py
+    python scripts/migrate.py --database-url sqlite:///./load.db upgrade --target 1
+    python scripts/migrate.py status
+    python scripts/migrate.py generate "index transactions by created_at"
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to DATABASE_URL")
+    commands = parser.add_subparsers(dest="command")
+    upgrade = commands.add_parser("upgrade", help="apply pending migrations (the default)")
+    upgrade.add_argument("--target", type=int, help="stop after this version")
+    commands.add_parser("status", help="show the applied and pending versions")
+    generate = commands.add_parser("generate", help="write the next migration from models.py")
+    generate.add_argument("name", help="what the migration does, e.g. \"add users.locale\"")
+    args = parser.parse_args()
+
+    # db_config reads this at import time, so set it before importing the app modules.
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    import schema
+    from database import engine
+
+    if args.command == "generate":
+        path = schema.generate(args.name)
+        print(f"wrote {path}" if path else "models.py matches the migrations; nothing to generate")
+        return
+
+    with engine.connect() as conn:
+        version = schema.current_version(conn)
+    pending = [migration for migration in schema.migrations() if migration.version > version]
+    if args.command == "status":
+        print(f"database at version {version}, code at {schema.head_version()}")
+        for migration in pending:
+            print(f"  pending {migration.version:04d}_{migration.name}")
+        return
+
+    applied = schema.upgrade(engine, target=getattr(args, "target", None), on_step=lambda migration, seconds: print(
+        f"applied {migration.version:04d}_{migration.name} in {seconds:.2f} s", flush=True))
+    with engine.connect() as conn:
+        print(f"database at version {schema.current_version(conn)} ({len(applied)} applied)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Reconcile users.balance against the signed sum of each user's ledger.
+
+Runs ``reconciliation.reconcile`` over id-range partitions of the users
+table on a process pool, prints a summary and the largest drifts, and
+exits with status 1 when any user is out of balance.
+
+    python scripts/reconcile_ledger.py --workers 8 --output drift.json
+    python scripts/reconcile_ledger.py --database-url sqlite:///./load.db --drifts drifts.ndjson
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to DATABASE_URL")
+    parser.add_argument("--partition-size", type=int, help="users per partition (RECONCILE_PARTITION_SIZE)")
+    parser.add_argument("--workers", type=int, help="worker processes (RECONCILE_WORKERS)")
+    parser.add_argument("--tolerance", type=float, help="largest |drift| still in balance (RECONCILE_TOLERANCE)")
+    parser.add_argument("--max-drifts", type=int, default=1000, help="largest drifts kept in the report")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--drifts", help="stream every drifted user to this NDJSON file")
+    parser.add_argument("--show", type=int, default=10, help="drifts to print")
+    args = parser.parse_args()
+
+    # db_config reads this at import time, so set it before importing the app modules.
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    import reconciliation
+
+    drift_file = open(args.drifts, "w") if args.drifts else None
+
+    def on_drift(drift: dict):
+        drift_file.write(json.dumps(drift) + "\n")
+
+    def on_partition(result: dict):
+        print(f"users {result['lo']:>10}-{result['hi'] - 1:<10} {result['rows']:>12,} rows  "
+              f"{len(result['drifts']):>6,} drifted", file=sys.stderr, flush=True)
+
+    try:
+        report = reconciliation.reconcile(
+            partition_size=args.partition_size or reconciliation.RECONCILE_PARTITION_SIZE,
+            workers=args.workers or reconciliation.RECONCILE_WORKERS,
+            tolerance=reconciliation.RECONCILE_TOLERANCE if args.tolerance is None else args.tolerance,
+            max_drifts=args.max_drifts,
+            on_drift=on_drift if drift_file else None,
+            on_partition=on_partition,
+        )
+    finally:
+        if drift_file:
+            drift_file.close()
+
+    rate = report["rows"] / report["elapsed_seconds"] if report["elapsed_seconds"] else 0.0
+    print(f"partitions:    {report['partitions']:,}")
+    print(f"users:         {report['users']:,}")
+    print(f"ledger rows:   {report['rows']:,} ({rate:,.0f} rows/s)")
+    print(f"balances:      {report['balance_total']:,.2f}")
+    print(f"ledger total:  {report['ledger_total']:,.2f}")
+    print(f"drifted users: {report['drifted_users']:,} (net drift {report['drift_total']:,.2f})")
+    for drift in report["drifts"][:args.show]:
+        print(f"  user {drift['user_id']}: balance {drift['balance']:,.2f}  ledger {drift['ledger_total']:,.2f}  "
+              f"drift {drift['drift']:+,.2f}")
+    print(f"elapsed:       {report['elapsed_seconds']:.2f}s")
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
+    sys.exit(1 if report["drifted_users"] else 0)
+
+
+if __name__ == "__main__":
+    main()
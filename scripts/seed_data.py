@@ -1,5 +1,45 @@
+"""Synthetic data generator and bulk loader for the wallet schema.
+
+Streams generated users and their ledgers into the tables from
+``models.py`` with chunked executemany inserts. Generation is driven by a
+seeded RNG per block of users, so the same ``--seed`` produces the same
+data whatever the ``--workers`` count.
+
+Every user's history starts with an opening DEPOSIT and is replayed in
+time order, so debits never overdraw and ``users.balance`` always equals
+the signed sum of the user's ledger; each row's ``balance_after`` is the
+running sum. Transfers pair a TRANSFER_OUT with a TRANSFER_IN inside the
+same block of users.
+
+Generated users all log in with the password ``seeded``; it is hashed
+once per run and that hash shared, since hashing per user would cost
+more than generating the data. Sample users get their own hashes.
+
+    python scripts/seed_data.py --users 100000 --mean-transactions 50 --workers 4
+    python scripts/seed_data.py --database-url sqlite:///./load.db --samples
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import func, select
+
+import db_config
+import schema
+from models import BALANCE_SIGN, Transaction, TransactionType, User
+from passwords import hash_password
+
+SEED_PASSWORD = "seeded"
+
 """create sample 5 sample users"""
-[
+SAMPLE_USERS = [
   {
     "username": "john_doe",
     "email": "john@example.com",
@@ -40,3 +80,247 @@
     "balance": 50.00
   }
 ]
+
+# Relative frequency of each kind of ledger event. TRANSFER produces a
+# TRANSFER_OUT / TRANSFER_IN pair.
+DEFAULT_MIX = {
+    "CREDIT": 0.25,
+    "DEBIT": 0.15,
+    "TRANSFER": 0.30,
+    "PAYMENT": 0.12,
+    "WITHDRAWAL": 0.05,
+    "FEE": 0.05,
+    "REFUND": 0.03,
+    "DEPOSIT": 0.05,
+}
+
+
+def parse_mix(text: str) -> dict:
+    """Parse ``CREDIT=0.3,TRANSFER=0.5`` into a weight map."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip().upper()
+        if name != "TRANSFER" and name not in TransactionType.__members__:
+            raise argparse.ArgumentTypeError(f"unknown transaction type {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+
+def activity_count(rng: random.Random, mean: float, alpha: float, cap: int) -> int:
+    """Heavy-tailed (Pareto) number of ledger events for one user."""
+    if mean <= 0:
+        return 0
+    scale = mean * (alpha - 1) / alpha if alpha > 1 else mean
+    return min(cap, int(rng.paretovariate(alpha) * scale))
+
+
+def generate_block(task):
+    """Generate users ``[first_id, first_id + count)`` and their ledgers."""
+    block, first_id, count, opts = task
+    rng = random.Random(f"{opts['seed']}:{block}")
+    end = opts["end"]
+    start = end - timedelta(days=opts["days"])
+    span = (end - start).total_seconds()
+    kinds = list(opts["mix"])
+    weights = [opts["mix"][kind] for kind in kinds]
+    user_ids = list(range(first_id, first_id + count))
+
+    users = []
+    events = []
+    for user_id in user_ids:
+        created_at = start + timedelta(seconds=rng.random() * span * 0.5)
+        users.append({
+            "id": user_id,
+            "username": f"user{user_id}",
+            "email": f"user{user_id}@example.com",
+            "full_name": f"User {user_id}",
+            "hashed_password": opts["password_hash"],
+            "is_active": 1,
+            "phone_number": None,
+            "balance": 0.0,
+            "created_at": created_at,
+            "updated_at": created_at,
+        })
+        opening = round(rng.lognormvariate(4, 1), 2)
+        events.append((created_at, user_id, "DEPOSIT", opening, None))
+        active_span = (end - created_at).total_seconds()
+        for _ in range(activity_count(rng, opts["mean"], opts["alpha"], opts["cap"])):
+            at = created_at + timedelta(seconds=rng.random() * active_span)
+            kind = rng.choices(kinds, weights)[0]
+            counterparty = rng.choice(user_ids) if kind == "TRANSFER" and count > 1 else None
+            if kind == "TRANSFER" and counterparty in (None, user_id):
+                continue
+            events.append((at, user_id, kind, round(rng.lognormvariate(2.5, 1.2), 2), counterparty))
+    events.sort(key=lambda event: event[0])
+
+    balances = {user_id: 0.0 for user_id in user_ids}
+    transactions = []
+    for at, user_id, kind, amount, counterparty in events:
+        if kind == "TRANSFER":
+            if balances[user_id] < amount:
+                continue
+            balances[user_id] -= amount
+            balances[counterparty] += amount
+            group = f"{rng.getrandbits(128):032x}"
+            transactions.append(_ledger_row(user_id, "TRANSFER_OUT", amount, at, recipient=counterparty,
+                                            description=f"Transfer to user {counterparty}", group=group,
+                                            balance_after=balances[user_id]))
+            transactions.append(_ledger_row(counterparty, "TRANSFER_IN", amount, at, recipient=counterparty,
+                                            sender=user_id, description=f"Transfer from user {user_id}", group=group,
+                                            balance_after=balances[counterparty]))
+            continue
+        sign = BALANCE_SIGN[TransactionType[kind]]
+        if sign < 0 and balances[user_id] < amount:
+            continue
+        balances[user_id] += sign * amount
+        transactions.append(_ledger_row(user_id, kind, amount, at, balance_after=balances[user_id]))
+    for user in users:
+        user["balance"] = round(balances[user["id"]], 2)
+    return users, transactions
+
+
+def _ledger_row(user_id, kind, amount, at, recipient=None, sender=None, description=None, group=None,
+                balance_after=None):
+    return {
+        "user_id": user_id,
+        "transaction_type": kind,
+        "amount": amount,
+        "description": description,
+        "reference_transaction_id": None,
+        "recipient_user_id": recipient,
+        "sender_user_id": sender,
+        "transfer_group": group,
+        "balance_after": None if balance_after is None else round(balance_after, 2),
+        "created_at": at,
+    }
+
+
+def _insert_chunks(conn, table, rows, chunk_size):
+    for offset in range(0, len(rows), chunk_size):
+        conn.execute(table.insert(), rows[offset:offset + chunk_size])
+
+
+def seed_samples(engine):
+    """Insert the five hand-written sample users with an opening deposit each."""
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        for sample in SAMPLE_USERS:
+            user_id = conn.execute(User.__table__.insert().values(
+                username=sample["username"],
+                email=sample["email"],
+                hashed_password=hash_password(sample["password"]),
+                phone_number=sample["phone_number"],
+                balance=sample["balance"],
+                is_active=1,
+                created_at=now,
+                updated_at=now,
+            )).inserted_primary_key[0]
+            conn.execute(Transaction.__table__.insert().values(
+                _ledger_row(user_id, "DEPOSIT", sample["balance"], now, description="Opening balance",
+                            balance_after=sample["balance"])
+            ))
+
+
+def generation_options(seed: int = 42, days: int = 365, mix: dict = None, mean_transactions: float = 20.0,
+                       pareto_alpha: float = 1.5, max_transactions: int = 100000) -> dict:
+    return {
+        "seed": seed,
+        "end": datetime.utcnow(),
+        "days": days,
+        "mix": mix or DEFAULT_MIX,
+        "mean": mean_transactions,
+        "alpha": pareto_alpha,
+        "cap": max_transactions,
+        "password_hash": hash_password(SEED_PASSWORD),
+    }
+
+
+def load(engine, users: int, opts: dict, block_size: int = 1000, chunk_size: int = 5000, workers: int = 1,
+         report_every: float = 0):
+    """Generate and insert ``users`` users after the current maximum id.
+
+    Returns the number of user and transaction rows written.
+    """
+    with engine.connect() as conn:
+        first_id = (conn.execute(select(func.max(User.id))).scalar() or 0) + 1
+    tasks = []
+    for block, offset in enumerate(range(0, users, block_size)):
+        tasks.append((block, first_id + offset, min(block_size, users - offset), opts))
+
+    pool = Pool(workers) if workers > 1 else None
+    blocks = pool.imap(generate_block, tasks) if pool else map(generate_block, tasks)
+    user_rows = transaction_rows = 0
+    started = last_report = time.perf_counter()
+    try:
+        for user_block, transactions in blocks:
+            with engine.begin() as conn:
+                _insert_chunks(conn, User.__table__, user_block, chunk_size)
+                _insert_chunks(conn, Transaction.__table__, transactions, chunk_size)
+            user_rows += len(user_block)
+            transaction_rows += len(transactions)
+            now = time.perf_counter()
+            if report_every and now - last_report >= report_every:
+                last_report = now
+                rate = (user_rows + transaction_rows) / (now - started)
+                print(f"  {user_rows} users, {transaction_rows} transactions ({rate:,.0f} rows/s)", flush=True)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return user_rows, transaction_rows
+
+
+def run(args):
+    engine = db_config.build_engine(args.database_url)
+    schema.upgrade(engine)
+    if args.samples:
+        seed_samples(engine)
+
+    opts = generation_options(
+        seed=args.seed,
+        days=args.days,
+        mix=args.mix,
+        mean_transactions=args.mean_transactions,
+        pareto_alpha=args.pareto_alpha,
+        max_transactions=args.max_transactions,
+    )
+    started = time.perf_counter()
+    user_rows, transaction_rows = load(
+        engine, args.users, opts,
+        block_size=args.block_size, chunk_size=args.chunk_size,
+        workers=args.workers, report_every=args.report_every,
+    )
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+
+    total = user_rows + transaction_rows
+    print(f"users:        {user_rows}")
+    print(f"transactions: {transaction_rows}")
+    print(f"elapsed:      {elapsed:.2f}s ({total / elapsed if elapsed else 0:,.0f} rows/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=db_config.DATABASE_URL)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--mean-transactions", type=float, default=20.0,
+                        help="mean ledger events per user")
+    parser.add_argument("--pareto-alpha", type=float, default=1.5,
+                        help="tail index of per-user activity; lower is heavier")
+    parser.add_argument("--max-transactions", type=int, default=100000,
+                        help="cap on events for a single user")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="event weights, e.g. CREDIT=0.3,TRANSFER=0.5,FEE=0.2")
+    parser.add_argument("--days", type=int, default=365, help="history length")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--block-size", type=int, default=1000, help="users generated per task")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows per executemany")
+    parser.add_argument("--workers", type=int, default=1, help="generator processes")
+    parser.add_argument("--samples", action="store_true", help="also insert the five sample users")
+    parser.add_argument("--report-every", type=float, default=5.0, help="progress interval in seconds")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Digital Wallet transaction search
+
+Filtered, newest-first search over one user's history for
+``GET /transactions/{user_id}/search``. Every filter is served by an
+index on ``transactions`` (see ``models.Transaction.__table_args__``);
+the free-text ``q`` filter uses the ``transactions_fts`` FTS5 index on
+SQLite, which triggers keep in sync with the table (both created by
+``migrations/0001_baseline.py``), and falls back to a case-insensitive
+substring match on other backends.
+"""
+
+from typing import Optional, Sequence
+
+from sqlalchemy import Integer, or_, select, text, tuple_
+
+import schemas
+from models import Transaction, TransactionType
+from pagination import decode_cursor
+
+"""FTS5 query text"""
+
+def fts_query(q: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    terms = ['"' + term.replace('"', '""') + '"*' for term in q.split()]
+    return " AND ".join(terms)
+
+
+def _escape_like(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+"""search statement"""
+
+def search_stmt(user_id: int, filters: schemas.TransactionSearch, cursor: Optional[str], limit: int,
+                dialect_name: str = "sqlite", columns: Optional[Sequence] = None):
+    """Newest-first page of ``user_id``'s transactions matching ``filters``.
+
+    Like ``crud.transactions_page_stmt`` it selects one extra row so the
+    caller can tell whether another page follows, and ``columns`` instead
+    of ``Transaction`` entities when given.
+    """
+    stmt = select(*columns) if columns is not None else select(Transaction)
+    stmt = stmt.where(Transaction.user_id == user_id)
+    if filters.types:
+        stmt = stmt.where(Transaction.transaction_type.in_([TransactionType(t.value) for t in filters.types]))
+    if filters.start is not None:
+        stmt = stmt.where(Transaction.created_at >= filters.start)
+    if filters.end is not None:
+        stmt = stmt.where(Transaction.created_at < filters.end)
+    if filters.min_amount is not None:
+        stmt = stmt.where(Transaction.amount >= filters.min_amount)
+    if filters.max_amount is not None:
+        stmt = stmt.where(Transaction.amount <= filters.max_amount)
+    if filters.counterparty is not None:
+        stmt = stmt.where(or_(
+            Transaction.recipient_user_id == filters.counterparty,
+            Transaction.sender_user_id == filters.counterparty,
+        ))
+    q = (filters.q or "").strip()
+    if q:
+        if dialect_name == "sqlite":
+            matches = text("SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH :fts_query")
+            matches = matches.bindparams(fts_query=fts_query(q)).columns(rowid=Integer)
+            stmt = stmt.where(Transaction.id.in_(matches))
+        else:
+            stmt = stmt.where(Transaction.description.ilike(f"%{_escape_like(q)}%", escape="\\"))
+    position = decode_cursor(cursor)
+    if position is not None:
+        stmt = stmt.where(tuple_(Transaction.created_at, Transaction.id) < tuple_(*position))
+    return stmt.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit + 1)
@@ -0,0 +1,55 @@
+"""Digital Wallet response encoding
+
+Routes with a ``response_model`` are validated and written straight to
+JSON bytes by Pydantic, which is why the mutation routes return typed
+models rather than ORM objects for ``jsonable_encoder`` to walk. The
+history and search pages go further: their rows come from column-only
+selects of ``TRANSACTION_COLUMNS``, so no ORM instances or identity-map
+entries are built, and are encoded here into the same body
+``schemas.TransactionPage`` would produce, without validating each row.
+
+Encoding uses orjson when it is installed and the standard library
+encoder otherwise.
+"""
+
+import json
+from datetime import datetime
+from typing import Iterable, Optional
+
+from fastapi.responses import Response
+
+import schemas
+from models import Transaction
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Field order of schemas.Transaction, which the encoded bodies keep.
+TRANSACTION_FIELDS = tuple(schemas.Transaction.model_fields)
+TRANSACTION_COLUMNS = tuple(Transaction.__table__.c[name] for name in TRANSACTION_FIELDS)
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def transaction_dict(row) -> dict:
+    """A ``schemas.Transaction`` body from a row of ``TRANSACTION_COLUMNS`` (or their archived twins)."""
+    item = dict(zip(TRANSACTION_FIELDS, row))
+    item["transaction_type"] = item["transaction_type"].value
+    return item
+
+
+def page_response(rows: Iterable, next_cursor: Optional[str]) -> Response:
+    body = {"transactions": [transaction_dict(row) for row in rows], "next_cursor": next_cursor}
+    return Response(dumps(body), media_type="application/json")
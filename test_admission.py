@@ -0,0 +1,125 @@
+"""Admission control and request deadlines for the Digital Wallet API
+
+Requests beyond the concurrency limit and its queue are shed with 503 and
+Retry-After, and a request's deadline reaches the database: expired
+requests start no statements and long statements are interrupted.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import admission
+from database import AsyncSessionLocal, SessionLocal
+
+# Counts to a hundred million: tens of seconds of work unless interrupted.
+SLOW_QUERY = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+              "SELECT count(*) FROM n")
+
+
+def test_limiter_queues_in_order_and_sheds():
+    async def scenario():
+        limiter = admission.Limiter("test", limit=1, queue_size=1)
+        assert await limiter.acquire(1.0)
+        queued = asyncio.ensure_future(limiter.acquire(1.0))
+        await asyncio.sleep(0)
+        assert not await limiter.acquire(1.0)
+        limiter.release()
+        assert await queued
+        assert not await limiter.acquire(0.01)
+        limiter.release()
+        assert limiter.stats()["in_flight"] == 0
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["admitted"] == 2
+    assert stats["shed"] == {"queue_full": 1, "queue_timeout": 1}
+
+
+def test_full_limiter_sheds_with_retry_after(client, monkeypatch, create_user):
+    user_id = create_user("admission_reader")
+    monkeypatch.setattr(admission.read_limiter, "limit", 1)
+    monkeypatch.setattr(admission.read_limiter, "active", 1)
+    monkeypatch.setattr(admission.read_limiter, "queue_timeout", 0.01)
+    shed = admission.read_limiter.shed["queue_timeout"]
+    response = client.get(f"/wallet/{user_id}/balance")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(admission.ADMISSION_RETRY_AFTER)
+    assert admission.read_limiter.shed["queue_timeout"] == shed + 1
+    assert client.get("/metrics").status_code == 200
+
+    monkeypatch.setattr(admission.read_limiter, "active", 0)
+    assert client.get(f"/wallet/{user_id}/balance").status_code == 200
+    assert 'wallet_admission_shed_total{limit="read",reason="queue_timeout"}' in client.get("/metrics").text
+
+
+def test_expired_request_runs_no_statements(client, create_user):
+    user_id = create_user("admission_writer")
+    balance = client.get(f"/wallet/{user_id}/balance").json()["balance"]
+    exceeded = admission.deadlines_exceeded
+    response = client.post(f"/wallet/{user_id}/add", params={"amount": 5},
+                           headers={"X-Request-Timeout": "0.000001"})
+    assert response.status_code == 503 and response.json()["detail"] == "Request deadline exceeded"
+    assert admission.deadlines_exceeded == exceeded + 1
+    assert client.get(f"/wallet/{user_id}/balance").json()["balance"] == balance
+
+
+def test_deadline_after_commit_does_not_fail_the_request(client, create_user, monkeypatch):
+    user_id = create_user("admission_slow_commit")
+    commit = AsyncSession.commit
+
+    async def slow_commit(self):
+        await commit(self)
+        await asyncio.sleep(0.7)
+
+    monkeypatch.setattr(AsyncSession, "commit", slow_commit)
+    headers = {"X-Request-Timeout": "0.5"}
+    response = client.put(f"/users/{user_id}", json={"full_name": "Slow Commit"}, headers=headers)
+    assert response.status_code == 200 and response.json()["full_name"] == "Slow Commit"
+    response = client.post("/users/", headers=headers, json={
+        "username": "admission_slow_new", "email": "admission_slow_new@example.com", "password": "x"})
+    assert response.status_code == 200 and response.json()["username"] == "admission_slow_new"
+    response = client.post(f"/wallet/{user_id}/add", params={"amount": 1}, headers=headers)
+    assert response.status_code == 200
+
+
+def test_group_commit_scales_the_write_limit():
+    def write_limit(**env):
+        script = "import admission; print(admission.write_limiter.limit)"
+        output = subprocess.run([sys.executable, "-c", script], env={**os.environ, **env},
+                                capture_output=True, text=True, check=True, cwd=os.path.dirname(admission.__file__))
+        return int(output.stdout)
+
+    assert write_limit(GROUP_COMMIT="0", DB_POOL_SIZE="5") == 5
+    assert write_limit(GROUP_COMMIT="1", GROUP_COMMIT_MAX_OPS="128") == 256
+    assert write_limit(GROUP_COMMIT="1", ADMISSION_WRITE_CONCURRENCY="9") == 9
+
+
+def test_running_statement_is_interrupted():
+    token = admission._deadline.set(time.monotonic() + 0.05)
+    try:
+        started = time.perf_counter()
+        with SessionLocal() as db, pytest.raises(admission.DeadlineExceeded):
+            db.connection().exec_driver_sql(SLOW_QUERY).scalar()
+        assert time.perf_counter() - started < 5.0
+
+        async def run_async():
+            async with AsyncSessionLocal() as db:
+                await (await db.connection()).exec_driver_sql(SLOW_QUERY)
+
+        admission._deadline.set(time.monotonic() + 0.05)
+        started = time.perf_counter()
+        with pytest.raises(admission.DeadlineExceeded):
+            asyncio.run(run_async())
+        assert time.perf_counter() - started < 5.0
+    finally:
+        admission._deadline.reset(token)
+
+    # The connections are reusable once the deadline is gone.
+    with SessionLocal() as db:
+        assert db.connection().exec_driver_sql("SELECT 1").scalar() == 1
@@ -0,0 +1,153 @@
+"""Cold storage for the Digital Wallet API
+
+Old ledger rows move into the attached archive database in verified
+batches, and history, export, lookups, balance-at and reconciliation keep
+returning what they returned before the move.
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select, update
+
+import archive
+import outbox
+import reconciliation
+from database import SessionLocal, engine
+from models import OutboxEvent, Transaction
+
+CUTOFF = datetime.utcnow() - timedelta(days=365)
+
+
+@pytest.fixture(scope="module")
+def app_setup():
+    previous = outbox.OUTBOX_DISPATCH
+    outbox.configure(False)
+    archive.configure(os.path.join(tempfile.mkdtemp(), "cold.db"))
+    archive.ensure_archive_schema(engine)
+    yield
+    archive.configure(None)
+    outbox.configure(previous)
+
+
+def history_ids(client, user_id: int, limit: int = 2):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        page = client.get(f"/transactions/{user_id}", params=params).json()
+        ids += [row["id"] for row in page["transactions"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def hot_ids(user_id: int):
+    with SessionLocal() as db:
+        return list(db.scalars(select(Transaction.id).where(Transaction.user_id == user_id).order_by(Transaction.id)))
+
+
+def backdate(db, user_ids, days: int = 730):
+    rows = db.execute(select(Transaction.id, Transaction.created_at).where(Transaction.user_id.in_(user_ids))).all()
+    for row in rows:
+        db.execute(update(Transaction).where(Transaction.id == row.id)
+                   .values(created_at=row.created_at - timedelta(days=days)))
+
+
+def export_ids(client, user_id: int):
+    response = client.get(f"/transactions/{user_id}/export")
+    assert response.status_code == 200, response.text
+    return [json.loads(line)["id"] for line in response.text.splitlines()]
+
+
+@pytest.fixture(scope="module")
+def moved(client, create_user):
+    """Two users whose history is two years old but for one recent deposit; returns what reads showed before."""
+    alice = create_user("archive_alice", 100.0)
+    bob = create_user("archive_bob", 20.0)
+    client.post(f"/wallet/{alice}/add", params={"amount": 50})
+    client.post(f"/wallet/{alice}/withdraw", params={"amount": 30})
+    transfer = client.post("/transfer/", params={"sender_id": alice, "recipient_id": bob, "amount": 45}).json()
+    client.post(f"/wallet/{bob}/add", params={"amount": 7})
+    with SessionLocal() as db:
+        backdate(db, [alice, bob])
+        # Delivered, except for bob's deposit, which must stay hot until it is.
+        undelivered = db.scalar(select(func.max(Transaction.id)).where(Transaction.user_id == bob))
+        db.execute(delete(OutboxEvent).where(OutboxEvent.user_id.in_([alice, bob]),
+                                             OutboxEvent.transaction_id != undelivered))
+        db.commit()
+        old = db.execute(select(Transaction.created_at, Transaction.balance_after)
+                         .where(Transaction.user_id == alice).order_by(Transaction.id)).all()
+    client.post(f"/wallet/{alice}/add", params={"amount": 5})
+    before = {
+        "history": {user_id: history_ids(client, user_id) for user_id in (alice, bob)},
+        "export": {user_id: export_ids(client, user_id) for user_id in (alice, bob)},
+        "transfer": client.get(f"/transfers/{transfer['transaction']['id']}/full").json(),
+        "transaction": client.get(f"/transaction/{transfer['transaction']['id']}").json(),
+        "old": old,
+        "undelivered": undelivered,
+    }
+    before["hot"] = {user_id: hot_ids(user_id) for user_id in (alice, bob)}
+    report = archive.archive_transactions(SessionLocal, cutoff=CUTOFF, batch_size=2)
+    return alice, bob, transfer["transaction"]["id"], before, report
+
+
+def test_old_settled_rows_move_to_the_archive(moved):
+    alice, bob, _, before, report = moved
+    assert hot_ids(alice) == before["hot"][alice][-1:]
+    assert hot_ids(bob) == [before["undelivered"]]
+    assert report["rows"] >= len(before["hot"][alice]) - 1 + len(before["hot"][bob]) - 1
+    with SessionLocal() as db:
+        assert archive.verify(db) == []
+        assert archive.pending_batches(db) == []
+        archived = db.scalars(select(archive.archived_transactions.c.id)
+                              .where(archive.archived_transactions.c.user_id.in_([alice, bob]))).all()
+    assert sorted(archived) == sorted(before["hot"][alice][:-1] + before["hot"][bob][:-1])
+
+
+def test_reads_merge_the_archive(client, moved):
+    alice, bob, transfer_id, before, _ = moved
+    for user_id in (alice, bob):
+        assert history_ids(client, user_id) == before["history"][user_id]
+        assert history_ids(client, user_id, limit=100) == before["history"][user_id]
+        assert export_ids(client, user_id) == before["export"][user_id]
+    assert client.get(f"/transfers/{transfer_id}/full").json() == before["transfer"]
+    assert client.get(f"/transaction/{transfer_id}").json() == before["transaction"]
+    for created_at, balance_after in before["old"]:
+        response = client.get(f"/wallet/{alice}/balance", params={"at": created_at.isoformat()})
+        assert response.json()["balance"] == balance_after
+    response = client.get(f"/wallet/{alice}/balance", params={"at": CUTOFF.isoformat()})
+    assert response.json()["balance"] == before["old"][-1].balance_after
+    report = reconciliation.reconcile(workers=1)
+    assert not [drift for drift in report["drifts"] if drift["user_id"] in (alice, bob)]
+
+
+def test_interrupted_batches_finish_and_tampering_is_detected(client, moved, create_user):
+    carol = create_user("archive_carol", 10.0)
+    client.post(f"/wallet/{carol}/add", params={"amount": 4})
+    with SessionLocal() as db:
+        backdate(db, [carol])
+        db.execute(delete(OutboxEvent).where(OutboxEvent.user_id == carol))
+        db.commit()
+        start = archive._month_start(datetime.utcnow() - timedelta(days=730))
+        batch_id = archive.copy_batch(db, start, CUTOFF, CUTOFF)
+    # Copied but not deleted: readers see each row once, and the next run finishes the batch.
+    assert len(hot_ids(carol)) == 2
+    assert len(history_ids(client, carol)) == 2
+    assert len(export_ids(client, carol)) == 2
+    report = archive.archive_transactions(SessionLocal, cutoff=CUTOFF)
+    assert report["resumed"] == 1
+    assert hot_ids(carol) == []
+    assert len(history_ids(client, carol)) == 2
+
+    table = archive.archived_transactions
+    with SessionLocal() as db:
+        db.execute(update(table).where(table.c.archive_batch == batch_id).values(amount=table.c.amount + 1))
+        db.execute(update(archive.archive_batches).where(archive.archive_batches.c.id == batch_id)
+                   .values(deleted_at=None))
+        db.commit()
+        assert archive.verify(db) == [batch_id]
+        with pytest.raises(archive.ArchiveChecksumError):
+            archive.finish_batch(db, batch_id)
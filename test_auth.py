@@ -0,0 +1,128 @@
+"""Password hashing and token authentication for the Digital Wallet API
+
+Registration stores scrypt hashes made on the hashing pool, login issues
+signed tokens, and repeat requests with a token are answered from the
+verified-token cache without touching the database. Stored values are
+never returned and never accepted as passwords.
+"""
+
+import asyncio
+import os
+import tempfile
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, select, text
+
+import async_crud
+import auth
+import instrumentation
+import passwords
+import schema
+import schemas
+from database import AsyncSessionLocal, SessionLocal
+from models import User
+
+
+def stored_hash(user_id: int) -> str:
+    with SessionLocal() as db:
+        return db.scalar(select(User.hashed_password).where(User.id == user_id))
+
+
+def login(client, name: str, password: str):
+    return client.post("/auth/login", json={"username": name, "password": password})
+
+
+def me(client, token: str):
+    return client.get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+
+
+def test_passwords_are_hashed_and_verified():
+    stored = passwords.hash_password("s3cret", n=1024)
+    assert stored.startswith("scrypt$1024$")
+    assert passwords.verify_password("s3cret", stored)
+    assert not passwords.verify_password("S3cret", stored)
+    assert passwords.needs_rehash(stored)
+    assert not passwords.needs_rehash(passwords.hash_password("s3cret"))
+    assert not passwords.verify_password("plain", "plain")
+
+
+def test_register_and_login(client, create_user):
+    hashes = passwords.pool.stats()["hashes"]
+    user_id = create_user("auth_alice", password="correct horse")
+    assert passwords.pool.stats()["hashes"] == hashes + 1
+    assert passwords.verify_password("correct horse", stored_hash(user_id))
+
+    assert login(client, "auth_alice", "wrong").status_code == 401
+    # The unknown-user hash was made on the pool at startup; this login only verifies.
+    assert passwords._DUMMY_HASH is not None
+    assert login(client, "auth_nobody", "correct horse").status_code == 401
+    assert passwords.pool.stats()["hashes"] == hashes + 1
+    response = login(client, "auth_alice", "correct horse")
+    assert response.status_code == 200, response.text
+    token = response.json()["access_token"]
+
+    auth.token_cache.clear()
+    assert me(client, token).json() == {"user_id": user_id}
+    assert instrumentation.registry.last_request.statements == 1
+    assert me(client, token).json() == {"user_id": user_id}
+    assert instrumentation.registry.last_request.statements == 0
+
+    assert client.get("/auth/me").status_code == 401
+    assert me(client, token[:-2] + ("AA" if token[-2:] != "AA" else "BB")).status_code == 401
+
+
+def test_stored_values_are_neither_returned_nor_accepted(client, create_user):
+    user_id = create_user("auth_private", password="hidden")
+    for response in (client.get(f"/users/{user_id}"), client.put(f"/users/{user_id}", json={"full_name": "P"})):
+        assert response.status_code == 200 and "hashed_password" not in response.json()
+    assert login(client, "auth_private", stored_hash(user_id)).status_code == 401
+
+    with SessionLocal() as db:
+        db.add(User(username="auth_legacy", email="legacy@example.com", hashed_password="old plain"))
+        db.commit()
+    assert login(client, "auth_legacy", "old plain").status_code == 401
+
+
+def test_migration_hashes_plain_text_passwords():
+    engine = create_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "passwords.db"))
+    schema.upgrade(engine, target=3)
+    with engine.begin() as conn:
+        for name, password in (("a", "seeded"), ("b", "seeded"), ("c", "own")):
+            conn.execute(text("INSERT INTO users (username, email, hashed_password) VALUES (:name, :email, :password)"),
+                         {"name": name, "email": f"{name}@example.com", "password": password})
+    schema.upgrade(engine)
+    with engine.connect() as conn:
+        stored = dict(conn.execute(text("SELECT username, hashed_password FROM users")).all())
+    engine.dispose()
+    assert all(value.startswith("scrypt$") for value in stored.values())
+    assert passwords.verify_password("seeded", stored["a"]) and passwords.verify_password("own", stored["c"])
+    assert stored["a"] != stored["b"]
+
+
+def test_duplicate_registrations_are_rejected(client, create_user):
+    create_user("auth_taken")
+    response = client.post("/users/", json={"username": "auth_other", "email": "auth_taken@example.com", "password": "x"})
+    assert response.status_code == 400 and response.json()["detail"] == "Email already registered"
+
+    async def register_racing_loser():
+        # The route's username check passed before the winner committed.
+        user = schemas.UserCreate(username="auth_taken", email="auth_race@example.com", password="x")
+        async with AsyncSessionLocal() as db:
+            await async_crud.create_user(db, user, await passwords.dummy_hash())
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(register_racing_loser())
+    assert raised.value.status_code == 400 and raised.value.detail == "Username already registered"
+
+
+def test_password_change_revokes_tokens(client, create_user):
+    user_id = create_user("auth_bob", password="first")
+    token = login(client, "auth_bob", "first").json()["access_token"]
+    assert me(client, token).status_code == 200
+    assert client.put(f"/users/{user_id}", json={"password": "second"}).status_code == 200
+    assert passwords.verify_password("second", stored_hash(user_id))
+    auth.token_cache.clear()
+    assert me(client, token).status_code == 401
+    assert login(client, "auth_bob", "first").status_code == 401
+    assert me(client, login(client, "auth_bob", "second").json()["access_token"]).status_code == 200
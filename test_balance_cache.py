@@ -0,0 +1,71 @@
+"""The in-process balance cache of the Digital Wallet API
+
+Writes put the committed balance and version through to the cache, and
+an older version never replaces a newer one, whichever order the
+writers and readers finish in.
+"""
+
+import time
+
+import crud
+from balance_cache import BalanceCache, balance_cache
+
+
+def test_older_version_does_not_replace_newer():
+    cache = BalanceCache(max_size=10, ttl=60)
+    cache.set(1, 20.0, 7)
+    cache.set(1, 10.0, 6)
+    assert cache.get_state(1) == (20.0, 7)
+    cache.set(1, 30.0, 8)
+    assert cache.get(1) == 30.0
+    cache.invalidate(1)
+    cache.set(1, 10.0, 6)
+    assert cache.get_state(1) == (10.0, 6)
+
+
+def test_expiry_and_eviction():
+    cache = BalanceCache(max_size=2, ttl=0.01)
+    cache.set(1, 1.0, 9)
+    time.sleep(0.02)
+    assert cache.get(1) is None and cache.stats()["expirations"] == 1
+    cache.set(1, 1.0, 2)
+    assert cache.get_state(1) == (1.0, 2)
+
+    cache = BalanceCache(max_size=2, ttl=60)
+    for user_id in (1, 2, 3):
+        cache.set(user_id, float(user_id), 1)
+    assert cache.get(1) is None and cache.get(3) == 3.0 and cache.stats()["evictions"] == 1
+
+    disabled = BalanceCache(max_size=0)
+    disabled.set(1, 1.0, 1)
+    assert disabled.get(1) is None
+
+
+def test_writes_cache_the_committed_version(client, create_user):
+    user_id = create_user("cache_writer", 10.0)
+    client.post(f"/wallet/{user_id}/add", params={"amount": 5})
+    state = balance_cache.get_state(user_id)
+    assert state is not None and state[0] == 15.0
+    assert client.get(f"/wallet/{user_id}/balance").headers["ETag"] == f'"{user_id}.{state[1]}"'
+
+
+def test_late_write_through_keeps_the_newer_balance(client, create_user):
+    user_id = create_user("cache_racer", 10.0)
+    other = create_user("cache_racer_other", 10.0)
+    client.post(f"/wallet/{user_id}/add", params={"amount": 1})
+    stale = balance_cache.get_state(user_id)
+    client.post("/transfer/", params={"sender_id": other, "recipient_id": user_id, "amount": 2})
+    # The first writer's write-through lands after the second one's.
+    crud.cache_balances({user_id: stale})
+    assert balance_cache.get(user_id) == 13.0
+    assert client.get(f"/wallet/{user_id}/balance").json()["balance"] == 13.0
+
+
+def test_batch_transfers_drop_cached_balances(client, create_user):
+    sender = create_user("cache_batch_sender", 10.0)
+    recipient = create_user("cache_batch_recipient", 0.0)
+    client.get(f"/wallet/{sender}/balance")
+    assert balance_cache.get(sender) == 10.0
+    client.post("/transfers/batch", json={"transfers": [{"sender_id": sender, "recipient_id": recipient, "amount": 4}]})
+    assert balance_cache.get(sender) is None
+    assert client.get(f"/wallet/{sender}/balance").json()["balance"] == 6.0
@@ -0,0 +1,117 @@
+"""Historical balances for the Digital Wallet API
+
+Ledger rows record ``balance_after``, ``GET /wallet/{id}/balance?at=``
+answers from them (or from the nearest checkpoint where they are
+missing), and the backfill fills the gaps.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+import balance_history
+import hot_accounts
+from database import SessionLocal, engine
+from models import Transaction
+
+
+def ledger(user_id: int):
+    with SessionLocal() as db:
+        return db.execute(
+            select(Transaction.id, Transaction.created_at, Transaction.balance_after)
+            .where(Transaction.user_id == user_id).order_by(Transaction.created_at, Transaction.id)
+        ).all()
+
+
+def balance_at(client, user_id: int, at: datetime) -> float:
+    response = client.get(f"/wallet/{user_id}/balance", params={"at": at.isoformat()})
+    assert response.status_code == 200, response.text
+    return response.json()["balance"]
+
+
+@pytest.fixture(scope="module")
+def history(client, create_user):
+    """Two users with a mix of credits, debits, transfers and a batch."""
+    alice = create_user("history_alice", 100.0)
+    bob = create_user("history_bob", 20.0)
+    client.post(f"/wallet/{alice}/add", params={"amount": 50})
+    client.post(f"/wallet/{alice}/withdraw", params={"amount": 30})
+    client.post("/transfer/", params={"sender_id": alice, "recipient_id": bob, "amount": 45})
+    client.post("/transfers/batch", json={"transfers": [
+        {"sender_id": bob, "recipient_id": alice, "amount": 5},
+        {"sender_id": alice, "recipient_id": bob, "amount": 10},
+    ]})
+    return alice, bob
+
+
+def test_mutations_record_balance_after(history):
+    alice, bob = history
+    assert [row.balance_after for row in ledger(alice)] == [100.0, 150.0, 120.0, 75.0, 80.0, 70.0]
+    assert [row.balance_after for row in ledger(bob)] == [20.0, 65.0, 60.0, 70.0]
+
+
+def test_balance_at(client, history):
+    alice, bob = history
+    rows = ledger(alice)
+    assert balance_at(client, alice, rows[0].created_at - timedelta(seconds=1)) == 0.0
+    assert balance_at(client, alice, rows[0].created_at) == 100.0
+    assert balance_at(client, alice, rows[2].created_at) == 120.0
+    assert balance_at(client, alice, rows[-1].created_at + timedelta(days=1)) == 70.0
+    assert balance_at(client, bob, ledger(bob)[1].created_at) == 65.0
+    assert client.get("/wallet/999999/balance", params={"at": datetime.utcnow().isoformat()}).status_code == 404
+
+
+def test_balance_at_without_checkpoints(client, create_user):
+    merchant = create_user("history_merchant", 0.0)
+    payer = create_user("history_payer", 100.0)
+    with SessionLocal() as db:
+        hot_accounts.designate(db, merchant, slots=4)
+    try:
+        for amount in (5, 7, 11):
+            client.post("/transfer/", params={"sender_id": payer, "recipient_id": merchant, "amount": amount})
+        client.post(f"/wallet/{merchant}/withdraw", params={"amount": 20})
+    finally:
+        with SessionLocal() as db:
+            hot_accounts.release(db, merchant)
+    rows = ledger(merchant)
+    assert [row.balance_after for row in rows] == [None, None, None, None]
+    # No checkpoint at all: answered from the current balance.
+    assert [balance_at(client, merchant, row.created_at) for row in rows] == [5.0, 12.0, 23.0, 3.0]
+
+    client.post(f"/wallet/{merchant}/add", params={"amount": 1})
+    with SessionLocal() as db:
+        db.execute(update(Transaction).where(Transaction.id == rows[1].id).values(balance_after=12.0))
+        db.commit()
+    # Checkpoints on either side of the missing rows.
+    assert [balance_at(client, merchant, row.created_at) for row in ledger(merchant)] == [5.0, 12.0, 23.0, 3.0, 4.0]
+
+
+def test_backfill(client, history):
+    alice, bob = history
+    expected = {user_id: [row.balance_after for row in ledger(user_id)] for user_id in (alice, bob)}
+    with SessionLocal() as db:
+        keep = ledger(alice)[3].id
+        db.execute(update(Transaction).where(Transaction.user_id.in_([alice, bob]), Transaction.id != keep)
+                   .values(balance_after=None))
+        db.commit()
+
+    assert balance_history.backfill(SessionLocal, chunk_size=2, user_ids=[alice, bob]) == 9
+    assert {user_id: [row.balance_after for row in ledger(user_id)] for user_id in (alice, bob)} == expected
+    assert balance_history.backfill(SessionLocal, chunk_size=2, user_ids=[alice, bob]) == 0
+
+
+def test_lookups_do_not_scan(history):
+    alice = history[0]
+    now = datetime.utcnow()
+    checkpoint = ledger(alice)[0]
+    for stmt in (
+        balance_history.latest_row_stmt(alice, now),
+        balance_history.checkpoint_before_stmt(alice, now),
+        balance_history.checkpoint_after_stmt(alice, now),
+        balance_history.signed_sum_stmt(alice, after=checkpoint, at_most=now),
+    ):
+        sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+        with engine.connect() as conn:
+            plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql).all()]
+        assert len(plan) == 1 and plan[0].startswith("SEARCH transactions USING INDEX"), plan
@@ -0,0 +1,81 @@
+"""POST /transfers/batch
+
+Items are checked in submission order against the balances the earlier
+items leave behind. ``best_effort`` commits the items that pass and
+reports the rest; ``all_or_nothing`` writes nothing once any item fails.
+"""
+
+from sqlalchemy import func, select
+
+from database import SessionLocal
+from models import Transaction
+
+
+def balance(client, user_id: int) -> float:
+    return client.get(f"/wallet/{user_id}/balance").json()["balance"]
+
+
+def ledger_rows(*user_ids: int) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(Transaction).where(Transaction.user_id.in_(user_ids)))
+
+
+def mixed_batch(alice: int, bob: int) -> list:
+    return [
+        {"sender_id": alice, "recipient_id": bob, "amount": 30},
+        {"sender_id": alice, "recipient_id": bob, "amount": 30},  # 20 left after the first
+        {"sender_id": alice, "recipient_id": alice, "amount": 1},
+        {"sender_id": alice, "recipient_id": bob + 10_000, "amount": 1},
+        {"sender_id": bob, "recipient_id": alice, "amount": 5},
+    ]
+
+
+def test_best_effort_commits_the_items_that_pass(client, create_user):
+    alice = create_user("batch_best_alice", 50.0)
+    bob = create_user("batch_best_bob", 0.0)
+    response = client.post("/transfers/batch", json={"mode": "best_effort", "transfers": mixed_batch(alice, bob)})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["committed"], body["succeeded"], body["failed"]) == (True, 2, 3)
+    assert [(r["status"], r["detail"]) for r in body["results"]] == [
+        ("success", None),
+        ("failed", "Insufficient balance"),
+        ("failed", "Cannot transfer to self"),
+        ("failed", "User not found"),
+        ("success", None),
+    ]
+    assert all(r["transaction_id"] for r in body["results"] if r["status"] == "success")
+    detail = client.get(f"/transfers/{body['results'][0]['transaction_id']}/full").json()
+    assert (detail["sender"]["id"], detail["recipient"]["id"], detail["amount"]) == (alice, bob, 30.0)
+    assert detail["transfer_in"]["transfer_group"] == detail["transfer_out"]["transfer_group"]
+    assert balance(client, alice) == 25.0 and balance(client, bob) == 25.0
+    assert ledger_rows(alice, bob) == 1 + 4  # alice's opening deposit and two transfers
+
+
+def test_all_or_nothing_rolls_back_every_item(client, create_user):
+    alice = create_user("batch_atomic_alice", 50.0)
+    bob = create_user("batch_atomic_bob", 0.0)
+    response = client.post("/transfers/batch", json={"transfers": mixed_batch(alice, bob)})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["mode"], body["committed"], body["succeeded"], body["failed"]) == ("all_or_nothing", False, 0, 3)
+    assert [r["status"] for r in body["results"]] == ["rolled_back", "failed", "failed", "failed", "rolled_back"]
+    assert not any(r["transaction_id"] for r in body["results"])
+    assert balance(client, alice) == 50.0 and balance(client, bob) == 0.0
+    assert ledger_rows(alice, bob) == 1
+
+
+def test_all_or_nothing_commits_a_clean_batch(client, create_user):
+    alice = create_user("batch_clean_alice", 10.0)
+    bob = create_user("batch_clean_bob", 0.0)
+    response = client.post("/transfers/batch", json={"transfers": [
+        {"sender_id": alice, "recipient_id": bob, "amount": 10},
+        {"sender_id": bob, "recipient_id": alice, "amount": 4},
+    ]})
+    body = response.json()
+    assert (body["committed"], body["succeeded"], body["failed"]) == (True, 2, 0)
+    assert balance(client, alice) == 4.0 and balance(client, bob) == 6.0
+
+
+def test_empty_batch_is_rejected(client):
+    assert client.post("/transfers/batch", json={"transfers": []}).status_code == 422
@@ -0,0 +1,81 @@
+"""Conditional GETs of users and balances for the Digital Wallet API
+
+Both reads carry a strong ETag from the account's version; a matching
+If-None-Match gets an empty 304 without loading the user, and every kind
+of write moves the tag on.
+"""
+
+import etags
+import hot_accounts
+import instrumentation
+from balance_cache import balance_cache
+from database import SessionLocal
+
+
+def conditional_get(client, path: str, tag: str):
+    response = client.get(path, headers={"If-None-Match": tag})
+    return response, instrumentation.registry.last_request.statements
+
+
+def test_unchanged_user_and_balance_answer_304(client, create_user):
+    user_id = create_user("etag_poller", 100.0)
+    for path in (f"/users/{user_id}", f"/wallet/{user_id}/balance"):
+        first = client.get(path)
+        tag = first.headers["ETag"]
+        assert first.status_code == 200 and tag.startswith('"')
+
+        balance_cache.clear()
+        response, statements = conditional_get(client, path, tag)
+        assert response.status_code == 304 and response.content == b""
+        assert response.headers["ETag"] == tag
+        assert statements == 1
+
+        response, statements = conditional_get(client, path, f'"stale", W/{tag}')
+        assert response.status_code == 304 and statements == 0
+
+    assert client.get(f"/users/{user_id + 1000}", headers={"If-None-Match": "*"}).status_code == 404
+
+
+def test_every_write_changes_the_tags(client, create_user):
+    user_id = create_user("etag_writer", 100.0)
+    other = create_user("etag_other", 100.0)
+    writes = [
+        lambda: client.post(f"/wallet/{user_id}/add", params={"amount": 5}),
+        lambda: client.post(f"/wallet/{user_id}/withdraw", params={"amount": 2}),
+        lambda: client.post("/transfer/", params={"sender_id": other, "recipient_id": user_id, "amount": 1}),
+        lambda: client.post("/transfers/batch", json={"transfers": [
+            {"sender_id": user_id, "recipient_id": other, "amount": 1}]}),
+        lambda: client.put(f"/users/{user_id}", json={"full_name": "Etag Writer"}),
+    ]
+    for write in writes:
+        user, balance = client.get(f"/users/{user_id}"), client.get(f"/wallet/{user_id}/balance")
+        assert write().status_code == 200
+        for path, before in ((f"/users/{user_id}", user), (f"/wallet/{user_id}/balance", balance)):
+            response = client.get(path, headers={"If-None-Match": before.headers["ETag"]})
+            assert response.status_code == 200 and response.headers["ETag"] != before.headers["ETag"]
+    assert client.get(f"/users/{user_id}").json()["full_name"] == "Etag Writer"
+
+
+def test_hot_account_credits_and_release_change_the_balance_tag(client, create_user):
+    merchant = create_user("etag_merchant", 10.0)
+    with SessionLocal() as db:
+        hot_accounts.designate(db, merchant, slots=4)
+    seen = {client.get(f"/wallet/{merchant}/balance").headers["ETag"]}
+    for _ in range(3):
+        assert client.post(f"/wallet/{merchant}/add", params={"amount": 1}).status_code == 200
+        response = client.get(f"/wallet/{merchant}/balance")
+        assert response.headers["ETag"] not in seen
+        seen.add(response.headers["ETag"])
+    with SessionLocal() as db:
+        hot_accounts.release(db, merchant)
+    response = client.get(f"/wallet/{merchant}/balance")
+    assert response.json()["balance"] == 13.0 and response.headers["ETag"] not in seen
+    user = client.get(f"/users/{merchant}")
+    assert client.get(f"/users/{merchant}", headers={"If-None-Match": user.headers["ETag"]}).status_code == 304
+
+
+def test_if_none_match_parsing():
+    tag = etags.etag(7, 3)
+    assert etags.matches(tag, tag) and etags.matches(f"W/{tag}", tag) and etags.matches("*", tag)
+    assert etags.matches(f'"7.2" , {tag}', tag)
+    assert not etags.matches(None, tag) and not etags.matches('"7.2"', tag) and not etags.matches('"17.3"', tag)
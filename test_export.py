@@ -0,0 +1,76 @@
+"""GET /transactions/{user_id}/export
+
+NDJSON is one object per line and CSV one header then one line per row,
+oldest first, and chunk boundaries never split a record; ``from``/``to``
+bound the rows by ``created_at``.
+"""
+
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+
+import export
+from database import SessionLocal
+from models import Transaction, TransactionType
+
+
+def backdate(user_id: int, *days: int) -> None:
+    with SessionLocal() as db:
+        db.add_all([Transaction(user_id=user_id, transaction_type=TransactionType.DEPOSIT, amount=float(day),
+                                description=f'day, "{day}"', created_at=datetime(2026, 3, day))
+                    for day in days])
+        db.commit()
+
+
+def test_ndjson_is_one_object_per_line_oldest_first(client, create_user):
+    user_id = create_user("export_ndjson")
+    backdate(user_id, 3, 1, 2)
+    response = client.get(f"/transactions/{user_id}/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == f'attachment; filename="transactions-{user_id}.ndjson"'
+    assert response.text.endswith("\n")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["amount"] for row in rows] == [1.0, 2.0, 3.0]
+    assert set(rows[0]) == set(export.EXPORT_FIELDS)
+    assert rows[0]["transaction_type"] == "DEPOSIT" and rows[0]["created_at"] == "2026-03-01T00:00:00"
+
+
+def test_csv_has_one_header_and_quotes_fields(client, create_user):
+    user_id = create_user("export_csv")
+    backdate(user_id, 1, 2)
+    response = client.get(f"/transactions/{user_id}/export", params={"format": "csv"})
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == f'attachment; filename="transactions-{user_id}.csv"'
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == export.EXPORT_FIELDS
+    assert [row[4] for row in rows[1:]] == ['day, "1"', 'day, "2"']
+
+
+def test_from_and_to_bound_the_rows(client, create_user):
+    user_id = create_user("export_range")
+    backdate(user_id, 1, 2, 3, 4)
+    response = client.get(f"/transactions/{user_id}/export",
+                          params={"from": "2026-03-02T00:00:00", "to": "2026-03-04T00:00:00"})
+    assert [json.loads(line)["amount"] for line in response.text.splitlines()] == [2.0, 3.0]
+
+
+def test_chunks_end_on_record_boundaries(create_user):
+    user_id = create_user("export_chunks")
+    backdate(user_id, *range(1, 8))
+
+    async def chunks(fmt):
+        return [chunk async for chunk in export.stream_transactions(export.export_stmts(user_id), fmt, chunk_size=3)]
+
+    ndjson = asyncio.run(chunks("ndjson"))
+    assert [chunk.count(b"\n") for chunk in ndjson] == [3, 3, 1]
+    assert all(chunk.endswith(b"\n") for chunk in ndjson)
+    csv_chunks = asyncio.run(chunks("csv"))
+    assert len(csv_chunks) == 4 and csv_chunks[0].decode().strip() == ",".join(export.EXPORT_FIELDS)
+
+
+def test_unknown_user_and_format_are_rejected(client):
+    assert client.get("/transactions/999999/export").status_code == 404
+    assert client.get("/transactions/1/export", params={"format": "xml"}).status_code == 422
@@ -0,0 +1,108 @@
+"""Group commit of the Digital Wallet money-moving operations
+
+With group commit on, operations arriving together share one
+transaction: each runs in its own SAVEPOINT so a failing one leaves the
+rest of its batch intact, retries of one Idempotency-Key collapse into
+a single ledger write, and no batch grows past ``max_ops``.
+"""
+
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+import async_crud
+import group_commit
+import idempotency
+from database import AsyncSessionLocal, SessionLocal
+from models import Transaction
+
+
+def run_grouped(scenario, **writer_options):
+    """Run ``scenario()`` with group commit on; returns its result and the writer's batch sizes."""
+    async def run():
+        group_commit.configure(True, **writer_options)
+        writer = group_commit.writer
+        try:
+            return await scenario(), writer.batch_sizes.snapshot()
+        finally:
+            await group_commit.shutdown()
+            group_commit.configure(False)
+
+    return asyncio.run(run())
+
+
+async def outcome(operation):
+    async with AsyncSessionLocal() as db:
+        try:
+            return await operation(db)
+        except HTTPException as exc:
+            return exc.status_code
+
+
+def balance(client, user_id: int) -> float:
+    return client.get(f"/wallet/{user_id}/balance").json()["balance"]
+
+
+def ledger_rows(user_id: int) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(Transaction).where(Transaction.user_id == user_id))
+
+
+def test_failing_operation_leaves_its_batch_intact(client, create_user):
+    payer = create_user("group_payer", 50.0)
+    payee = create_user("group_payee", 0.0)
+    short = create_user("group_short", 1.0)
+
+    async def scenario():
+        return await asyncio.gather(
+            outcome(lambda db: async_crud.add_money(db, user_id=payee, amount=5.0)),
+            outcome(lambda db: async_crud.withdraw_money(db, user_id=short, amount=2.0)),
+            outcome(lambda db: async_crud.transfer_money(db, sender_id=payer, recipient_id=payee, amount=10.0)),
+            outcome(lambda db: async_crud.add_money(db, user_id=payee + 10_000, amount=1.0)),
+        )
+
+    (added, short_result, transferred, missing), batches = run_grouped(scenario, window_ms=200)
+    assert batches["count"] == 1 and batches["sum"] == 4
+    assert (short_result, missing) == (400, 404)
+    assert added.amount == 5.0 and transferred.amount == 10.0
+    assert balance(client, payee) == 15.0 and balance(client, payer) == 40.0 and balance(client, short) == 1.0
+    assert ledger_rows(short) == 1
+
+
+def test_concurrent_retries_of_one_key_write_once(client, create_user):
+    user_id = create_user("group_retry", 0.0)
+    request = idempotency.build_request("group-key", "add", owner=user_id, user_id=user_id, amount=7.0, description=None)
+
+    async def attempt():
+        async with AsyncSessionLocal() as db:
+            return await idempotency.execute(db, request, lambda idem: async_crud.add_money(
+                db, user_id=user_id, amount=7.0, idempotency=idem))
+
+    async def scenario():
+        return await asyncio.gather(attempt(), attempt(), attempt())
+
+    results, batches = run_grouped(scenario, window_ms=200)
+    ids = {result.id if isinstance(result, Transaction) else result["id"] for result in results}
+    assert len(ids) == 1 and batches["sum"] == 3
+    assert balance(client, user_id) == 7.0 and ledger_rows(user_id) == 1
+
+
+@pytest.mark.parametrize("ops, max_ops, expected_batches", [(7, 3, 3), (6, 3, 2)])
+def test_batches_stop_at_max_ops(client, create_user, ops, max_ops, expected_batches):
+    user_id = create_user(f"group_max_{ops}_{max_ops}", 0.0)
+
+    async def scenario():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            outcome(lambda db: async_crud.add_money(db, user_id=user_id, amount=1.0)) for _ in range(ops)))
+        return results, time.perf_counter() - started
+
+    (results, elapsed), batches = run_grouped(scenario, window_ms=1000, max_ops=max_ops)
+    assert all(isinstance(result, Transaction) for result in results)
+    assert batches["count"] == expected_batches and batches["sum"] == ops
+    # Only a batch left short of max_ops waits out the window.
+    assert (elapsed >= 1.0) == bool(ops % max_ops)
+    assert balance(client, user_id) == float(ops)
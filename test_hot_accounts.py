@@ -0,0 +1,68 @@
+"""Hot-account balance sharding for the Digital Wallet API
+
+Credits to a hot account land in its slots, debits borrow from them, and
+the reported balance is always the exact total.
+"""
+
+import pytest
+from sqlalchemy import func, select
+
+import hot_accounts
+from database import SessionLocal
+from models import BalanceSlot, User
+
+
+def stored(user_id: int):
+    with SessionLocal() as db:
+        main_balance = db.scalar(select(User.balance).where(User.id == user_id))
+        slots = db.scalar(select(func.coalesce(func.sum(BalanceSlot.balance), 0.0)).where(BalanceSlot.user_id == user_id))
+    return main_balance, slots
+
+
+@pytest.fixture
+def merchant(client, request, create_user):
+    user_id = create_user(f"merchant_{request.node.name}", 10.0)
+    with SessionLocal() as db:
+        hot_accounts.designate(db, user_id, slots=4)
+    yield user_id
+    with SessionLocal() as db:
+        hot_accounts.release(db, user_id)
+
+
+def test_credits_go_to_slots_and_balance_is_exact(client, merchant, create_user):
+    payer = create_user("payer_credits", 1000.0)
+    for _ in range(20):
+        assert client.post("/transfer/", params={"sender_id": payer, "recipient_id": merchant, "amount": 5}).status_code == 200
+    assert client.post(f"/wallet/{merchant}/add", params={"amount": 1}).status_code == 200
+
+    assert stored(merchant) == (10.0, 101.0)
+    assert client.get(f"/wallet/{merchant}/balance").json()["balance"] == 111.0
+
+
+def test_debit_borrows_from_slots(client, merchant):
+    client.post(f"/wallet/{merchant}/add", params={"amount": 50})
+    response = client.post(f"/wallet/{merchant}/withdraw", params={"amount": 55})
+    assert response.status_code == 200, response.text
+    assert stored(merchant) == (5.0, 0.0)
+    assert client.post(f"/wallet/{merchant}/withdraw", params={"amount": 6}).status_code == 400
+    assert client.get(f"/wallet/{merchant}/balance").json()["balance"] == 5.0
+
+
+def test_batch_sender_sees_slot_balances(client, merchant, create_user):
+    recipient = create_user("batch_recipient_hot", 0.0)
+    client.post(f"/wallet/{merchant}/add", params={"amount": 40})
+    response = client.post("/transfers/batch", json={"transfers": [
+        {"sender_id": merchant, "recipient_id": recipient, "amount": 45},
+    ]})
+    assert response.json()["committed"] is True, response.text
+    assert client.get(f"/wallet/{merchant}/balance").json()["balance"] == 5.0
+
+
+def test_sweep_consolidates_into_main_row(client, merchant):
+    for _ in range(8):
+        client.post(f"/wallet/{merchant}/add", params={"amount": 2.5})
+    with SessionLocal() as db:
+        assert hot_accounts.sweep(db, merchant) == 20.0
+        db.commit()
+    assert stored(merchant) == (30.0, 0.0)
+    assert client.get(f"/wallet/{merchant}/balance").json()["balance"] == 30.0
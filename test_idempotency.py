@@ -0,0 +1,84 @@
+"""Idempotency-Key handling of the Digital Wallet money-moving routes
+
+A retry with the same key and request replays the stored response, the
+same key with a different request is refused, keys belong to the
+account they were sent for, and an expired key runs the request again.
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text, update
+
+import schema
+from database import SessionLocal
+from models import IdempotencyKey
+
+
+def add(client, user_id: int, key: str, amount: float = 5.0):
+    return client.post(f"/wallet/{user_id}/add", params={"amount": amount}, headers={"Idempotency-Key": key})
+
+
+def balance(client, user_id: int) -> float:
+    return client.get(f"/wallet/{user_id}/balance").json()["balance"]
+
+
+def test_retry_replays_and_changed_request_is_refused(client, create_user):
+    user_id = create_user("idem_retry", 0.0)
+    first = add(client, user_id, "retry-1")
+    again = add(client, user_id, "retry-1")
+    assert first.status_code == again.status_code == 200
+    assert again.json()["transaction"]["id"] == first.json()["transaction"]["id"]
+    assert balance(client, user_id) == 5.0
+
+    response = add(client, user_id, "retry-1", amount=6.0)
+    assert response.status_code == 422
+    assert balance(client, user_id) == 5.0
+
+
+def test_keys_are_scoped_to_the_account(client, create_user):
+    alice = create_user("idem_alice", 50.0)
+    bob = create_user("idem_bob", 50.0)
+    first = add(client, alice, "shared-key")
+    second = add(client, bob, "shared-key")
+    assert second.status_code == 200
+    assert second.json()["transaction"]["user_id"] == bob
+    assert second.json()["transaction"]["id"] != first.json()["transaction"]["id"]
+
+    transfer = client.post("/transfer/", params={"sender_id": bob, "recipient_id": alice, "amount": 1},
+                           headers={"Idempotency-Key": "shared-key"})
+    assert transfer.status_code == 422
+    with SessionLocal() as db:
+        assert {row.key for row in db.query(IdempotencyKey).filter(IdempotencyKey.key.like("%:shared-key"))} \
+            == {f"{alice}:shared-key", f"{bob}:shared-key"}
+
+
+def test_expired_key_runs_again_and_overwrites_its_record(client, create_user):
+    user_id = create_user("idem_expired", 0.0)
+    first = add(client, user_id, "expiring")
+    with SessionLocal() as db:
+        db.execute(update(IdempotencyKey).where(IdempotencyKey.key == f"{user_id}:expiring")
+                   .values(created_at=datetime.utcnow() - timedelta(days=2)))
+        db.commit()
+
+    second = add(client, user_id, "expiring")
+    assert second.status_code == 200
+    assert second.json()["transaction"]["id"] != first.json()["transaction"]["id"]
+    assert balance(client, user_id) == 10.0
+    replayed = add(client, user_id, "expiring")
+    assert replayed.json()["transaction"]["id"] == second.json()["transaction"]["id"]
+
+
+def test_migration_scopes_existing_keys():
+    engine = create_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "idempotency.db"))
+    schema.upgrade(engine, target=2)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO idempotency_keys (key, request_hash, response_body, created_at) "
+                          "VALUES ('legacy', 'h', :body, CURRENT_TIMESTAMP)"),
+                     {"body": json.dumps({"id": 9, "user_id": 42})})
+    schema.upgrade(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT key FROM idempotency_keys")).scalar_one() == "42:legacy"
+    engine.dispose()
@@ -0,0 +1,99 @@
+"""Schema migrations for the Digital Wallet API
+
+``scripts/migrate.py`` brings new and pre-migration databases to the
+newest version, startup only checks that version, and ``generate`` turns
+a change to the models into the next migration.
+"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+from sqlalchemy import Column, Index, MetaData, String, create_engine, event, inspect
+
+import schema
+from database import Base
+
+# transactions and users as create_all made them before transfer groups and balance checkpoints.
+LEGACY_DDL = (
+    "CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR NOT NULL, email VARCHAR NOT NULL, "
+    "full_name VARCHAR, hashed_password VARCHAR NOT NULL, is_active INTEGER, phone_number VARCHAR, "
+    "balance FLOAT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME, PRIMARY KEY (id))",
+    "CREATE TABLE transactions (id INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+    "transaction_type VARCHAR(12) NOT NULL, amount FLOAT NOT NULL, description VARCHAR, "
+    "reference_transaction_id INTEGER, recipient_user_id INTEGER, sender_user_id INTEGER, "
+    "created_at DATETIME DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (id))",
+    "INSERT INTO users (id, username, email, hashed_password, balance) VALUES (1, 'old', 'old@example.com', 'pw', 5)",
+    "INSERT INTO transactions (id, user_id, transaction_type, amount, description) "
+    "VALUES (1, 1, 'CREDIT', 5, 'coffee refund')",
+)
+
+
+def engine_for(name: str):
+    return create_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), name))
+
+
+def count_statements(engine) -> list:
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def test_pre_migration_database_is_upgraded():
+    engine = engine_for("legacy.db")
+    with engine.begin() as conn:
+        for statement in LEGACY_DDL:
+            conn.exec_driver_sql(statement)
+    with pytest.raises(schema.SchemaVersionError):
+        schema.check(engine)
+
+    applied = [migration.version for migration in schema.upgrade(engine)]
+    assert applied == [migration.version for migration in schema.migrations()] and applied[-1] == schema.head_version()
+    columns = {column["name"] for column in inspect(engine).get_columns("transactions")}
+    assert {"transfer_group", "balance_after"} <= columns
+    assert "version" in {column["name"] for column in inspect(engine).get_columns("users")}
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT version FROM users WHERE id = 1").scalar() == 1
+    assert {index.name for index in Base.metadata.tables["transactions"].indexes} <= {
+        index["name"] for index in inspect(engine).get_indexes("transactions")}
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql(
+            "SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH 'coffee'").scalar() == 1
+    assert schema.upgrade(engine) == []
+
+    statements = count_statements(engine)
+    assert schema.check(engine) == schema.head_version()
+    assert len(statements) == 1
+
+
+def test_generated_migration_adds_columns_and_indexes():
+    directory = tempfile.mkdtemp()
+    for migration in schema.migrations():
+        shutil.copy(migration.path, directory)
+    assert schema.generate("nothing", directory=directory) is None
+
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        table.to_metadata(metadata)
+    transactions = metadata.tables["transactions"]
+    transactions.append_column(Column("merchant", String, nullable=True))
+    Index("ix_transactions_merchant", transactions.c.merchant)
+    path = schema.generate("add transactions.merchant", metadata, directory)
+    assert os.path.basename(path) == f"{schema.head_version() + 1:04d}_add_transactions_merchant.py"
+    source = open(path).read()
+    assert 'add_column(conn, "transactions", "merchant", "merchant VARCHAR")' in source
+    assert "ONLINE" not in source
+
+    Index("ix_transactions_user_merchant", transactions.c.user_id, transactions.c.merchant)
+    online = schema.generate("index merchants per user", metadata, directory)
+    assert "ONLINE = True" in open(online).read()
+
+    engine = engine_for("generated.db")
+    schema.upgrade(engine, directory=directory)
+    assert "merchant" in {column["name"] for column in inspect(engine).get_columns("transactions")}
+    assert {"ix_transactions_merchant", "ix_transactions_user_merchant"} <= {
+        index["name"] for index in inspect(engine).get_indexes("transactions")}
+    assert schema.check(engine, directory) == schema.head_version(directory) == schema.head_version() + 2
+    with pytest.raises(schema.SchemaVersionError):
+        schema.check(engine_for("empty.db"), directory)
@@ -0,0 +1,116 @@
+"""Transactional outbox for the Digital Wallet API
+
+Money-moving writes record their events in the same commit, and the
+dispatcher delivers, retries and dead-letters them.
+"""
+
+import asyncio
+from datetime import datetime
+
+import httpx
+import pytest
+from sqlalchemy import select, update
+
+import outbox
+from database import SessionLocal
+from models import OutboxEvent, Transaction
+
+
+@pytest.fixture(scope="module")
+def app_setup():
+    # Events are delivered by the dispatchers these tests run themselves.
+    previous = outbox.OUTBOX_DISPATCH
+    outbox.configure(False)
+    yield
+    outbox.configure(previous)
+
+
+def pending(user_id: int):
+    with SessionLocal() as db:
+        return db.execute(
+            select(OutboxEvent.transaction_id, OutboxEvent.attempts, OutboxEvent.dead, OutboxEvent.last_error)
+            .where(OutboxEvent.user_id == user_id).order_by(OutboxEvent.id)
+        ).all()
+
+
+def dispatch(sinks, **options) -> dict:
+    """One dispatcher pass on this thread's own event loop; returns its stats."""
+    async def run():
+        dispatcher = outbox.OutboxDispatcher(sinks, batch_size=10000, **options)
+        try:
+            await dispatcher.run_once()
+            return dispatcher.stats()
+        finally:
+            await dispatcher.stop()
+
+    return asyncio.run(run())
+
+
+def make_due():
+    with SessionLocal() as db:
+        db.execute(update(OutboxEvent).values(available_at=datetime.utcnow()))
+        db.commit()
+
+
+class FailingSink:
+    async def deliver(self, event: dict):
+        raise ConnectionError("consumer down")
+
+
+def test_events_are_written_with_the_ledger_rows(client, create_user):
+    alice = create_user("outbox_alice", 100.0)
+    bob = create_user("outbox_bob", 0.0)
+    add = client.post(f"/wallet/{alice}/add", params={"amount": 10}).json()["transaction"]
+    assert client.post(f"/wallet/{alice}/withdraw", params={"amount": 1000}).status_code == 400
+    transfer = client.post("/transfer/", params={"sender_id": alice, "recipient_id": bob, "amount": 5}).json()
+    batch = client.post("/transfers/batch", json={"transfers": [{"sender_id": alice, "recipient_id": bob, "amount": 1}]})
+    assert batch.json()["committed"] is True
+
+    with SessionLocal() as db:
+        ledger = db.scalars(select(Transaction.id).where(Transaction.user_id.in_([alice, bob]))).all()
+    events = [row.transaction_id for row in pending(alice) + pending(bob)]
+    assert sorted(events) == sorted(ledger)
+    assert add["id"] in events and transfer["transaction"]["id"] in events
+
+
+def test_dispatch_delivers_and_deletes(client, create_user):
+    carol = create_user("outbox_carol", 0.0)
+    transaction = client.post(f"/wallet/{carol}/add", params={"amount": 7.5}).json()["transaction"]
+    memory = outbox.MemorySink()
+    stand_in = outbox.stand_in_app()
+    http = outbox.HttpSink("http://stand-in/events", transport=httpx.ASGITransport(app=stand_in))
+
+    stats = dispatch([memory, http])
+
+    delivered = [event for event in memory.drain() if event["transaction"]["user_id"] == carol]
+    assert [event["transaction"]["id"] for event in delivered] == [transaction["id"]]
+    assert delivered[0]["type"] == outbox.BALANCE_CHANGED
+    assert delivered[0]["transaction"]["amount"] == 7.5
+    assert delivered[0] in stand_in.received
+    assert stats["delivered"] >= 1 and stats["failed"] == 0
+    assert pending(carol) == []
+
+
+def test_failed_delivery_is_retried_then_dead_lettered(client, create_user):
+    dave = create_user("outbox_dave", 0.0)
+    client.post(f"/wallet/{dave}/add", params={"amount": 3})
+
+    stats = dispatch([FailingSink()], max_attempts=2)
+    [(_, attempts, dead, last_error)] = pending(dave)
+    assert (attempts, dead) == (1, 0)
+    assert last_error == "ConnectionError: consumer down"
+    assert stats["failed"] >= 1
+
+    # Backed off: not due yet, so nothing is attempted.
+    dispatch([FailingSink()], max_attempts=2)
+    assert pending(dave)[0][1] == 1
+
+    make_due()
+    stats = dispatch([FailingSink()], max_attempts=2)
+    assert pending(dave)[0][1:3] == (2, 1)
+    assert stats["dead"] >= 1
+
+    memory = outbox.MemorySink()
+    make_due()
+    dispatch([memory])
+    assert [event for event in memory.drain() if event["transaction"]["user_id"] == dave] == []
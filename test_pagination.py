@@ -0,0 +1,59 @@
+"""Keyset pagination of a user's transaction history
+
+Pages run newest-first by ``(created_at, id)``; following ``next_cursor``
+visits every row exactly once, even when rows share a timestamp, and
+the last page has no cursor.
+"""
+
+from datetime import datetime
+
+from database import SessionLocal
+from models import Transaction, TransactionType
+
+
+def walk(client, user_id: int, limit: int):
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/transactions/{user_id}", params=params)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        pages.append([row["id"] for row in body["transactions"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_history_once_newest_first(client, create_user):
+    user_id = create_user("page_walker", 1.0)
+    for amount in range(1, 7):
+        client.post(f"/wallet/{user_id}/add", params={"amount": amount})
+
+    pages = walk(client, user_id, limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    ids = [row_id for page in pages for row_id in page]
+    assert ids == sorted(ids, reverse=True) and len(set(ids)) == 7
+
+    # A history that fills its last page exactly ends without an empty page.
+    assert [len(page) for page in walk(client, user_id, limit=7)] == [7]
+
+
+def test_rows_sharing_a_timestamp_are_neither_skipped_nor_repeated(client, create_user):
+    user_id = create_user("page_ties")
+    at = datetime(2026, 1, 1, 12, 0, 0)
+    with SessionLocal() as db:
+        db.add_all([Transaction(user_id=user_id, transaction_type=TransactionType.CREDIT, amount=1.0, created_at=at)
+                    for _ in range(5)])
+        db.commit()
+    pages = walk(client, user_id, limit=2)
+    ids = [row_id for page in pages for row_id in page]
+    assert [len(page) for page in pages] == [2, 2, 1] and ids == sorted(set(ids), reverse=True)
+
+
+def test_bad_cursor_and_limits_are_rejected(client, create_user):
+    user_id = create_user("page_bad")
+    assert client.get(f"/transactions/{user_id}", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get(f"/transactions/{user_id}", params={"limit": 0}).status_code == 422
+    assert client.get(f"/transactions/{user_id}", params={"limit": 101}).status_code == 422
+    response = client.get(f"/transactions/{user_id}")
+    assert response.json() == {"transactions": [], "next_cursor": None}
@@ -0,0 +1,85 @@
+"""Per-endpoint SQL query budgets for the Digital Wallet API
+
+Each request's statement and commit counts come from the instrumentation
+middleware, so an N+1 regression on any of these routes fails here.
+"""
+
+import pytest
+
+import instrumentation
+from balance_cache import balance_cache
+
+
+@pytest.fixture(scope="module")
+def accounts(create_user):
+    return create_user("budget_alice", 500.0), create_user("budget_bob", 500.0)
+
+
+def assert_budget(response, statements: int, commits: int = 0):
+    assert response.status_code == 200, response.text
+    stats = instrumentation.registry.last_request
+    assert stats.statements <= statements, f"{stats.statements} statements, budget {statements}"
+    assert stats.commits <= commits, f"{stats.commits} commits, budget {commits}"
+
+
+def test_create_user_budget(client):
+    response = client.post("/users/", json={"username": "budget_carol", "email": "budget_carol@example.com",
+                                             "password": "x"})
+    assert_budget(response, statements=3, commits=1)
+
+
+def test_read_user_budget(client, accounts):
+    alice, _ = accounts
+    assert_budget(client.get(f"/users/{alice}"), statements=1)
+
+
+def test_balance_budget(client, accounts):
+    alice, _ = accounts
+    balance_cache.clear()
+    assert_budget(client.get(f"/wallet/{alice}/balance"), statements=1)
+    assert_budget(client.get(f"/wallet/{alice}/balance"), statements=0)
+
+
+def test_add_and_withdraw_budget(client, accounts):
+    alice, _ = accounts
+    # Balance update, ledger insert, outbox insert, refresh.
+    assert_budget(client.post(f"/wallet/{alice}/add", params={"amount": 10}), statements=4, commits=1)
+    assert_budget(client.post(f"/wallet/{alice}/withdraw", params={"amount": 5}), statements=4, commits=1)
+
+
+def test_transfer_budget(client, accounts):
+    alice, bob = accounts
+    response = client.post("/transfer/", params={"sender_id": alice, "recipient_id": bob, "amount": 1})
+    assert_budget(response, statements=6, commits=1)
+
+
+def test_transfer_detail_budget(client, accounts):
+    alice, bob = accounts
+    transfer = client.post("/transfer/", params={"sender_id": alice, "recipient_id": bob, "amount": 2}).json()["transaction"]
+    response = client.get(f"/transfers/{transfer['id']}/full")
+    assert_budget(response, statements=1)
+    detail = response.json()
+    assert detail["transfer_group"] == transfer["transfer_group"] is not None
+    assert (detail["sender"]["id"], detail["recipient"]["id"]) == (alice, bob)
+    assert detail["transfer_out"]["id"] == transfer["id"]
+    assert detail["transfer_in"]["user_id"] == bob
+    assert detail["transfer_in"]["transfer_group"] == transfer["transfer_group"]
+
+
+def test_history_page_budget(client, accounts):
+    _, bob = accounts
+    for _ in range(15):
+        client.post(f"/wallet/{bob}/add", params={"amount": 1})
+    first = client.get(f"/transactions/{bob}", params={"limit": 5})
+    assert_budget(first, statements=1)
+    second = client.get(f"/transactions/{bob}", params={"limit": 5, "cursor": first.json()["next_cursor"]})
+    assert_budget(second, statements=1)
+
+
+def test_batch_transfer_budget_is_independent_of_size(client, accounts):
+    alice, bob = accounts
+    transfers = [{"sender_id": (alice, bob)[i % 2], "recipient_id": (bob, alice)[i % 2], "amount": 1} for i in range(50)]
+    response = client.post("/transfers/batch", json={"transfers": transfers})
+    # Balance UPDATE, final-balance SELECT for balance_after, ledger INSERT, outbox INSERT.
+    assert_budget(response, statements=4, commits=1)
+    assert response.json()["succeeded"] == 50
@@ -0,0 +1,72 @@
+"""Read/write session split for the Digital Wallet API
+
+Read-only routes must be served by the read-only engines, except for a
+user this process has just written when the read-your-writes policy is
+in force.
+"""
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+import database
+from balance_cache import balance_cache
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.engine = engine.sync_engine if hasattr(engine, "sync_engine") else engine
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self)
+
+
+@pytest.fixture
+def user_id(request, create_user):
+    user_id = create_user(f"routing_{request.node.name}", 100.0)
+    database.recent_writes.clear()
+    balance_cache.clear()
+    return user_id
+
+
+def test_read_routes_use_read_engines(client, user_id):
+    with StatementCounter(database.async_read_engine) as reads, StatementCounter(database.async_engine) as writes:
+        assert client.get(f"/wallet/{user_id}/balance").status_code == 200
+        assert client.get(f"/transactions/{user_id}").status_code == 200
+    assert reads.count == 2
+    assert writes.count == 0
+
+    with StatementCounter(database.read_engine) as reads, StatementCounter(database.engine) as writes:
+        assert client.get(f"/users/{user_id}").status_code == 200
+    assert reads.count == 1
+    assert writes.count == 0
+
+
+def test_recent_write_reads_from_primary(client, user_id):
+    assert client.post(f"/wallet/{user_id}/add", params={"amount": 5}).status_code == 200
+    balance_cache.clear()
+    with StatementCounter(database.async_read_engine) as reads, StatementCounter(database.async_engine) as writes:
+        response = client.get(f"/wallet/{user_id}/balance")
+    assert response.json()["balance"] == 105.0
+    assert (reads.count, writes.count) == (0, 1)
+
+    database.recent_writes.clear()
+    with StatementCounter(database.async_read_engine) as reads:
+        client.get(f"/transactions/{user_id}")
+    assert reads.count == 1
+
+
+def test_read_engine_rejects_writes():
+    if database.read_engine is database.engine:
+        pytest.skip("no separate read engine for this DATABASE_URL")
+    with database.read_engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("UPDATE users SET balance = balance + 1"))
@@ -0,0 +1,69 @@
+"""Ledger reconciliation for the Digital Wallet API
+
+Balances moved through the API reconcile exactly; a balance changed
+behind the ledger's back is reported with its drift, serially and on a
+process pool alike.
+"""
+
+import pytest
+from sqlalchemy import update
+
+import db_config
+import hot_accounts
+import reconciliation
+from database import SessionLocal
+from models import User
+
+
+@pytest.fixture(scope="module")
+def accounts(client, create_user):
+    alice = create_user("reconcile_alice", 100.0)
+    bob = create_user("reconcile_bob", 0.0)
+    merchant = create_user("reconcile_merchant", 0.0)
+    with SessionLocal() as db:
+        hot_accounts.designate(db, merchant, slots=4)
+    client.post(f"/wallet/{alice}/add", params={"amount": 0.1})
+    client.post(f"/wallet/{alice}/add", params={"amount": 0.2})
+    client.post(f"/wallet/{alice}/withdraw", params={"amount": 30})
+    client.post("/transfer/", params={"sender_id": alice, "recipient_id": bob, "amount": 12.5})
+    client.post("/transfer/", params={"sender_id": alice, "recipient_id": merchant, "amount": 7})
+    client.post("/transfers/batch", json={"transfers": [{"sender_id": bob, "recipient_id": alice, "amount": 2.5}]})
+    yield alice, bob, merchant
+    with SessionLocal() as db:
+        hot_accounts.release(db, merchant)
+
+
+def drifts_of(report, user_ids):
+    return {drift["user_id"]: drift for drift in report["drifts"] if drift["user_id"] in user_ids}
+
+
+def test_api_balances_reconcile(accounts):
+    report = reconciliation.reconcile(db_config.DATABASE_URL, partition_size=2, workers=1)
+    assert drifts_of(report, accounts) == {}
+    assert report["users"] >= 3 and report["partitions"] >= 2
+
+
+def test_reports_drift(accounts):
+    alice, bob, merchant = accounts
+    with SessionLocal() as db:
+        db.execute(update(User).where(User.id == bob).values(balance=User.balance + 4.25))
+        db.commit()
+    try:
+        for workers in (1, 2):
+            report = reconciliation.reconcile(db_config.DATABASE_URL, partition_size=2, workers=workers)
+            drift = drifts_of(report, accounts)
+            assert list(drift) == [bob]
+            assert drift[bob]["drift"] == pytest.approx(4.25)
+            assert drift[bob]["by_type"] == {"TRANSFER_IN": 12.5, "TRANSFER_OUT": 2.5}
+    finally:
+        with SessionLocal() as db:
+            db.execute(update(User).where(User.id == bob).values(balance=User.balance - 4.25))
+            db.commit()
+
+
+def test_partition_covers_every_user():
+    engine = db_config.build_engine()
+    ranges = reconciliation.partitions(engine, size=3)
+    engine.dispose()
+    assert all(hi - lo <= 3 for lo, hi in ranges)
+    assert all(prev[1] == nxt[0] for prev, nxt in zip(ranges, ranges[1:]))
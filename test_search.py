@@ -0,0 +1,112 @@
+"""Transaction search for the Digital Wallet API
+
+Checks the filters of ``GET /transactions/{user_id}/search``, that the
+FTS index follows inserts, updates and deletes, and that no combination
+of filters makes SQLite scan the transactions table.
+"""
+
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, text
+
+import schemas
+import search
+from database import SessionLocal, engine
+from pagination import encode_cursor
+
+
+@pytest.fixture(scope="module")
+def accounts(client, create_user):
+    alice, bob, carol = (create_user(name, 1000.0) for name in ("search_alice", "search_bob", "search_carol"))
+    client.post(f"/wallet/{alice}/add", params={"amount": 25, "description": "Coffee beans refund"})
+    client.post(f"/wallet/{alice}/withdraw", params={"amount": 40, "description": "Grocery store"})
+    client.post("/transfer/", params={"sender_id": alice, "recipient_id": bob, "amount": 75, "description": "Rent share"})
+    client.post("/transfer/", params={"sender_id": carol, "recipient_id": alice, "amount": 12.5, "description": "Coffee"})
+    return alice, bob, carol
+
+
+def search_for(client, user_id, **params):
+    response = client.get(f"/transactions/{user_id}/search", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def descriptions(page):
+    return [row["description"] for row in page["transactions"]]
+
+
+def test_filters(client, accounts):
+    alice, bob, carol = accounts
+    assert descriptions(search_for(client, alice, type=["CREDIT", "DEBIT"])) == ["Grocery store", "Coffee beans refund"]
+    assert descriptions(search_for(client, alice, min_amount=30, max_amount=80)) == ["Rent share", "Grocery store"]
+    assert descriptions(search_for(client, alice, counterparty=carol)) == ["Coffee"]
+    assert descriptions(search_for(client, alice, counterparty=bob, type="TRANSFER_OUT")) == ["Rent share"]
+    assert descriptions(search_for(client, alice, q="coff")) == ["Coffee", "Coffee beans refund"]
+    assert descriptions(search_for(client, alice, q="coffee refund")) == ["Coffee beans refund"]
+    assert search_for(client, alice, **{"from": (datetime.utcnow() + timedelta(days=1)).isoformat()})["transactions"] == []
+
+
+def test_pagination(client, accounts):
+    alice = accounts[0]
+    first = search_for(client, alice, q="coffee", limit=1)
+    assert descriptions(first) == ["Coffee"]
+    second = search_for(client, alice, q="coffee", limit=1, cursor=first["next_cursor"])
+    assert descriptions(second) == ["Coffee beans refund"]
+    assert second["next_cursor"] is None
+
+
+def test_fts_follows_table(client, accounts):
+    alice = accounts[0]
+    with SessionLocal() as db:
+        db.execute(text("UPDATE transactions SET description = 'Groceries weekly' WHERE description = 'Grocery store'"))
+        db.commit()
+    assert descriptions(search_for(client, alice, q="weekly")) == ["Groceries weekly"]
+    assert search_for(client, alice, q="store")["transactions"] == []
+    with SessionLocal() as db:
+        db.execute(text("DELETE FROM transactions WHERE description = 'Groceries weekly'"))
+        db.commit()
+    assert search_for(client, alice, q="weekly")["transactions"] == []
+
+
+def test_fts_query_escapes_syntax():
+    assert search.fts_query('rent "share" OR') == '"rent"* AND """share"""* AND "OR"*'
+
+
+FILTER_VALUES = {
+    "types": [schemas.TransactionType.CREDIT, schemas.TransactionType.TRANSFER_IN],
+    "start": datetime(2024, 1, 1),
+    "end": datetime(2030, 1, 1),
+    "min_amount": 10.0,
+    "max_amount": 500.0,
+    "counterparty": 2,
+    "q": "coffee",
+}
+
+
+def query_plan(stmt):
+    """EXPLAIN QUERY PLAN details for ``stmt`` as SQLite would run it."""
+    captured = {}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.setdefault("sql", (statement, parameters))
+
+    with engine.connect() as conn:
+        event.listen(conn, "before_cursor_execute", capture)
+        conn.execute(stmt).all()
+        statement, parameters = captured["sql"]
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+    return [row[-1] for row in rows]
+
+
+@pytest.mark.parametrize("names", [
+    combo for size in range(len(FILTER_VALUES) + 1) for combo in itertools.combinations(FILTER_VALUES, size)
+], ids=lambda names: "+".join(names) or "none")
+@pytest.mark.parametrize("paged", [False, True], ids=["first", "next"])
+def test_no_full_scan(accounts, names, paged):
+    filters = schemas.TransactionSearch(**{name: FILTER_VALUES[name] for name in names})
+    cursor = encode_cursor(datetime(2029, 1, 1), 10 ** 9) if paged else None
+    plan = query_plan(search.search_stmt(1, filters, cursor, 10))
+    scans = [detail for detail in plan if detail.startswith("SCAN") and "VIRTUAL TABLE" not in detail]
+    assert not scans, plan
@@ -0,0 +1,72 @@
+"""scripts/seed_data.py
+
+The same seed loads the same rows whatever the worker count; every
+balance is the signed sum of its ledger, ``balance_after`` is the
+running sum, and transfers land as OUT/IN pairs.
+"""
+
+import os
+import sys
+import tempfile
+from collections import defaultdict
+
+import pytest
+from sqlalchemy import create_engine, select
+
+import schema
+from models import BALANCE_SIGN, Transaction, TransactionType, User
+from passwords import verify_password
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+
+import seed_data  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def opts():
+    return seed_data.generation_options(seed=7, days=30, mean_transactions=8.0)
+
+
+def loaded(opts, workers: int):
+    engine = create_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "seed.db"))
+    schema.upgrade(engine)
+    counts = seed_data.load(engine, 30, opts, block_size=10, chunk_size=7, workers=workers)
+    with engine.connect() as conn:
+        users = conn.execute(select(User.id, User.username, User.balance, User.hashed_password)
+                             .order_by(User.id)).all()
+        ledger = conn.execute(select(Transaction.user_id, Transaction.transaction_type, Transaction.amount,
+                                     Transaction.balance_after, Transaction.transfer_group,
+                                     Transaction.created_at).order_by(Transaction.id)).all()
+    engine.dispose()
+    return counts, users, ledger
+
+
+def test_same_seed_loads_same_rows_whatever_the_workers(opts):
+    single = loaded(opts, workers=1)
+    pooled = loaded(opts, workers=2)
+    assert single == pooled
+    assert single[0] == (30, len(single[2]))
+
+
+def test_ledgers_add_up(opts):
+    _, users, ledger = loaded(opts, workers=1)
+    running = defaultdict(float)
+    groups = defaultdict(list)
+    for user_id, kind, amount, balance_after, group, _ in ledger:
+        running[user_id] += BALANCE_SIGN[kind] * amount
+        assert balance_after == pytest.approx(running[user_id], abs=0.011)
+        assert running[user_id] >= -0.01
+        if group:
+            groups[group].append((kind, amount))
+    for user_id, _, balance, _ in users:
+        assert balance == pytest.approx(running[user_id], abs=0.011)
+    assert groups
+    for legs in groups.values():
+        assert {kind for kind, _ in legs} == {TransactionType.TRANSFER_OUT, TransactionType.TRANSFER_IN}
+        assert len(legs) == 2 and legs[0][1] == legs[1][1]
+
+
+def test_generated_users_share_one_hash_of_the_seed_password(opts):
+    _, users, _ = loaded(opts, workers=1)
+    assert {row.hashed_password for row in users} == {opts["password_hash"]}
+    assert verify_password(seed_data.SEED_PASSWORD, opts["password_hash"])
@@ -0,0 +1,61 @@
+"""Response encoding for the Digital Wallet API
+
+History and search pages are encoded from column-only rows into exactly
+the bytes Pydantic produces for ``schemas.TransactionPage``, and the
+mutation routes answer with the typed ``schemas.TransactionResult``.
+"""
+
+import pytest
+from sqlalchemy import select
+
+import schemas
+import serialization
+from database import SessionLocal
+from models import Transaction
+
+
+def pydantic_page(user_id: int, limit: int, ids=None) -> bytes:
+    """The body the route produced when it returned ORM objects through ``response_model``."""
+    with SessionLocal() as db:
+        stmt = select(Transaction).where(Transaction.user_id == user_id)
+        if ids is not None:
+            stmt = stmt.where(Transaction.id.in_(ids))
+        rows = db.scalars(stmt.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit)).all()
+        page = schemas.TransactionPage(transactions=[schemas.Transaction.model_validate(row) for row in rows])
+        return page.model_dump_json().encode()
+
+
+@pytest.fixture(scope="module")
+def users(client, create_user):
+    alice = create_user("serial_alice", 100.0)
+    bob = create_user("serial_bob", 0.0)
+    client.post(f"/wallet/{alice}/add", params={"amount": 0.1, "description": "café ☕ \"quoted\"\n"})
+    client.post(f"/wallet/{alice}/withdraw", params={"amount": 12.5})
+    client.post("/transfer/", params={"sender_id": alice, "recipient_id": bob, "amount": 1e-3})
+    return alice, bob
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_pages_match_pydantic_bytes(client, users, monkeypatch, fast):
+    if not fast:
+        monkeypatch.setattr(serialization, "orjson", None)
+    alice, bob = users
+    for user_id in (alice, bob):
+        response = client.get(f"/transactions/{user_id}", params={"limit": 100})
+        assert response.headers["content-type"] == "application/json"
+        assert response.content == pydantic_page(user_id, 100)
+    found = client.get(f"/transactions/{alice}/search", params={"q": "café"})
+    ids = [row["id"] for row in found.json()["transactions"]]
+    assert len(ids) == 1
+    assert found.content == pydantic_page(alice, 100, ids)
+
+
+def test_mutations_return_typed_results(client, users):
+    alice, _ = users
+    first = client.post(f"/wallet/{alice}/add", params={"amount": 2}, headers={"Idempotency-Key": "serial-add"})
+    replay = client.post(f"/wallet/{alice}/add", params={"amount": 2}, headers={"Idempotency-Key": "serial-add"})
+    assert first.status_code == replay.status_code == 200
+    assert first.content == replay.content
+    body = first.json()
+    assert list(body) == ["message", "transaction"]
+    assert tuple(body["transaction"]) == serialization.TRANSACTION_FIELDS
@@ -0,0 +1,63 @@
+"""The async wallet, transaction and transfer routes
+
+Lookups by id, recording a transaction, the transfer leg lookup, and
+concurrent debits on the async sessions never overdrawing an account.
+"""
+
+import asyncio
+
+from fastapi import HTTPException
+
+import async_crud
+from database import AsyncSessionLocal
+
+
+def test_transfer_legs_are_looked_up_by_id(client, create_user):
+    alice = create_user("txn_alice", 20.0)
+    bob = create_user("txn_bob", 0.0)
+    transfer = client.post("/transfer/", params={"sender_id": alice, "recipient_id": bob, "amount": 8,
+                                                 "description": "rent"})
+    assert transfer.status_code == 200 and transfer.json()["message"] == "Transfer successful"
+    out_leg = transfer.json()["transaction"]
+    assert (out_leg["user_id"], out_leg["transaction_type"], out_leg["recipient_user_id"]) == (alice, "TRANSFER_OUT", bob)
+
+    assert client.get(f"/transaction/{out_leg['id']}").json() == out_leg
+    assert client.get(f"/transfer/{out_leg['id']}").json() == out_leg
+    detail = client.get(f"/transfers/{out_leg['id']}/full").json()
+    assert detail["transfer_in"]["user_id"] == bob and detail["transfer_in"]["description"] == "rent"
+
+    deposit = client.get(f"/transactions/{alice}").json()["transactions"][-1]
+    assert deposit["transaction_type"] == "DEPOSIT"
+    assert client.get(f"/transfer/{deposit['id']}").status_code == 404
+    assert client.get("/transaction/999999").status_code == 404
+    assert client.get("/transfer/999999").status_code == 404
+
+
+def test_create_transaction_records_a_row(client, create_user):
+    user_id = create_user("txn_record")
+    response = client.post("/transactions/", json={"user_id": user_id, "transaction_type": "PAYMENT", "amount": 3.5,
+                                                   "description": "coffee"})
+    assert response.status_code == 200
+    created = response.json()
+    assert (created["user_id"], created["amount"], created["description"]) == (user_id, 3.5, "coffee")
+    assert client.get(f"/transaction/{created['id']}").json() == created
+    assert client.post("/transactions/", json={"user_id": user_id + 10_000, "transaction_type": "PAYMENT",
+                                               "amount": 1}).status_code == 404
+
+
+def test_concurrent_withdrawals_never_overdraw(client, create_user):
+    user_id = create_user("txn_race", 10.0)
+
+    async def withdraw():
+        async with AsyncSessionLocal() as db:
+            try:
+                return await async_crud.withdraw_money(db, user_id=user_id, amount=3.0)
+            except HTTPException as exc:
+                return exc.status_code
+
+    async def race():
+        return await asyncio.gather(*(withdraw() for _ in range(6)))
+
+    results = asyncio.run(race())
+    assert sum(1 for result in results if result == 400) == 3
+    assert client.get(f"/wallet/{user_id}/balance").json()["balance"] == 1.0
@@ -0,0 +1,59 @@
+"""Amount checks on the atomic balance mutations of the Digital Wallet API
+
+Adds, withdrawals and transfers are conditional UPDATEs; an amount they
+cannot move is rejected before any row is touched, and a debit the
+balance does not cover leaves it unchanged.
+"""
+
+import json
+
+import pytest
+
+
+def balance(client, user_id: int) -> float:
+    return client.get(f"/wallet/{user_id}/balance").json()["balance"]
+
+
+@pytest.mark.parametrize("amount, detail", [
+    ("inf", "Amount must be a finite number"),
+    ("-inf", "Amount must be a finite number"),
+    ("nan", "Amount must be a finite number"),
+    ("0", "Amount must be positive"),
+    ("-5", "Amount must be positive"),
+])
+def test_unmovable_amounts_are_rejected(client, create_user, amount, detail):
+    sender = create_user(f"mutation_sender_{amount}", 100.0)
+    recipient = create_user(f"mutation_recipient_{amount}", 100.0)
+    for response in (
+        client.post(f"/wallet/{sender}/add", params={"amount": amount}),
+        client.post(f"/wallet/{sender}/withdraw", params={"amount": amount}),
+        client.post("/transfer/", params={"sender_id": sender, "recipient_id": recipient, "amount": amount}),
+    ):
+        assert response.status_code == 400 and response.json()["detail"] == detail
+    assert balance(client, sender) == 100.0 and balance(client, recipient) == 100.0
+
+
+def test_non_finite_batch_item_fails_alone(client, create_user):
+    sender = create_user("mutation_batch_sender", 100.0)
+    recipient = create_user("mutation_batch_recipient", 0.0)
+    body = {"mode": "best_effort", "transfers": [
+        {"sender_id": sender, "recipient_id": recipient, "amount": float("inf")},
+        {"sender_id": sender, "recipient_id": recipient, "amount": 10.0},
+    ]}
+    response = client.post("/transfers/batch", content=json.dumps(body), headers={"Content-Type": "application/json"})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["status"] == "failed" and results[0]["detail"] == "Amount must be a finite number"
+    assert results[1]["status"] == "success"
+    assert balance(client, sender) == 90.0 and balance(client, recipient) == 10.0
+
+
+def test_uncovered_debit_leaves_balance_unchanged(client, create_user):
+    user_id = create_user("mutation_short", 5.0)
+    other = create_user("mutation_short_other", 0.0)
+    response = client.post(f"/wallet/{user_id}/withdraw", params={"amount": 5.01})
+    assert response.status_code == 400 and response.json()["detail"] == "Insufficient balance"
+    response = client.post("/transfer/", params={"sender_id": user_id, "recipient_id": other, "amount": 6})
+    assert response.status_code == 400 and response.json()["detail"] == "Insufficient balance"
+    assert balance(client, user_id) == 5.0 and balance(client, other) == 0.0
+    assert client.post(f"/wallet/{user_id + 10_000}/add", params={"amount": 1}).status_code == 404